@@ -0,0 +1,5 @@
+"""
+Benchmarks for the backend. Run them from the backend directory, e.g.
+
+    python -m benchmarks.wire_protocol
+"""
@@ -0,0 +1,85 @@
+"""
+How many chat sockets one worker process holds within a latency budget, with the chat database
+writes on the shared sync_to_async thread (--db-workers 0) versus on the dedicated executor
+(chatapp/dbexecutor.py).
+
+Every step is a fresh benchmarks.ws_load run in its own process, so each setting starts from a
+clean interpreter and database. Steps grow the number of conversations until the connect or
+round trip p95 goes over budget (or messages fail); the last step within budget is the density.
+
+    python -m benchmarks.chat_density [--workers 0 8] [--conversations 50 100 200 400]
+                                      [--query-latency 1] [--p95-ms 1000] [--output results.json]
+"""
+import argparse, json, subprocess, sys, tempfile
+
+
+def measure(conversations, workers, args):
+    with tempfile.NamedTemporaryFile(suffix='.json') as output:
+        command = [
+            sys.executable, '-m', 'benchmarks.ws_load',
+            '--conversations', str(conversations),
+            '--messages', str(args.messages),
+            '--rate', str(args.rate),
+            '--concurrency', str(args.concurrency),
+            '--memory-connections', '0',
+            '--db-workers', str(workers),
+            '--query-latency', str(args.query_latency),
+            '--output', output.name,
+        ]
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        with open(output.name) as handle:
+            return json.load(handle)
+
+
+def within_budget(result, args):
+    return (
+        not result['failures']
+        and result['round_trip_ms'] is not None
+        and result['connect_ms']['p95'] <= args.p95_ms
+        and result['round_trip_ms']['p95'] <= args.p95_ms
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 8], help='CHAT_DB_EXECUTOR workers to compare, 0 is the shared thread.')
+    parser.add_argument('--conversations', type=int, nargs='+', default=[50, 100, 200, 400], help='Steps, each conversation is two sockets.')
+    parser.add_argument('--messages', type=int, default=10, help='Messages sent per conversation.')
+    parser.add_argument('--rate', type=float, default=2, help='Messages per second per conversation.')
+    parser.add_argument('--concurrency', type=int, default=50, help='Sockets connecting at the same time.')
+    parser.add_argument('--query-latency', type=float, default=1, help='Milliseconds added to every query, to stand in for a database server.')
+    parser.add_argument('--p95-ms', type=float, default=1000, help='Connect and round trip p95 budget.')
+    parser.add_argument('--output', help='Write the results to this JSON file as well.')
+    args = parser.parse_args()
+
+    results = {'budget_p95_ms': args.p95_ms, 'query_latency_ms': args.query_latency, 'workers': {}}
+    print(f"{'workers':<9}{'sockets':>9}{'connect p95':>13}{'round trip p95':>16}{'msgs/s':>9}{'failures':>10}")
+    for workers in args.workers:
+        steps, density = [], 0
+        for conversations in args.conversations:
+            result = measure(conversations, workers, args)
+            ok = within_budget(result, args)
+            steps.append({
+                'sockets': result['config']['sockets'],
+                'connect_p95_ms': result['connect_ms']['p95'],
+                'round_trip_p95_ms': result['round_trip_ms']['p95'] if result['round_trip_ms'] else None,
+                'messages_per_second': result['messages_per_second'],
+                'failures': len(result['failures']),
+                'within_budget': ok,
+            })
+            step = steps[-1]
+            print(f"{workers:<9}{step['sockets']:>9}{step['connect_p95_ms']:>13}{str(step['round_trip_p95_ms']):>16}"
+                  f"{str(step['messages_per_second']):>9}{step['failures']:>10}")
+            if not ok:
+                break
+            density = step['sockets']
+        results['workers'][str(workers)] = {'steps': steps, 'sockets_within_budget': density}
+
+    print(', '.join(f"workers={workers}: {result['sockets_within_budget']} sockets" for workers, result in results['workers'].items()))
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,384 @@
+"""
+HTTP API benchmark and regression suite.
+
+Seeds a synthetic marketplace (users, products with images, interests, likes, reviews and
+conversations with messages) into a throwaway SQLite database, then calls every route in
+products.urls, user.urls and chatapp.urls through the Django test client. Each endpoint records
+its latency distribution and the number of SQL queries per request, and is checked against the
+budget declared for it in ENDPOINTS below.
+
+The run fails (exit status 1) when an endpoint goes over its query or latency budget, answers
+with an unexpected status, or when a route has no endpoint here at all. Query budgets are exact
+regression limits. Latency depends on the machine, so --latency-factor scales those budgets
+and 0 turns them off.
+
+Runs offline: no Redis, Postgres or network is needed.
+
+    python -m benchmarks.http_api [--scale 1.0] [--iterations 20] [--latency-factor 1.0]
+                                  [--only search] [--output results.json]
+"""
+import argparse, datetime, io, json, math, os, random, sys, tempfile, time
+
+
+def setup_django(directory):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swappynest.settings')
+    os.environ.setdefault('SECRET_KEY', 'http-benchmark')
+    os.environ['DATABASE_ENGINE'] = 'django.db.backends.sqlite3'
+    os.environ['DATABASE_NAME'] = os.path.join(directory, 'http_api.sqlite3')
+    os.environ['CHAT_WRITE_BEHIND'] = 'false'
+    # Request profiling adds its own overhead, REQUEST_PROFILING=true measures with it
+    os.environ.setdefault('REQUEST_PROFILING', 'false')
+
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+
+    settings.ALLOWED_HOSTS = ['*']
+    settings.MEDIA_ROOT = os.path.join(directory, 'media')
+    settings.SEARCH_INDEX_DIR = os.path.join(directory, 'search_index')
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+# ---------------------------------------------------------------------------- seeding
+
+WORDS = (
+    'vintage acoustic guitar leather jacket wooden desk lamp camera lens mountain bike novel '
+    'paperback hardcover ceramic vase running shoes watch strap vinyl record console controller '
+    'garden hose kettle blender yoga mat tent backpack puzzle board game sofa chair mirror'
+).split()
+
+
+class Marketplace:
+    """Ids of the seeded rows the endpoints need."""
+
+    def __init__(self, scale, seed=7):
+        self.scale = scale
+        self.rng = random.Random(seed)
+
+    def count(self, number):
+        return max(int(number * self.scale), 1)
+
+    def seed(self):
+        from django.core.management import call_command
+        from django.db import transaction
+        from chatapp.models import Conversation, Message
+        from products.models import Product, Image, Interest, Like
+        from products.search import search_index
+        from user.models import UserAccount, UserReview
+
+        rng = self.rng
+        categories = [choice for choice, _ in Product.CATEGORY_CHOICES]
+        now = datetime.datetime.now(datetime.timezone.utc)
+
+        with transaction.atomic():
+            users = UserAccount.objects.bulk_create(
+                UserAccount(
+                    email=f'user{number}@example.com', username=f'user{number}',
+                    firstname='Bench', lastname=f'User{number}', password='!',
+                )
+                for number in range(self.count(2000))
+            )
+            user_ids = [user.id for user in users]
+            self.viewer, self.other = users[0], users[1]
+
+            products = Product.objects.bulk_create(
+                Product(
+                    user_id=rng.choice(user_ids),
+                    productname=' '.join(rng.sample(WORDS, 3)).title(),
+                    description=' '.join(rng.choices(WORDS, k=20)),
+                    purchaseyear=datetime.date(rng.randint(2010, 2024), 1, 1),
+                    condition=rng.choice(['new', 'good', 'used']),
+                    category=rng.choice(categories),
+                )
+                for _ in range(self.count(20000))
+            )
+            product_ids = [product.id for product in products]
+            self.product_id = product_ids[0]
+
+            Image.objects.bulk_create(
+                Image(product_id=product_id, image=f'products/seed-{product_id}-{number}.jpg')
+                for product_id in product_ids
+                for number in range(rng.randint(1, 3))
+            )
+            Interest.objects.bulk_create(
+                Interest(user_id=user_id, interested_products=rng.sample(categories, 3))
+                for user_id in user_ids
+            )
+            likes = {user_id: rng.sample(product_ids, rng.randint(0, 40)) for user_id in user_ids}
+            # The viewer gets a full page of everything
+            Interest.objects.filter(user=self.viewer).update(interested_products=['books', 'music', 'electronics'])
+            likes[self.viewer.id] = rng.sample(product_ids, 40)
+            Like.objects.bulk_create(
+                Like(user_id=user_id, product_id=product_id)
+                for user_id, liked in likes.items()
+                for product_id in liked
+            )
+
+            reviews = {(rng.choice(user_ids), rng.choice(user_ids)) for _ in range(self.count(5000))}
+            reviews |= {(self.viewer.id, reviewer) for reviewer in user_ids[2:22]}
+            reviews |= {(reviewed, self.viewer.id) for reviewed in user_ids[2:22]}
+            UserReview.objects.bulk_create(
+                UserReview(reviewed_user_id=reviewed, reviewer_id=reviewer, rating=rng.randint(1, 5), content='Smooth swap')
+                for reviewed, reviewer in reviews if reviewed != reviewer
+            )
+
+            pairs = {tuple(sorted(rng.sample(user_ids, 2))) for _ in range(self.count(2000))}
+            pairs |= {tuple(sorted((self.viewer.id, other))) for other in user_ids[1:31]}
+            conversations = Conversation.objects.bulk_create(
+                Conversation(user_low_id=low, user_high_id=high, last_message_at=now) for low, high in sorted(pairs)
+            )
+            through = Conversation.participants.through
+            through.objects.bulk_create(
+                through(conversation_id=conversation.id, useraccount_id=user_id)
+                for conversation in conversations
+                for user_id in (conversation.user_low_id, conversation.user_high_id)
+            )
+            messages = []
+            for conversation in conversations:
+                ends = (conversation.user_low_id, conversation.user_high_id)
+                for number in range(rng.randint(1, 20)):
+                    sender = rng.choice(ends)
+                    messages.append(Message(
+                        conversation_id=conversation.id,
+                        sender_id=sender,
+                        receiver_id=ends[0] if sender == ends[1] else ends[1],
+                        content=' '.join(rng.choices(WORDS, k=8)),
+                        timestamp=now - datetime.timedelta(minutes=number),
+                    ))
+            Message.objects.bulk_create(messages, batch_size=5000)
+            self.conversation_id = next(
+                conversation.id for conversation in conversations if self.viewer.id in (conversation.user_low_id, conversation.user_high_id)
+            )
+
+        call_command('reconcile_unread_counts', stdout=io.StringIO())
+        # Fills in like_count from the Like rows above
+        call_command('migrate_liked_products', stdout=io.StringIO())
+        search_index.build(Product.objects.only('id', 'productname', 'description').iterator())
+
+        return {
+            'users': len(users),
+            'products': len(products),
+            'images': Image.objects.count(),
+            'reviews': UserReview.objects.count(),
+            'conversations': len(conversations),
+            'messages': len(messages),
+        }
+
+
+# -------------------------------------------------------------------------- endpoints
+
+def png(name='photo.png'):
+    from django.core.files.uploadedfile import SimpleUploadedFile
+    from PIL import Image as PILImage
+
+    buffer = io.BytesIO()
+    PILImage.new('RGB', (64, 48), (200, 120, 40)).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class Endpoint:
+    """
+    One call to benchmark. ``path`` and ``data`` are functions of the seeded marketplace and the
+    iteration number, so write endpoints can use fresh rows on every call.
+    """
+
+    def __init__(self, name, route, path, max_queries, p95_ms, method='get', data=None, format=None,
+                 auth=True, status=200):
+        self.name = name
+        self.route = route
+        self.path = path
+        self.max_queries = max_queries
+        self.p95_ms = p95_ms
+        self.method = method
+        self.data = data
+        self.format = format
+        self.auth = auth
+        self.status = status
+
+
+ENDPOINTS = [
+    # products.urls
+    Endpoint('upload product', 'api/products/uploadproduct/', lambda m, i: '/api/products/uploadproduct/', 8, 150,
+             method='post', format='multipart', data=lambda m, i: {
+                 'productname': f'Bench guitar {i}', 'description': 'Acoustic guitar', 'purchaseyear': '2020-01-01',
+                 'condition': 'good', 'category': 'music', 'interested_products': '["books"]',
+                 'images': [png(), png()],
+             }),
+    Endpoint('like product', 'api/products/likeproduct/', lambda m, i: '/api/products/likeproduct/', 7, 50,
+             method='post', format='json', data=lambda m, i: {'product_id': m.product_id}),
+    Endpoint('liked products', 'api/products/listlikedproducts/', lambda m, i: '/api/products/listlikedproducts/', 4, 150),
+    Endpoint('search', 'api/products/search/', lambda m, i: f'/api/products/search/?q={WORDS[i % len(WORDS)]}+guitar', 2, 150,
+             auth=False),
+    Endpoint('similar products', 'api/products/similar/<int:id>/', lambda m, i: f'/api/products/similar/{m.product_id + i}/', 2, 150,
+             auth=False),
+    Endpoint('feed', 'api/products/listallproduct/', lambda m, i: f'/api/products/listallproduct/?seed={i}', 5, 150),
+    Endpoint('feed page 3', 'api/products/listallproduct/', lambda m, i: f'/api/products/listallproduct/?seed={i}&page=3', 5, 150),
+    Endpoint('interest', 'api/products/interest/', lambda m, i: '/api/products/interest/', 1, 30),
+    Endpoint('category', 'api/products/<slug:slug>/', lambda m, i: '/api/products/books/', 3, 100, auth=False),
+    Endpoint('category page 10', 'api/products/<slug:slug>/', lambda m, i: '/api/products/music/?page=10', 3, 100, auth=False),
+    Endpoint('category viewer', 'api/products/<slug:slug>/', lambda m, i: '/api/products/books/', 4, 100),
+
+    # user.urls
+    # Mostly password hashing
+    Endpoint('sign up', 'api/user/signup/', lambda m, i: '/api/user/signup/', 4, 1000,
+             method='post', format='json', auth=False, data=lambda m, i: {
+                 'email': f'newcomer{i}-{m.run}@example.com', 'username': f'newcomer{i}', 'firstname': 'New',
+                 'lastname': 'Comer', 'password': 'Correct-Horse-42', 'password1': 'Correct-Horse-42',
+                 'profilephoto': '', 'phone': '', 'address': '',
+             }),
+    Endpoint('profile', 'api/user/profile/<int:id>/', lambda m, i: f'/api/user/profile/{m.other.id}/', 1, 30, auth=False),
+    Endpoint('update profile', 'api/user/profile/<int:id>/', lambda m, i: f'/api/user/profile/{m.viewer.id}/', 6, 100,
+             method='put', format='multipart', data=lambda m, i: {'firstname': f'Bench{i}', 'profilephoto': png()}),
+    Endpoint('user products', 'api/user/<int:id>/products', lambda m, i: f'/api/user/{m.other.id}/products', 3, 100, auth=False),
+    Endpoint('user products viewer', 'api/user/<int:id>/products', lambda m, i: f'/api/user/{m.other.id}/products', 4, 100),
+    Endpoint('create review', 'api/user/createreview/', lambda m, i: '/api/user/createreview/', 5, 50,
+             method='post', format='json', data=lambda m, i: {'reviewed_user': m.other.email, 'rating': 1 + i % 5, 'content': 'Great'}),
+    Endpoint('reviews for user', 'api/user/foruserreviewlist/<int:user_id>/', lambda m, i: f'/api/user/foruserreviewlist/{m.viewer.id}/', 2, 50,
+             auth=False),
+    Endpoint('reviews by user', 'api/user/byuserreviewlist/<int:user_id>/', lambda m, i: f'/api/user/byuserreviewlist/{m.viewer.id}/', 1, 50),
+
+    # chatapp.urls
+    Endpoint('conversations', 'api/chatapp/conversations/', lambda m, i: '/api/chatapp/conversations/', 3, 100),
+    Endpoint('messages', 'api/chatapp/conversations/<int:conversation_id>/messages/',
+             lambda m, i: f'/api/chatapp/conversations/{m.conversation_id}/messages/', 3, 50),
+]
+
+
+def routes():
+    """Every route of the benchmarked url modules, as it appears under swappynest.urls."""
+    from django.urls import URLPattern, URLResolver
+    import swappynest.urls
+
+    found = []
+
+    def walk(patterns, prefix):
+        for pattern in patterns:
+            if isinstance(pattern, URLResolver):
+                walk(pattern.url_patterns, prefix + str(pattern.pattern))
+            elif isinstance(pattern, URLPattern):
+                found.append(prefix + str(pattern.pattern))
+
+    for pattern in swappynest.urls.urlpatterns:
+        if isinstance(pattern, URLResolver) and getattr(pattern.urlconf_module, '__name__', '') in ('products.urls', 'user.urls', 'chatapp.urls'):
+            walk(pattern.url_patterns, str(pattern.pattern))
+    return found
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def measure(endpoint, marketplace, iterations, warmup):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.test import APIClient
+
+    client = APIClient()
+    if endpoint.auth:
+        client.force_authenticate(marketplace.viewer)
+
+    latencies, queries, statuses = [], [], set()
+    for iteration in range(warmup + iterations):
+        path = endpoint.path(marketplace, iteration)
+        kwargs = {}
+        if endpoint.data is not None:
+            kwargs['data'] = endpoint.data(marketplace, iteration)
+        if endpoint.format is not None:
+            kwargs['format'] = endpoint.format
+
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            response = getattr(client, endpoint.method)(path, **kwargs)
+            elapsed = (time.perf_counter() - start) * 1000
+        statuses.add(response.status_code)
+        if iteration >= warmup:
+            latencies.append(elapsed)
+            queries.append(len(captured))
+
+    return {
+        'name': endpoint.name,
+        'route': endpoint.route,
+        'method': endpoint.method.upper(),
+        'statuses': sorted(statuses),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50), 2),
+            'p95': round(percentile(latencies, 95), 2),
+            'p99': round(percentile(latencies, 99), 2),
+            'max': round(max(latencies), 2),
+        },
+        'queries': {'min': min(queries), 'max': max(queries)},
+        'budget': {'max_queries': endpoint.max_queries, 'p95_ms': endpoint.p95_ms},
+    }
+
+
+def check(result, endpoint, latency_factor):
+    problems = []
+    if result['statuses'] != [endpoint.status]:
+        problems.append(f"answered {result['statuses']}, expected {endpoint.status}")
+    if result['queries']['max'] > endpoint.max_queries:
+        problems.append(f"{result['queries']['max']} queries, budget {endpoint.max_queries}")
+    if latency_factor and result['latency_ms']['p95'] > endpoint.p95_ms * latency_factor:
+        problems.append(f"p95 {result['latency_ms']['p95']} ms, budget {endpoint.p95_ms * latency_factor:g} ms")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier on the seeded row counts (1.0 is 2000 users, 20000 products).')
+    parser.add_argument('--iterations', type=int, default=20, help='Measured requests per endpoint.')
+    parser.add_argument('--warmup', type=int, default=2, help='Requests per endpoint before measuring.')
+    parser.add_argument('--latency-factor', type=float, default=1.0, help='Multiplier on the latency budgets, 0 ignores them.')
+    parser.add_argument('--only', help='Only run the endpoints whose name contains this text.')
+    parser.add_argument('--output', help='Write the results to this JSON file as well.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(directory)
+
+        uncovered = sorted(set(routes()) - {endpoint.route for endpoint in ENDPOINTS})
+
+        marketplace = Marketplace(args.scale)
+        marketplace.run = os.urandom(4).hex()
+        start = time.perf_counter()
+        seeded = marketplace.seed()
+        seeded['seconds'] = round(time.perf_counter() - start, 1)
+        print(f'Seeded {seeded}', file=sys.stderr)
+
+        results, failures = [], {}
+        print(f"{'endpoint':<22}{'method':<8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'queries':>9}  budget")
+        for endpoint in ENDPOINTS:
+            if args.only and args.only not in endpoint.name:
+                continue
+            result = measure(endpoint, marketplace, args.iterations, args.warmup)
+            problems = check(result, endpoint, args.latency_factor)
+            result['problems'] = problems
+            results.append(result)
+            if problems:
+                failures[endpoint.name] = problems
+            latency = result['latency_ms']
+            print(
+                f"{endpoint.name:<22}{result['method']:<8}{latency['p50']:>9}{latency['p95']:>9}{latency['p99']:>9}"
+                f"{result['queries']['max']:>9}  {endpoint.max_queries} queries, {endpoint.p95_ms} ms"
+                + ('  FAIL: ' + '; '.join(problems) if problems else '')
+            )
+
+        # Uploaded photos are still being resized, and saved products indexed, in the background,
+        # and their files go with the directory
+        from products.imaging import image_processor
+        from products.search import search_updates
+        image_processor.shutdown()
+        search_updates.shutdown()
+
+    for route in uncovered:
+        print(f'No endpoint benchmarks route {route}')
+    report = {'seeded': seeded, 'endpoints': results, 'failures': failures, 'uncovered_routes': uncovered}
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(report, handle, indent=2)
+    sys.exit(1 if failures or uncovered else 0)
+
+
+if __name__ == '__main__':
+    main()
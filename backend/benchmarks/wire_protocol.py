@@ -0,0 +1,121 @@
+"""
+Compares the JSON and msgpack chat wire formats (chatapp/protocol.py): frame size and the CPU
+time to encode and decode the frames a busy server sends, plus what that costs per second of
+wall time at a few message rates.
+
+    python -m benchmarks.wire_protocol [--frames 20000] [--json results.json]
+"""
+import argparse, json, random, string, time, uuid
+from chatapp.protocol import JsonCodec, MsgpackCodec
+
+
+def chat_message(rng):
+    # Chat messages are mostly short, with the odd long one or shared product card
+    length = rng.choice([8, 20, 40, 80, 200, 600])
+    return {
+        'id': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+        'sender_id': rng.randint(1, 50000),
+        'receiver_id': rng.randint(1, 50000),
+        'content': ''.join(rng.choice(string.ascii_letters + ' ') for _ in range(length)),
+        'timestamp': time.time() - rng.random() * 3600,
+    }
+
+
+def chat_list_update(rng, message):
+    participants = [
+        {'id': user_id, 'username': f'user{user_id}', 'profilephoto': f'/media/blobs/{user_id:x}.jpg'}
+        for user_id in (message['sender_id'], message['receiver_id'])
+    ]
+    return {
+        'type': 'update_conversations',
+        'conversations': [{
+            'id': rng.randint(1, 100000),
+            'participants': participants,
+            'last_message': message['content'],
+            'timestamp': message['timestamp'],
+        }],
+    }
+
+
+def build_frames(count, seed=1):
+    rng = random.Random(seed)
+    frames = []
+    for _ in range(count):
+        message = chat_message(rng)
+        # Every message goes to the conversation and to a chat list
+        frames.append(message)
+        frames.append(chat_list_update(rng, message))
+    return frames
+
+
+def stamped(codec, frame):
+    # The consumers put timestamps in the codec's form as they build the frame, see ChatConsumer.chat_message
+    if 'conversations' in frame:
+        return dict(frame, conversations=[codec.stamp(conversation) for conversation in frame['conversations']])
+    return codec.stamp(frame)
+
+
+def measure(codec, frames, repeat):
+    encoded = [codec.encode(stamped(codec, frame)) for frame in frames]
+    key = 'bytes_data' if codec.binary else 'text_data'
+    size = sum(len(frame.encode() if isinstance(frame, str) else frame) for frame in encoded)
+
+    encode_times, decode_times = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for frame in frames:
+            codec.encode(stamped(codec, frame))
+        encode_times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for frame in encoded:
+            codec.decode(**{key: frame})
+        decode_times.append(time.perf_counter() - start)
+
+    count = len(frames)
+    return {
+        'frames': count,
+        'mean_frame_bytes': round(size / count, 1),
+        'encode_us_per_frame': round(min(encode_times) / count * 1e6, 3),
+        'decode_us_per_frame': round(min(decode_times) / count * 1e6, 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--frames', type=int, default=10000, help='Messages to generate (each gives two frames).')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per codec, the fastest one counts.')
+    parser.add_argument('--rates', type=int, nargs='+', default=[100, 1000, 10000], help='Messages per second to cost out.')
+    parser.add_argument('--json', dest='output', help='Also write the results to this file.')
+    args = parser.parse_args()
+
+    frames = build_frames(args.frames)
+    results = {'codecs': {}, 'rates': args.rates}
+    for name, codec in (('json', JsonCodec()), ('msgpack', MsgpackCodec())):
+        result = measure(codec, frames, args.repeat)
+        # Each message is encoded twice (conversation + chat list) on the server and decoded on the clients
+        per_message_us = 2 * (result['encode_us_per_frame'] + result['decode_us_per_frame'])
+        result['cpu_share_at_rate'] = {str(rate): round(per_message_us * rate / 1e6, 4) for rate in args.rates}
+        result['bytes_per_second_at_rate'] = {str(rate): round(2 * result['mean_frame_bytes'] * rate) for rate in args.rates}
+        results['codecs'][name] = result
+
+    json_result, msgpack_result = results['codecs']['json'], results['codecs']['msgpack']
+    results['msgpack_vs_json'] = {
+        'size_ratio': round(msgpack_result['mean_frame_bytes'] / json_result['mean_frame_bytes'], 3),
+        'encode_speedup': round(json_result['encode_us_per_frame'] / msgpack_result['encode_us_per_frame'], 2),
+        'decode_speedup': round(json_result['decode_us_per_frame'] / msgpack_result['decode_us_per_frame'], 2),
+    }
+
+    print(f"{'codec':<10}{'bytes/frame':>14}{'encode us':>12}{'decode us':>12}" + ''.join(f'{f"cpu@{rate}/s":>14}' for rate in args.rates))
+    for name, result in results['codecs'].items():
+        shares = ''.join(f"{result['cpu_share_at_rate'][str(rate)] * 100:>13.2f}%" for rate in args.rates)
+        print(f"{name:<10}{result['mean_frame_bytes']:>14}{result['encode_us_per_frame']:>12}{result['decode_us_per_frame']:>12}{shares}")
+    print(f"msgpack vs json: {results['msgpack_vs_json']}")
+
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,271 @@
+"""
+WebSocket load test for the chat consumers.
+
+Drives swappynest.asgi.application in process, with the in-memory channel layer and a throwaway
+SQLite database, so it needs neither Redis nor Postgres. Pairs of users open a ChatConsumer
+socket each, and one side of every pair sends messages that the other side waits for.
+
+Reported: connect latency and message round trip (send until the other participant has the
+frame) at p50/p95/p99, messages per second, database queries per message, and the memory one
+open socket holds.
+
+    python -m benchmarks.ws_load [--conversations 50] [--messages 20] [--rate 0] [--msgpack]
+                                 [--write-behind] [--db-workers 8] [--query-latency 0]
+                                 [--output results.json]
+"""
+import argparse, asyncio, gc, json, math, os, tempfile, threading, time, tracemalloc
+
+
+def setup_django(database, write_behind, db_workers=None):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swappynest.settings')
+    os.environ.setdefault('SECRET_KEY', 'ws-load-test')
+    os.environ['DATABASE_ENGINE'] = 'django.db.backends.sqlite3'
+    os.environ['DATABASE_NAME'] = database
+    os.environ['CHAT_WRITE_BEHIND'] = 'true' if write_behind else 'false'
+    if db_workers is not None:
+        os.environ['CHAT_DB_WORKERS'] = str(db_workers)
+
+    import django
+    django.setup()
+    from django.conf import settings
+    from django.core.management import call_command
+
+    settings.CHANNEL_LAYERS = {
+        'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 1000}},
+    }
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def percentiles(values):
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p):
+        return round(ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)], 3)
+
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 3),
+        'p50': rank(50),
+        'p95': rank(95),
+        'p99': rank(99),
+        'max': round(ordered[-1], 3),
+    }
+
+
+class QueryCounter:
+    # Database execute wrapper, installed on every connection, i.e. the shared sync_to_async thread's and the chat DB executor's
+    def __init__(self, latency=0):
+        self.count = 0
+        self.latency = latency
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        with self._lock:
+            self.count += 1
+        if self.latency:
+            # Stands in for the network round trip to a database server, which SQLite doesn't have
+            time.sleep(self.latency)
+        return execute(sql, params, many, context)
+
+    def install(self, sender, connection, **kwargs):
+        # connection_created receiver
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Client:
+    """One chat socket, speaking JSON or msgpack."""
+
+    def __init__(self, application, path, codec, timeout):
+        from channels.testing import WebsocketCommunicator
+        self.codec = codec
+        self.timeout = timeout
+        self.communicator = WebsocketCommunicator(
+            application, path, subprotocols=[codec.subprotocol] if codec.subprotocol else None,
+        )
+
+    async def connect(self):
+        start = time.perf_counter()
+        connected, _ = await self.communicator.connect(timeout=self.timeout)
+        if not connected:
+            raise ConnectionError('socket was refused')
+        return (time.perf_counter() - start) * 1000
+
+    async def send(self, payload):
+        frame = self.codec.encode(payload)
+        if self.codec.binary:
+            await self.communicator.send_to(bytes_data=frame)
+        else:
+            await self.communicator.send_to(text_data=frame)
+
+    async def receive_content(self, content):
+        # Skips presence, typing and other people's messages until the wanted message arrives
+        while True:
+            output = await self.communicator.receive_output(self.timeout)
+            if output['type'] != 'websocket.send':
+                raise ConnectionError('socket was closed')
+            data = self.codec.decode(text_data=output.get('text'), bytes_data=output.get('bytes'))
+            if data.get('content') == content:
+                return
+
+    async def disconnect(self):
+        await self.communicator.disconnect()
+
+
+async def run(args):
+    from asgiref.sync import sync_to_async
+    from django.conf import settings
+    from django.db import connection
+    from django.db.backends.signals import connection_created
+    from swappynest.asgi import application
+    from chatapp.protocol import JsonCodec, MsgpackCodec
+    from chatapp.writebehind import write_behind
+    from rest_framework_simplejwt.tokens import AccessToken
+    from user.models import UserAccount
+
+    codec = MsgpackCodec() if args.msgpack else JsonCodec()
+    counter = QueryCounter()
+    connection_created.connect(counter.install)
+
+    @sync_to_async
+    def prepare():
+        connection.ensure_connection()
+        counter.install(None, connection)
+        users = UserAccount.objects.bulk_create(
+            UserAccount(email=f'load{number}@example.com', username=f'load{number}')
+            for number in range(2 * args.conversations)
+        )
+        # Sockets identify their user with an access token, as the frontend does
+        tokens = {user.id: str(AccessToken.for_user(user)) for user in users}
+        return [(users[2 * number].id, users[2 * number + 1].id) for number in range(args.conversations)], tokens
+
+    pairs, tokens = await prepare()
+    counter.latency = args.query_latency / 1000
+    # Both sockets of a conversation, each as one of its two users
+    paths = [
+        tuple(f'/ws/chat/conversation_{first}_{second}/?token={tokens[user_id]}' for user_id in (first, second))
+        for first, second in pairs
+    ]
+    limit = asyncio.Semaphore(args.concurrency)
+    failures = []
+
+    async def open_pair(pair_paths):
+        async with limit:
+            pair = tuple(Client(application, path, codec, args.timeout) for path in pair_paths)
+            return pair, [await client.connect() for client in pair]
+
+    # Connect: every conversation opens both sockets, args.concurrency at a time
+    queries_before = counter.count
+    start = time.perf_counter()
+    opened = await asyncio.gather(*(open_pair(pair_paths) for pair_paths in paths))
+    connect_seconds = time.perf_counter() - start
+    connect_queries = counter.count - queries_before
+    clients = [pair for pair, _ in opened]
+    connect_ms = [latency for _, latencies in opened for latency in latencies]
+
+    for sender, receiver in clients:
+        await sender.send({'type': 'heartbeat'})
+        await receiver.send({'type': 'heartbeat'})
+
+    # Messages: one side of every conversation sends, the round trip ends when the other side has it
+    round_trip_ms = []
+    interval = 1 / args.rate if args.rate else 0
+
+    async def converse(number, sender, receiver, sender_id, receiver_id):
+        for sequence in range(args.messages):
+            content = f'load test message {number}/{sequence}'
+            start = time.perf_counter()
+            try:
+                await sender.send({'sender_id': sender_id, 'receiver_id': receiver_id, 'message': content})
+                await receiver.receive_content(content)
+            except (asyncio.TimeoutError, ConnectionError) as e:
+                failures.append(f'conversation {number}: {type(e).__name__} {e}')
+                return
+            round_trip_ms.append((time.perf_counter() - start) * 1000)
+            if interval:
+                await asyncio.sleep(interval)
+
+    queries_before = counter.count
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        converse(number, sender, receiver, sender_id, receiver_id)
+        for number, ((sender, receiver), (sender_id, receiver_id)) in enumerate(zip(clients, pairs))
+    ))
+    if write_behind.enabled:
+        await write_behind.flush()
+    message_seconds = time.perf_counter() - start
+    message_queries = counter.count - queries_before
+
+    for pair in clients:
+        for client in pair:
+            await client.disconnect()
+
+    # Memory: the heap growth for a batch of extra sockets, traced on its own so the timings above stay clean
+    memory_per_connection = None
+    if args.memory_connections:
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        extra = [Client(application, paths[number % len(paths)][number % 2], codec, args.timeout) for number in range(args.memory_connections)]
+        for client in extra:
+            await client.connect()
+        gc.collect()
+        memory_per_connection = (tracemalloc.get_traced_memory()[0] - before) / len(extra)
+        tracemalloc.stop()
+        for client in extra:
+            await client.disconnect()
+
+    messages = len(round_trip_ms)
+    return {
+        'config': {
+            'conversations': args.conversations,
+            'sockets': 2 * args.conversations,
+            'messages_per_conversation': args.messages,
+            'rate_per_conversation': args.rate or None,
+            'codec': 'msgpack' if args.msgpack else 'json',
+            'write_behind': write_behind.enabled,
+            'concurrency': args.concurrency,
+            'db_workers': settings.CHAT_DB_EXECUTOR['WORKERS'],
+            'query_latency_ms': args.query_latency,
+        },
+        'connect_ms': percentiles(connect_ms),
+        'connect_seconds': round(connect_seconds, 3),
+        'queries_per_connection': round(connect_queries / len(connect_ms), 2) if connect_ms else None,
+        'round_trip_ms': percentiles(round_trip_ms),
+        'messages': messages,
+        'messages_per_second': round(messages / message_seconds, 1) if message_seconds else None,
+        'queries_per_message': round(message_queries / messages, 2) if messages else None,
+        'memory_per_connection_kb': round(memory_per_connection / 1024, 1) if memory_per_connection is not None else None,
+        'failures': failures,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--conversations', type=int, default=50, help='Conversations, each with two open sockets.')
+    parser.add_argument('--messages', type=int, default=20, help='Messages sent per conversation.')
+    parser.add_argument('--rate', type=float, default=0, help='Messages per second per conversation, 0 sends back to back.')
+    parser.add_argument('--concurrency', type=int, default=50, help='Sockets connecting at the same time.')
+    parser.add_argument('--memory-connections', type=int, default=100, help='Extra sockets opened to measure memory, 0 skips it.')
+    parser.add_argument('--timeout', type=float, default=10, help='Seconds to wait for a connect or a message.')
+    parser.add_argument('--msgpack', action='store_true', help='Use the msgpack subprotocol instead of JSON.')
+    parser.add_argument('--write-behind', action='store_true', help='Turn on the chat write-behind buffer.')
+    parser.add_argument('--db-workers', type=int, help='Threads for chat database writes, 0 uses the shared sync_to_async thread.')
+    parser.add_argument('--query-latency', type=float, default=0, help='Milliseconds added to every query, to stand in for a database server.')
+    parser.add_argument('--output', help='Write the results to this JSON file as well.')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django(os.path.join(directory, 'ws_load.sqlite3'), args.write_behind, args.db_workers)
+        results = asyncio.run(run(args))
+
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as handle:
+            json.dump(results, handle, indent=2)
+
+
+if __name__ == '__main__':
+    main()
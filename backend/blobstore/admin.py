@@ -0,0 +1,11 @@
+from django.contrib import admin
+from .models import Blob
+
+
+class BlobAdmin(admin.ModelAdmin):
+    list_display = ('name', 'size', 'references', 'created_at')
+    search_fields = ('name',)
+    readonly_fields = ('name', 'size', 'references', 'created_at')
+    list_per_page = 50
+
+admin.site.register(Blob, BlobAdmin)
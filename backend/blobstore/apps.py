@@ -0,0 +1,10 @@
+from django.apps import AppConfig
+
+
+class BlobstoreConfig(AppConfig):
+    default_auto_field = 'django.db.models.BigAutoField'
+    name = 'blobstore'
+
+    def ready(self):
+        # Connect the signal handlers that give up the blobs of deleted rows
+        from . import signals  # noqa: F401
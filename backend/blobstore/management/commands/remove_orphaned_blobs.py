@@ -0,0 +1,48 @@
+import os, time
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from blobstore.models import Blob
+from blobstore.storage import BLOB_PREFIX
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete blob files nothing refers to: files saved by transactions that rolled back, '
+        'temporary files of interrupted uploads, and blobs whose last reference went without '
+        'the file following it, e.g. because the process died.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be deleted without deleting anything.')
+        parser.add_argument(
+            '--min-age', type=float, default=24,
+            help='Hours a file must be old, so saves that are still in their transaction keep theirs.',
+        )
+
+    def handle(self, *args, **options):
+        root = default_storage.path(BLOB_PREFIX)
+        cutoff = time.time() - options['min_age'] * 3600
+
+        orphaned = []
+        for directory, _, files in os.walk(root):
+            relative = os.path.relpath(directory, root)
+            prefix = BLOB_PREFIX if relative == '.' else BLOB_PREFIX + relative.replace(os.sep, '/') + '/'
+            known = set(Blob.objects.filter(name__startswith=prefix).values_list('name', flat=True))
+            orphaned += [
+                os.path.join(directory, file) for file in files
+                if prefix + file not in known and os.path.getmtime(os.path.join(directory, file)) < cutoff
+            ]
+        unreferenced = list(Blob.objects.filter(references=0).values_list('name', flat=True))
+
+        if options['dry_run']:
+            self.stdout.write(f'Would have deleted {len(orphaned)} orphaned and {len(unreferenced)} unreferenced blobs.')
+            return
+
+        for path in orphaned:
+            os.remove(path)
+        for name in unreferenced:
+            # Checks the references again under a lock, a save may have just acquired the blob
+            default_storage._remove_unreferenced(name)
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {len(orphaned)} orphaned and {len(unreferenced)} unreferenced blobs.'
+        ))
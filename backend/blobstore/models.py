@@ -0,0 +1,52 @@
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+
+
+class BlobManager(models.Manager):
+
+    def acquire(self, name, size):
+        """
+        Add a reference to the blob stored as ``name``, creating its row on the first one. The
+        unique name turns a concurrent create into an update, like UnreadCounter.increment.
+        """
+        blob = self.filter(name=name)
+        if blob.update(references=F('references') + 1):
+            return
+        try:
+            with transaction.atomic():
+                self.create(name=name, size=size, references=1)
+        except IntegrityError:
+            blob.update(references=F('references') + 1)
+
+    def release(self, name):
+        """
+        Drop a reference to ``name``. Returns True when that was the last one and the file can
+        go, False while other references remain, and None for files that aren't tracked. The row
+        stays with no references, the storage deletes it together with the file (see
+        ContentAddressedStorage._remove_unreferenced), unless a save acquires it again first.
+        """
+        with transaction.atomic():
+            blob = self.select_for_update().filter(name=name).first()
+            if blob is None:
+                return None
+            if blob.references > 1:
+                self.filter(id=blob.id).update(references=F('references') - 1)
+                return False
+            self.filter(id=blob.id).update(references=0)
+            return True
+
+
+class Blob(models.Model):
+    """
+    A file stored once under its content digest (see blobstore/storage.py), with the number of
+    file fields and image sizes that point at it.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    size = models.BigIntegerField()
+    references = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = BlobManager()
+
+    def __str__(self):
+        return f'{self.name} ({self.references} references)'
@@ -0,0 +1,22 @@
+from django.apps import apps
+from django.db import transaction
+from django.db.models import FileField
+from django.db.models.signals import post_delete
+
+
+# A deleted row gives up the files its file fields point at. Django leaves files alone when
+# rows go, which with shared blobs would leave their reference counts too high forever.
+def release_deleted_files(sender, instance, **kwargs):
+    for field in sender._meta.concrete_fields:
+        if isinstance(field, FileField):
+            name = getattr(instance, field.attname)
+            name = getattr(name, 'name', name)
+            if name:
+                storage = field.storage
+                transaction.on_commit(lambda storage=storage, name=name: storage.delete(name))
+
+
+# Only models with file fields get the receiver, the others keep their fast bulk deletes
+for model in apps.get_models():
+    if any(isinstance(field, FileField) for field in model._meta.concrete_fields):
+        post_delete.connect(release_deleted_files, sender=model, dispatch_uid=f'release_deleted_files:{model._meta.label}')
@@ -0,0 +1,94 @@
+import hashlib, os, re, uuid
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+BLOB_PREFIX = 'blobs/'
+# Uploads are hashed here before they become blobs
+TEMPORARY_PREFIX = f'{BLOB_PREFIX}tmp/'
+
+_EXTENSION = re.compile(r'^\.[a-z0-9]{1,8}$')
+
+
+def is_content_addressed(name):
+    """Whether ``name`` is a blob, whose content can never change under its name."""
+    return name.startswith(BLOB_PREFIX) and not name.startswith(TEMPORARY_PREFIX)
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    File system storage that keeps every file once, under the SHA-256 of its content:
+    ``blobs/<first two hex digits>/<digest><extension>``. The name a field asks for (e.g.
+    ``upload_to``) only contributes the extension.
+
+    Uploads are hashed while they stream to a temporary file, which then either becomes the
+    blob or is thrown away because the blob is already there. Every save adds a reference to
+    the blob and every delete drops one (see Blob.objects); the file itself only goes with the
+    last reference. Files saved before this storage, outside ``blobs/``, aren't tracked and are
+    deleted right away as before.
+
+    A blob's URL always serves the same bytes, so it can be cached for good.
+
+    A save inside a transaction that rolls back loses its reference, but not a file it moved
+    into place; the remove_orphaned_blobs command deletes those.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # _save() picks the name from the content, equal content is supposed to share it
+        return name
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        extension = os.path.splitext(name)[1].lower()
+        if not _EXTENSION.match(extension):
+            extension = ''
+        temporary = self.path(f'{TEMPORARY_PREFIX}{uuid.uuid4().hex}')
+        os.makedirs(os.path.dirname(temporary), exist_ok=True)
+
+        digest, size = hashlib.sha256(), 0
+        try:
+            with open(temporary, 'wb') as handle:
+                if hasattr(content, 'seek'):
+                    content.seek(0)
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    handle.write(chunk)
+                    size += len(chunk)
+
+            hexdigest = digest.hexdigest()
+            blob_name = f'{BLOB_PREFIX}{hexdigest[:2]}/{hexdigest}{extension}'
+            # The reference goes first, a concurrent removal of the file then either leaves it
+            # alone or has finished and the file is written again below
+            Blob.objects.acquire(blob_name, size)
+            path = self.path(blob_name)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temporary, path)
+                if self.file_permissions_mode is not None:
+                    os.chmod(path, self.file_permissions_mode)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        return blob_name
+
+    def delete(self, name):
+        from .models import Blob
+
+        if not name:
+            raise ValueError('The name must be given to delete().')
+        if not is_content_addressed(name):
+            return super().delete(name)
+
+        if Blob.objects.release(name):
+            transaction.on_commit(lambda: self._remove_unreferenced(name))
+
+    def _remove_unreferenced(self, name):
+        from .models import Blob
+
+        with transaction.atomic():
+            # Locked while the file goes, so a save of the same content waits and then writes it
+            # again. One that acquired the blob before has brought its references back up.
+            blob = Blob.objects.select_for_update().filter(name=name, references=0).first()
+            if blob is not None:
+                super().delete(name)
+                blob.delete()
@@ -0,0 +1,97 @@
+import io, os, tempfile
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import override_settings
+from PIL import Image as PILImage
+from rest_framework.test import APITestCase
+from user.models import UserAccount
+from .models import Blob
+
+
+class ContentAddressedStorageTest(APITestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+    def photo(self):
+        buffer = io.BytesIO()
+        PILImage.new('RGB', (20, 10), (200, 120, 40)).save(buffer, 'PNG')
+        return SimpleUploadedFile('photo.png', buffer.getvalue(), content_type='image/png')
+
+    def test_same_content_is_stored_once(self):
+        first = default_storage.save('products/a.jpg', ContentFile(b'same bytes'))
+        second = default_storage.save('profile/b.JPG', ContentFile(b'same bytes'))
+        self.assertEqual(first, second)
+        self.assertTrue(first.startswith('blobs/') and first.endswith('.jpg'))
+        self.assertEqual(Blob.objects.get(name=first).references, 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_storage.delete(first)
+        self.assertTrue(default_storage.exists(first))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            default_storage.delete(first)
+        self.assertFalse(default_storage.exists(first))
+        self.assertFalse(Blob.objects.exists())
+        self.assertEqual(os.listdir(default_storage.path('blobs/tmp')), [])
+
+    def test_save_before_the_removal_keeps_the_file(self):
+        name = default_storage.save('products/a.jpg', ContentFile(b'same bytes'))
+        with self.captureOnCommitCallbacks() as callbacks:
+            default_storage.delete(name)
+        # Saved again before the file of the last reference is removed
+        default_storage.save('products/b.jpg', ContentFile(b'same bytes'))
+        for callback in callbacks:
+            callback()
+        self.assertTrue(default_storage.exists(name))
+        self.assertEqual(Blob.objects.get(name=name).references, 1)
+
+    def test_remove_orphaned_blobs(self):
+        kept = default_storage.save('products/a.jpg', ContentFile(b'kept'))
+        try:
+            with transaction.atomic():
+                orphaned = default_storage.save('products/b.jpg', ContentFile(b'rolled back'))
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertTrue(default_storage.exists(orphaned))
+
+        # Too recent to tell from a save that hasn't committed yet
+        output = io.StringIO()
+        call_command('remove_orphaned_blobs', '--dry-run', stdout=output)
+        self.assertIn('Would have deleted 0 orphaned', output.getvalue())
+
+        call_command('remove_orphaned_blobs', '--min-age', '0', stdout=io.StringIO())
+        self.assertFalse(default_storage.exists(orphaned))
+        self.assertTrue(default_storage.exists(kept))
+
+    def test_remove_profilephoto_releases_one_reference(self):
+        users = [
+            UserAccount.objects.create(email=f'user{number}@example.com', username=f'user{number}')
+            for number in range(2)
+        ]
+        for user in users:
+            self.client.force_authenticate(user)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.put(f'/api/user/profile/{user.id}/', {'profilephoto': self.photo()}, format='multipart')
+        name = UserAccount.objects.get(id=users[0].id).profilephoto.name
+        self.assertEqual(Blob.objects.get(name=name).references, 2)
+
+        # Removing twice must not take the other user's reference with it
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                response = self.client.put(f'/api/user/profile/{users[1].id}/', {'remove_profilephoto': 'true'}, format='multipart')
+            self.assertEqual(response.status_code, 200)
+        self.assertEqual(Blob.objects.get(name=name).references, 1)
+        self.assertTrue(default_storage.exists(name))
+
+        # Deleting the last user holding it removes the file
+        with self.captureOnCommitCallbacks(execute=True):
+            UserAccount.objects.get(id=users[0].id).delete()
+        self.assertFalse(Blob.objects.exists())
+        self.assertFalse(default_storage.exists(name))
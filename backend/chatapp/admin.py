@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Conversation, Message
+from .models import Conversation, Message, UnreadCounter
 
 # Register your models here.
 
@@ -14,4 +14,5 @@ class ConversationAdmin(admin.ModelAdmin):
     search_fields = ('participants_username',)
 
 admin.site.register(Conversation, ConversationAdmin)
-admin.site.register(Message)
\ No newline at end of file
+admin.site.register(Message)
+admin.site.register(UnreadCounter)
\ No newline at end of file
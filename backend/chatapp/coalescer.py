@@ -0,0 +1,63 @@
+import asyncio, logging
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class ChatListCoalescer:
+    """
+    Coalesces chat-list updates before they go out to the ``chat_list_<user id>`` groups.
+
+    Every message used to push the full conversation to both participants' chat lists. Here
+    updates wait for CHAT_LIST_COALESCE_WINDOW seconds, only the latest update per (user,
+    conversation) is kept, and each user then gets a single frame with every conversation that
+    changed in the window. A window of 0 sends every update straight away. The chat_list_*
+    counters in chatapp/metrics.py show how many sends it saves.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._pending = {}
+        self._task = None
+
+    async def publish(self, channel_layer, user_id, conversation):
+        metrics.chat_list_updates.inc()
+        if settings.CHAT_LIST_COALESCE_WINDOW <= 0:
+            await self._send(channel_layer, user_id, [conversation])
+            return
+
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._pending, self._task = loop, {}, None
+
+        pending = self._pending.setdefault(user_id, {})
+        if conversation['id'] in pending:
+            metrics.chat_list_coalesced.inc()
+        pending[conversation['id']] = conversation
+
+        if self._task is None:
+            self._task = loop.create_task(self._flush_later(channel_layer))
+
+    async def _flush_later(self, channel_layer):
+        await asyncio.sleep(settings.CHAT_LIST_COALESCE_WINDOW)
+        pending, self._pending, self._task = self._pending, {}, None
+        for user_id, conversations in pending.items():
+            try:
+                await self._send(channel_layer, user_id, list(conversations.values()))
+            except Exception:
+                logger.exception('Could not send the chat list update of user %s', user_id)
+
+    async def _send(self, channel_layer, user_id, conversations):
+        metrics.chat_list_frames.inc()
+        await metrics.group_send(
+            channel_layer,
+            f'chat_list_{user_id}',
+            {
+                'type': 'update_chat_list_batch',
+                'conversations': conversations
+            }
+        )
+
+
+chat_list_coalescer = ChatListCoalescer()
@@ -1,18 +1,38 @@
-import json, os, django
+import asyncio, logging, os, time, django
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+from django.db import transaction
 from django.contrib.auth import get_user_model
-from asgiref.sync import sync_to_async
+from django.utils import timezone
 
 from django.db.models import Q
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "swappynest.settings")
 django.setup()  # Ensure Django is set up before importing models
-from .models import Conversation, Message
+from .models import Conversation, Message, UnreadCounter
+from .writebehind import write_behind
+from .coalescer import chat_list_coalescer
+from .protocol import CodecConsumerMixin
+from .presence import presence_registry
+from . import metrics
+from .metrics import InstrumentedConsumerMixin, timed_sync_to_async
+from .dbexecutor import db_executor
+
+logger = logging.getLogger(__name__)
+
 User = get_user_model()
 
-class ChatConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(InstrumentedConsumerMixin, CodecConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = None  # Initialize to None
+        # The authenticated participant on this socket (see chatapp/auth.py), None for anonymous
+        # sockets, which can send messages but take no part in presence, typing or read receipts
+        self.user_id = None
+        self.typing_sent = None
+        self.read_upto = None
+        self.read_task = None
+        # Write-behind futures of the messages this connection sent that aren't written yet
+        self.pending_writes = set()
         
         # Check if the room_name is 'undefined' or doesn't contain participant IDs
         if self.room_name == 'undefined' or '_' not in self.room_name:
@@ -32,153 +52,338 @@ class ChatConsumer(AsyncWebsocketConsumer):
             # Get or create a conversation for these participants
             self.conversation = await self.get_or_create_conversation(self.sender_id, self.receiver_id)
             
+            # Membership and participant cards don't change for a 1:1 conversation, so they are loaded once per connection
+            self.participants = await self.get_participants(self.conversation)
+
             # Set up the WebSocket group name for this conversation
             self.room_group_name = f'chat_{self.conversation.id}'
 
             # Join the WebSocket group
-            await self.channel_layer.group_add(
+            await metrics.group_add(
+                self.channel_layer,
                 self.room_group_name,
                 self.channel_name
             )
-            await self.accept()
+            await self.accept_with_codec()
+
+            await self.identify()
         except Exception as e:
             print(f"Error in connect: {str(e)}")
             await self.close()
 
     async def disconnect(self, close_code):
+        # Make sure everything this connection sent is in the database before it goes away
+        if self.pending_writes:
+            await write_behind.flush(self.pending_writes)
+
+        if self.user_id is not None:
+            try:
+                if self.read_task is not None:
+                    self.read_task.cancel()
+                    self.read_task = None
+                await self.flush_read()
+                if self.typing_sent is not None:
+                    await self.send_typing(False)
+                await presence_registry.unregister(self.channel_layer, self.channel_name)
+            except Exception as e:
+                print(f"Error in disconnect: {str(e)}")
+
         # Check if room_group_name was set before attempting to use it
         if hasattr(self, 'room_group_name') and self.room_group_name:
             try:
-                await self.channel_layer.group_discard(
+                await metrics.group_discard(
+                    self.channel_layer,
                     self.room_group_name,
                     self.channel_name
                 )
             except Exception as e:
                 print(f"Error in disconnect: {str(e)}")
 
-    async def receive(self, text_data):
-        # Process incoming WebSocket message
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        # Process incoming WebSocket message, JSON text or msgpack depending on the negotiated subprotocol
+        data = self.decode_frame(text_data, bytes_data)
+        # Any frame shows the client is still there
+        presence_registry.touch(self.channel_name)
+
+        # Frames without a type are chat messages, as they always were
+        frame_type = data.get('type', 'message')
+        metrics.frames_received.inc(type(self).__name__, frame_type)
+        if frame_type == 'message':
+            await self.receive_message(data)
+        elif frame_type == 'heartbeat':
+            # Nothing else to do, the touch above keeps the connection alive
+            pass
+        elif frame_type == 'typing':
+            if self.user_id is not None:
+                await self.receive_typing(bool(data.get('is_typing', True)))
+        elif frame_type == 'read':
+            if self.user_id is not None:
+                self.receive_read()
+
+    async def identify(self):
+        """
+        Bind the socket to its authenticated user when that user is a participant, which puts the
+        user in the presence registry. The user ids frames carry are never trusted for this,
+        otherwise either participant could type, read and clear unread counts as the other.
+        """
+        user = self.scope.get('user')
+        if user is not None and user.is_authenticated and user.id in self.participants:
+            self.user_id = user.id
+            await presence_registry.register(self.channel_layer, self.channel_name, user.id, self.room_group_name)
+
+    async def receive_message(self, data):
         sender_id = data['sender_id']
         receiver_id = data['receiver_id']
         message_content = data['message']
 
-        # Validate that the participants are part of this conversation
-        if not await self.are_participants_valid(sender_id, receiver_id):
+        # Validate that the participants are part of this conversation, and that an authenticated
+        # socket only sends as its own user
+        if not self.are_participants_valid(sender_id, receiver_id) or self.user_id not in (None, sender_id):
             await self.close()
             return
+        # Clients clear the typing indicator when the message arrives
+        self.typing_sent = None
 
-        # Save the message to the database
-        message = await self.save_message(self.conversation, sender_id, receiver_id, message_content)
+        # Save the message to the database, or queue it for the write-behind buffer
+        message = Message(
+            conversation=self.conversation,
+            sender_id=sender_id,
+            receiver_id=receiver_id,
+            content=message_content
+        )
+        # Unread counts are only known once the message is written, queued messages go out without them
+        unread_counts = {}
+        if write_behind.enabled:
+            written = await write_behind.submit(message)
+            self.pending_writes.add(written)
+            written.add_done_callback(self.pending_writes.discard)
+        else:
+            unread_counts = await self.save_message(message)
 
-        # Broadcast the message to the conversation group
-        await self.channel_layer.group_send(
+        # Broadcast the message to the conversation group. Its uuid is the id clients see, here
+        # and in the message history, since a queued message has no database id yet.
+        await metrics.group_send(
+            self.channel_layer,
             self.room_group_name,
             {
                 'type': 'chat_message',
                 'message': {
-                    'id': message.id,
+                    'id': str(message.uuid),
                     'sender_id': sender_id,
                     'receiver_id': receiver_id,
                     'content': message_content,
-                    'timestamp': str(message.timestamp)
+                    'timestamp': message.timestamp.timestamp()
                 }
             }
         )
 
-        # Send updates to both participants' chat list channels
-        conversation_data = await self.get_conversation_data(self.conversation.id)
+        metrics.message_sent()
+
+        # Send updates to both participants' chat list channels, batched per user by the coalescer
+        conversation_data = self.get_conversation_data(message)
         for participant_id in [sender_id, receiver_id]:
-            await self.channel_layer.group_send(
-                f'chat_list_{participant_id}',
-                {
-                    'type': 'update_chat_list',
-                    'conversation': conversation_data
-                }
-            )
+            if participant_id in unread_counts:
+                data = dict(conversation_data, unread_count=unread_counts[participant_id])
+            else:
+                data = conversation_data
+            await chat_list_coalescer.publish(self.channel_layer, participant_id, data)
+
+    async def receive_typing(self, is_typing):
+        # Typing is sent when it starts and then at most once per CHAT_TYPING_DEBOUNCE seconds, so
+        # clients can drop an indicator that hasn't been renewed for a while
+        now = time.monotonic()
+        if is_typing:
+            if self.typing_sent is not None and now - self.typing_sent < settings.CHAT_TYPING_DEBOUNCE:
+                return
+            self.typing_sent = now
+        elif self.typing_sent is None:
+            return
+        await self.send_typing(is_typing)
+
+    async def send_typing(self, is_typing):
+        if not is_typing:
+            self.typing_sent = None
+        await metrics.group_send(self.channel_layer, self.room_group_name, {
+            'type': 'typing',
+            'user_id': self.user_id,
+            'is_typing': is_typing,
+        })
+
+    def receive_read(self):
+        # The user has read everything received so far. Receipts within CHAT_READ_DEBOUNCE seconds
+        # are written together, up to the time of the last one.
+        self.read_upto = timezone.now()
+        if self.read_task is None:
+            self.read_task = asyncio.get_running_loop().create_task(self.flush_read_later())
+
+    async def flush_read_later(self):
+        await asyncio.sleep(settings.CHAT_READ_DEBOUNCE)
+        self.read_task = None
+        try:
+            await self.flush_read()
+        except Exception:
+            logger.exception('Could not save the read receipt of user %s', self.user_id)
+
+    async def flush_read(self):
+        read_upto, self.read_upto = self.read_upto, None
+        if read_upto is None:
+            return
+        # Queued messages have to be in the table to be marked
+        if write_behind.enabled:
+            await write_behind.flush()
+        unread_count = await self.mark_read(self.user_id, read_upto)
+        if unread_count is None:
+            return
+        await metrics.group_send(self.channel_layer, self.room_group_name, {
+            'type': 'read_receipt',
+            'user_id': self.user_id,
+            'conversation_id': self.conversation.id,
+            'timestamp': read_upto.timestamp(),
+        })
+        # The reader's chat lists (other tabs and devices) get the new count
+        await metrics.group_send(self.channel_layer, f'chat_list_{self.user_id}', {
+            'type': 'update_unread_count',
+            'conversation_id': self.conversation.id,
+            'unread_count': unread_count,
+        })
 
     async def chat_message(self, event):
         # Send chat message to WebSocket
-        await self.send(text_data=json.dumps(event['message']))
-
-    @sync_to_async
-    def save_message(self, conversation, sender_id, receiver_id, message_content):
-        # Save a new message to the database
-        sender = User.objects.get(id=sender_id)
-        receiver = User.objects.get(id=receiver_id)
-
-        message = Message.objects.create(
-            conversation=conversation,
-            sender=sender,
-            receiver=receiver,
-            content=message_content
-        )
-        return message
+        await self.send_payload(self.codec.stamp(event['message']))
 
-    @sync_to_async
-    def get_or_create_conversation(self, sender_id, receiver_id):
-        sender = User.objects.get(id=sender_id)
-        receiver = User.objects.get(id=receiver_id)
+    async def presence(self, event):
+        if event['user_id'] != self.user_id:
+            await self.send_payload({'type': 'presence', 'user_id': event['user_id'], 'online': event['online']})
+            if event['reply'] and self.user_id is not None:
+                await presence_registry.announce(self.channel_layer, self.room_group_name, self.user_id, True)
+        elif not event['online'] and presence_registry.is_online(self.user_id, self.room_group_name):
+            # Our user left on another node but is still connected here
+            await presence_registry.announce(self.channel_layer, self.room_group_name, self.user_id, True)
 
-        conversation = Conversation.objects.filter(participants=sender).filter(participants=receiver).distinct()
+    async def presence_expired(self, event):
+        # No frame for CHAT_PRESENCE['TTL'] seconds, the client is gone
+        await self.close()
 
-        if conversation.exists():
-            return conversation.first()
-        else:
-            conversation = Conversation.objects.create()
-            conversation.participants.add(sender, receiver)
-            return conversation
+    async def typing(self, event):
+        if event['user_id'] != self.user_id:
+            await self.send_payload({'type': 'typing', 'user_id': event['user_id'], 'is_typing': event['is_typing']})
+
+    async def read_receipt(self, event):
+        await self.send_payload(self.codec.stamp({
+            'type': 'read_receipt',
+            'user_id': event['user_id'],
+            'conversation_id': event['conversation_id'],
+            'timestamp': event['timestamp'],
+        }))
+
+    @timed_sync_to_async(adapter=db_executor.adapter)
+    def save_message(self, message):
+        # Save a new message to the database, the participants were already checked so the ids are used as they are.
+        # Returns both participants' unread counts after the receiver's was incremented.
+        with transaction.atomic():
+            message.save()
+            Conversation.objects.record_activity({message.conversation_id: message.timestamp})
+            UnreadCounter.objects.increment({(message.receiver_id, message.conversation_id): 1})
+            counts = dict.fromkeys(self.participants, 0)
+            counts.update(
+                UnreadCounter.objects.filter(conversation_id=message.conversation_id, user_id__in=self.participants)
+                .values_list('user_id', 'count')
+            )
+            return counts
+
+    @timed_sync_to_async(adapter=db_executor.adapter)
+    def mark_read(self, user_id, read_upto):
+        # One UPDATE for every message the user had not read yet, however many there are. The
+        # unread counter goes down by as many messages as were marked, which leaves anything that
+        # arrived after read_upto counted. Returns the unread count afterwards, or None when there
+        # was nothing to mark.
+        with transaction.atomic():
+            read = Message.objects.filter(
+                conversation=self.conversation,
+                receiver_id=user_id,
+                read_at__isnull=True,
+                timestamp__lte=read_upto,
+            ).update(read_at=read_upto)
+            if not read:
+                return None
+            UnreadCounter.objects.decrement(user_id, self.conversation.id, read)
+            return UnreadCounter.objects.filter(user_id=user_id, conversation=self.conversation).values_list('count', flat=True).first() or 0
+
+    async def get_or_create_conversation(self, sender_id, receiver_id):
+        # Looking the pair up is a plain read, only creating the conversation needs a transaction
+        conversation = await Conversation.objects.aget_pair(sender_id, receiver_id)
+        if conversation is None:
+            conversation = await self.create_conversation(sender_id, receiver_id)
+        return conversation
+
+    @timed_sync_to_async(adapter=db_executor.adapter)
+    def create_conversation(self, sender_id, receiver_id):
+        return Conversation.objects.get_or_create_pair(sender_id, receiver_id)
+
+    async def get_participants(self, conversation):
+        # Participant cards keyed by user id, in the shape the chat list expects
+        return {
+            participant.id: {
+                'id': participant.id,
+                'username': participant.username,
+                'profilephoto': participant.profilephoto.url if participant.profilephoto else None
+            }
+            async for participant in conversation.participants.only('id', 'username', 'profilephoto')
+        }
 
-    @sync_to_async
     def are_participants_valid(self, sender_id, receiver_id):
         # Validate that both sender and receiver are part of this conversation
-        participants = list(self.conversation.participants.all())
-        participant_ids = {user.id for user in participants}
-        return {sender_id, receiver_id}.issubset(participant_ids)
-
-    @sync_to_async
-    def get_conversation_data(self, conversation_id):
-        conversation = Conversation.objects.get(id=conversation_id)
-        participants = conversation.participants.all()
-        last_message = conversation.messages.order_by('-timestamp').first()
+        return {sender_id, receiver_id}.issubset(self.participants)
+
+    def get_conversation_data(self, last_message):
+        # Built from the participants loaded at connect and the message that was just sent, so no query is needed
         return {
-            'id': conversation.id,
-            'participants': [
-                {
-                    'id': participant.id,
-                    'username': participant.username,
-                    'profilephoto': participant.profilephoto.url if participant.profilephoto else None
-                }
-                for participant in participants
-            ],
-            'last_message': last_message.content if last_message else None,
-            'timestamp': str(last_message.timestamp) if last_message else None
+            'id': self.conversation.id,
+            'participants': list(self.participants.values()),
+            'last_message': last_message.content,
+            'timestamp': last_message.timestamp.timestamp()
         }
 
-class ChatListConsumer(AsyncWebsocketConsumer):
+class ChatListConsumer(InstrumentedConsumerMixin, CodecConsumerMixin, AsyncWebsocketConsumer):
     async def connect(self):
         # Set up WebSocket connection for chat list updates
         self.user_id = self.scope['url_route']['kwargs']['user_id']
         self.room_group_name = f'chat_list_{self.user_id}'
 
-        await self.channel_layer.group_add(
+        await metrics.group_add(
+            self.channel_layer,
             self.room_group_name,
             self.channel_name
         )
 
-        await self.accept()
+        await self.accept_with_codec()
 
     async def disconnect(self, close_code):
         # Leave the WebSocket group when disconnecting
-        await self.channel_layer.group_discard(
+        await metrics.group_discard(
+            self.channel_layer,
             self.room_group_name,
             self.channel_name
         )
 
     async def update_chat_list(self, event):
         # Send chat list update to WebSocket
-        await self.send(text_data=json.dumps({
+        await self.send_payload({
             'type': 'update_conversation',
-            'conversation': event['conversation']
-        }))
+            'conversation': self.codec.stamp(event['conversation'])
+        })
+
+    async def update_chat_list_batch(self, event):
+        # Send every conversation that changed during the coalescing window in one frame
+        await self.send_payload({
+            'type': 'update_conversations',
+            'conversations': [self.codec.stamp(conversation) for conversation in event['conversations']]
+        })
 
+    async def update_unread_count(self, event):
+        # The user read a conversation somewhere else
+        await self.send_payload({
+            'type': 'update_unread_count',
+            'conversation_id': event['conversation_id'],
+            'unread_count': event['unread_count']
+        })
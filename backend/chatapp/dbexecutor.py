@@ -0,0 +1,57 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from asgiref.sync import SyncToAsync
+from django.conf import settings
+from django.db import close_old_connections
+
+
+class DatabaseExecutor:
+    """
+    Dedicated, bounded thread pool for the chat database work that has to stay sync, i.e. writes
+    that need a transaction, which the async ORM can't open. Everything else in the consumers
+    goes through the async ORM.
+
+    Plain ``sync_to_async`` runs every call on one shared thread, so one slow write holds up every
+    socket in the process. Here up to CHAT_DB_EXECUTOR['WORKERS'] calls run at once, each worker
+    with its own database connection, and the rest queue for a free worker (see the chat_sync_*
+    metrics). WORKERS = 0 goes back to the shared thread.
+
+    Like channels' database_sync_to_async, every call closes connections that are broken or past
+    CONN_MAX_AGE before and after it runs, otherwise a worker would keep a dead connection for
+    good.
+    """
+
+    def __init__(self):
+        self._pool = None
+
+    @property
+    def workers(self):
+        return settings.CHAT_DB_EXECUTOR['WORKERS']
+
+    @property
+    def pool(self):
+        if self._pool is None and self.workers > 0:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='chat-db')
+        return self._pool
+
+    @staticmethod
+    def _with_connection_cleanup(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            close_old_connections()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                close_old_connections()
+        return run
+
+    def adapter(self, func):
+        # For timed_sync_to_async(adapter=db_executor.adapter)
+        func = self._with_connection_cleanup(func)
+        pool = self.pool
+        if pool is None:
+            return SyncToAsync(func)
+        return SyncToAsync(func, thread_sensitive=False, executor=pool)
+
+
+db_executor = DatabaseExecutor()
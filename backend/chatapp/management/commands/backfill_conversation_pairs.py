@@ -0,0 +1,66 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from chatapp.models import Conversation, Message
+
+
+class Command(BaseCommand):
+    help = (
+        'Fill in the canonical participant pair of every 1:1 conversation, merge duplicate '
+        'conversations between the same two users into the oldest one, and set every '
+        'conversation\'s last_message_at from its messages.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing anything.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        # Group every conversation by its participant pair, straight from the M2M table
+        participants = defaultdict(set)
+        through = Conversation.participants.through
+        for conversation_id, user_id in through.objects.values_list('conversation_id', 'useraccount_id').iterator():
+            participants[conversation_id].add(user_id)
+
+        pairs = defaultdict(list)
+        skipped = 0
+        for conversation in Conversation.objects.only('id', 'user_low_id', 'user_high_id').order_by('created_at', 'id'):
+            user_ids = sorted(participants.get(conversation.id, ()))
+            if len(user_ids) != 2:
+                skipped += 1
+                continue
+            pairs[tuple(user_ids)].append(conversation)
+
+        backfilled = merged = 0
+        for (user_low_id, user_high_id), conversations in pairs.items():
+            # A conversation that already carries the pair wins, otherwise the oldest one does
+            keyed = [c for c in conversations if c.user_low_id is not None]
+            survivor = keyed[0] if keyed else conversations[0]
+            duplicates = [c.id for c in conversations if c.id != survivor.id]
+
+            if survivor.user_low_id is None:
+                backfilled += 1
+            merged += len(duplicates)
+            if dry_run:
+                continue
+
+            with transaction.atomic():
+                if duplicates:
+                    Message.objects.filter(conversation_id__in=duplicates).update(conversation=survivor)
+                    Conversation.objects.filter(id__in=duplicates).delete()
+                if survivor.user_low_id is None:
+                    Conversation.objects.filter(id=survivor.id).update(user_low_id=user_low_id, user_high_id=user_high_id)
+
+        if not dry_run:
+            # One pass over the message index, for conversations from before the column and the merged ones
+            newest = Message.objects.filter(conversation=OuterRef('pk')).order_by().values('conversation').annotate(newest=Max('timestamp'))
+            Conversation.objects.update(last_message_at=Coalesce(Subquery(newest.values('newest')), F('created_at')))
+
+        prefix = 'Would have ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}backfilled {backfilled} conversations and merged {merged} duplicates '
+            f'({skipped} conversations without exactly two participants were left alone).'
+        ))
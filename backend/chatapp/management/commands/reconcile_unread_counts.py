@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+from chatapp.models import Message, UnreadCounter
+
+
+class Command(BaseCommand):
+    help = (
+        'Recount the unread messages of every user in every conversation and repair the unread '
+        'counters that drifted from it. Messages written while this runs can still leave a '
+        'counter off by their number, so run it when chat is quiet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing anything.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Counters written per query.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+
+        # The real counts, straight from the unread rows (see message_unread_idx)
+        actual = {
+            (row['receiver_id'], row['conversation_id']): row['unread']
+            for row in Message.objects.filter(read_at__isnull=True)
+            .values('receiver_id', 'conversation_id')
+            .annotate(unread=Count('id'))
+            .order_by()
+        }
+
+        drifted = []
+        for counter in UnreadCounter.objects.only('id', 'user_id', 'conversation_id', 'count').iterator():
+            count = actual.pop((counter.user_id, counter.conversation_id), 0)
+            if counter.count != count:
+                counter.count = count
+                drifted.append(counter)
+        missing = [
+            UnreadCounter(user_id=user_id, conversation_id=conversation_id, count=count)
+            for (user_id, conversation_id), count in actual.items()
+        ]
+
+        if not dry_run:
+            with transaction.atomic():
+                UnreadCounter.objects.bulk_update(drifted, ['count'], batch_size=batch_size)
+                UnreadCounter.objects.bulk_create(missing, batch_size=batch_size, ignore_conflicts=True)
+
+        prefix = 'Would have ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}corrected {len(drifted)} unread counters and created {len(missing)} missing ones.'
+        ))
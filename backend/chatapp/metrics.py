@@ -0,0 +1,323 @@
+"""
+Metrics for the chat consumers, kept in process and served in the Prometheus text format by the
+ASGI app itself (see MetricsEndpoint and swappynest/asgi.py).
+
+Covered: consumer connect/receive/event handler durations, group_send durations, how long
+sync_to_async calls wait for a thread versus how long they run, connections per consumer and per
+group, chat messages per second and how many chat-list updates the coalescer merged. Every worker process keeps its own numbers, so each one is
+scraped on its own.
+"""
+import functools, hmac, threading, time
+from collections import deque
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+DURATION_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the group size buckets, so big groups show up without a series per group
+GROUP_SIZE_BUCKETS = (1, 2, 5, 10, 50, 100)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        registry.append(self)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        return self.header() + [
+            f'{self.name}{_labels(self.labelnames, labels)} {value}' for labels, value in sorted(self._values.items())
+        ]
+
+
+class Gauge(Metric):
+    """A gauge that is set directly, or read from ``collect`` (returning {labels: value}) at scrape time."""
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), collect=None):
+        super().__init__(name, help, labelnames)
+        self.collect = collect
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self):
+        values = self.collect() if self.collect is not None else dict(self._values)
+        return self.header() + [
+            f'{self.name}{_labels(self.labelnames, labels)} {value}' for labels, value in sorted(values.items())
+        ]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, *labels):
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            values = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._values.items()}
+        for labels, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket in zip(self.buckets, counts):
+                cumulative += bucket
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), labels + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_labels(self.labelnames + ("le",), labels + ("+Inf",))} {count}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, labels)} {total:.6f}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, labels)} {count}')
+        return lines
+
+
+registry = []
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines += metric.render()
+    return '\n'.join(lines) + '\n'
+
+
+# ------------------------------------------------------------------- groups and rates
+
+class GroupTracker:
+    """Which channels are in which group on this process, from the group_add/group_discard helpers below."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.groups = {}
+
+    def add(self, group, channel):
+        with self._lock:
+            self.groups.setdefault(group, set()).add(channel)
+
+    def discard(self, group, channel):
+        with self._lock:
+            channels = self.groups.get(group)
+            if channels is not None:
+                channels.discard(channel)
+                if not channels:
+                    del self.groups[group]
+
+    @staticmethod
+    def kind(group):
+        # chat_12 and chat_list_7 are kinds 'chat' and 'chat_list', one series per kind instead of per group
+        return group.rstrip('0123456789').rstrip('_') or group
+
+    def by_kind(self):
+        groups, connections, largest = {}, {}, {}
+        with self._lock:
+            for group, channels in self.groups.items():
+                kind = (self.kind(group),)
+                groups[kind] = groups.get(kind, 0) + 1
+                connections[kind] = connections.get(kind, 0) + len(channels)
+                largest[kind] = max(largest.get(kind, 0), len(channels))
+        return groups, connections, largest
+
+    def by_size(self):
+        # Groups per kind with at most ``le`` connections, cumulative like a histogram
+        counts = {}
+        with self._lock:
+            for group, channels in self.groups.items():
+                kind = self.kind(group)
+                for bound in GROUP_SIZE_BUCKETS + (None,):
+                    if bound is None or len(channels) <= bound:
+                        key = (kind, '+Inf' if bound is None else str(bound))
+                        counts[key] = counts.get(key, 0) + 1
+        return counts
+
+
+class RateMeter:
+    """Events per second over the last ``window`` seconds."""
+
+    def __init__(self, window=60):
+        self.window = window
+        self._lock = threading.Lock()
+        self._events = deque()
+
+    def mark(self):
+        now = time.monotonic()
+        with self._lock:
+            self._events.append(now)
+            self._trim(now)
+
+    def _trim(self, now):
+        while self._events and self._events[0] < now - self.window:
+            self._events.popleft()
+
+    def rate(self):
+        with self._lock:
+            self._trim(time.monotonic())
+            return len(self._events) / self.window
+
+
+group_tracker = GroupTracker()
+message_rate = RateMeter()
+
+handler_seconds = Histogram(
+    'chat_consumer_handler_seconds', 'Time spent handling one consumer event (websocket.connect, websocket.receive, chat_message, ...).',
+    ('consumer', 'event'),
+)
+group_send_seconds = Histogram('chat_group_send_seconds', 'Time spent in channel_layer.group_send.', ('event',))
+sync_wait_seconds = Histogram('chat_sync_wait_seconds', 'Time a sync_to_async call waited for its thread.', ('function',))
+sync_run_seconds = Histogram('chat_sync_run_seconds', 'Time a sync_to_async call ran in its thread.', ('function',))
+sync_in_flight = Gauge('chat_sync_in_flight', 'sync_to_async calls waiting for or running in a thread.', ('function',))
+connections = Gauge('chat_connections', 'Open WebSocket connections.', ('consumer',))
+frames_received = Counter('chat_frames_received_total', 'WebSocket frames received by type.', ('consumer', 'type'))
+messages_total = Counter('chat_messages_total', 'Chat messages sent.')
+presence_expired = Counter('chat_presence_expired_total', 'Chat connections dropped after staying silent for CHAT_PRESENCE TTL seconds.')
+# The coalescer saves chat_list_updates_total - chat_list_frames_total group sends
+chat_list_updates = Counter('chat_list_updates_total', 'Chat-list updates handed to the coalescer.')
+chat_list_coalesced = Counter('chat_list_updates_coalesced_total', 'Chat-list updates replaced by a newer update of the same conversation.')
+chat_list_frames = Counter('chat_list_frames_total', 'Chat-list frames sent, each with every conversation that changed for one user.')
+Gauge('chat_messages_per_second', 'Chat messages per second over the last minute.', collect=lambda: {(): round(message_rate.rate(), 3)})
+Gauge('chat_groups', 'Channel groups with a member on this process.', ('kind',), collect=lambda: group_tracker.by_kind()[0])
+Gauge('chat_group_connections', 'Connections in channel groups on this process.', ('kind',), collect=lambda: group_tracker.by_kind()[1])
+Gauge('chat_group_connections_max', 'Connections in the largest channel group on this process.', ('kind',), collect=lambda: group_tracker.by_kind()[2])
+Gauge('chat_groups_by_size', 'Channel groups on this process with at most le connections.', ('kind', 'le'), collect=group_tracker.by_size)
+
+
+# ----------------------------------------------------------------- instrumentation
+
+def timed_sync_to_async(func=None, *, adapter=sync_to_async):
+    """
+    Drop-in for ``@sync_to_async`` that records how long each call waited for a thread and how
+    long it ran there. ``adapter`` can be another SyncToAsync flavour, e.g. database_sync_to_async.
+    """
+    if func is None:
+        return functools.partial(timed_sync_to_async, adapter=adapter)
+    name = func.__qualname__
+
+    def run(queued, args, kwargs):
+        started = time.perf_counter()
+        sync_wait_seconds.observe(started - queued, name)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sync_run_seconds.observe(time.perf_counter() - started, name)
+
+    call = adapter(run)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        sync_in_flight.inc(name)
+        try:
+            return await call(time.perf_counter(), args, kwargs)
+        finally:
+            sync_in_flight.dec(name)
+    return wrapper
+
+
+async def group_send(channel_layer, group, message):
+    start = time.perf_counter()
+    try:
+        await channel_layer.group_send(group, message)
+    finally:
+        group_send_seconds.observe(time.perf_counter() - start, message['type'])
+
+
+async def group_add(channel_layer, group, channel):
+    await channel_layer.group_add(group, channel)
+    group_tracker.add(group, channel)
+
+
+async def group_discard(channel_layer, group, channel):
+    group_tracker.discard(group, channel)
+    await channel_layer.group_discard(group, channel)
+
+
+def message_sent():
+    messages_total.inc()
+    message_rate.mark()
+
+
+class InstrumentedConsumerMixin:
+    """Times every event a consumer handles and counts its open connections."""
+
+    async def dispatch(self, message):
+        consumer = type(self).__name__
+        if message['type'] == 'websocket.connect':
+            connections.inc(consumer)
+        elif message['type'] == 'websocket.disconnect':
+            connections.dec(consumer)
+        start = time.perf_counter()
+        try:
+            await super().dispatch(message)
+        finally:
+            handler_seconds.observe(time.perf_counter() - start, consumer, message['type'])
+
+
+# ----------------------------------------------------------------------- endpoint
+
+class MetricsEndpoint:
+    """
+    ASGI middleware that answers CHAT_METRICS['PATH'] with the metrics above and hands every
+    other HTTP request to ``app``. With CHAT_METRICS['TOKEN'] set, scrapers have to send it as a
+    bearer token. Without a token the metrics are only served with DEBUG on, they name the
+    process's internals and anyone who can reach the ASGI app could read them.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        config = settings.CHAT_METRICS
+        if scope['type'] != 'http' or scope['path'] != config['PATH']:
+            return await self.app(scope, receive, send)
+
+        headers = dict(scope.get('headers', ()))
+        if not config['TOKEN'] and not settings.DEBUG:
+            status, body = 403, b'Forbidden, set METRICS_TOKEN to serve metrics with DEBUG off\n'
+        elif config['TOKEN'] and not hmac.compare_digest(headers.get(b'authorization', b''), f"Bearer {config['TOKEN']}".encode()):
+            status, body = 401, b'Unauthorized\n'
+        else:
+            status, body = 200, render().encode()
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': [
+                (b'content-type', b'text/plain; version=0.0.4; charset=utf-8'),
+                (b'content-length', str(len(body)).encode()),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
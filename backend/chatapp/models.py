@@ -1,9 +1,77 @@
-from django.db import models
+import uuid
+from django.db import models, transaction, IntegrityError
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
 from django.conf import settings
+from django.utils import timezone
+
+class ConversationManager(models.Manager):
+
+    @staticmethod
+    def pair(first_id, second_id):
+        user_low_id, user_high_id = sorted((first_id, second_id))
+        return {'user_low_id': user_low_id, 'user_high_id': user_high_id}
+
+    async def aget_pair(self, first_id, second_id):
+        """The 1:1 conversation between two users through the async ORM, or None if there is none yet."""
+        try:
+            return await self.aget(**self.pair(first_id, second_id))
+        except self.model.DoesNotExist:
+            return None
+
+    def get_or_create_pair(self, first_id, second_id):
+        """
+        Return the 1:1 conversation between two users, creating it if needed. The lookup is a
+        single query on the unique pair index, and the unique constraint settles concurrent
+        creates: the loser of the race gets the winner's conversation.
+        """
+        pair = self.pair(first_id, second_id)
+        try:
+            return self.get(**pair)
+        except self.model.DoesNotExist:
+            pass
+
+        try:
+            with transaction.atomic():
+                conversation = self.create(**pair)
+                conversation.participants.add(*pair.values())
+                return conversation
+        except IntegrityError:
+            return self.get(**pair)
+
+    def record_activity(self, timestamps):
+        """
+        Move ``last_message_at`` of the conversations in ``timestamps`` (conversation id to the
+        time of its newest new message) forward. It never goes back, so messages that are
+        written out of order leave the newest time in place.
+        """
+        for conversation_id, timestamp in timestamps.items():
+            self.filter(id=conversation_id).update(last_message_at=Greatest(F('last_message_at'), Value(timestamp)))
+
 
 class Conversation(models.Model):
     participants = models.ManyToManyField(settings.AUTH_USER_MODEL, related_name='conversations')
+    # Canonical participant pair of a 1:1 conversation, lower user id first. Conversations from
+    # before the pair existed are filled in by the backfill_conversation_pairs command.
+    user_low = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
+    user_high = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.CASCADE, related_name='+')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Time of the newest message, or of the creation while there is none. Kept up to date by
+    # record_activity() as messages are written, so the conversation list is a range scan on the
+    # indexes below. Existing conversations get it from the backfill_conversation_pairs command.
+    last_message_at = models.DateTimeField(default=timezone.now)
+
+    objects = ConversationManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='unique_conversation_pair'),
+        ]
+        indexes = [
+            # A user's conversations, most recently active first, see ConversationListView
+            models.Index(fields=['user_low', '-last_message_at', '-id'], name='conversation_low_activity_idx'),
+            models.Index(fields=['user_high', '-last_message_at', '-id'], name='conversation_high_activity_idx'),
+        ]
 
     def __str__(self):
         # Sort user IDs and join with an underscore
@@ -15,7 +83,70 @@ class Message(models.Model):
     sender = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='sent_messages', on_delete=models.CASCADE)
     receiver = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='received_messages', on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Set when the message object is built rather than when the row is inserted, so a message
+    # that is broadcast before it is written (see chatapp/writebehind.py) keeps its time
+    timestamp = models.DateTimeField(default=timezone.now)
+    # A plain AddField gives every existing row the same default and fails on the unique index.
+    # On a table that already has messages, migrate in three steps: add the column with
+    # null=True, fill it with RunPython (a uuid4() per row), then AlterField to this definition.
+    uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    # When the receiver read the message. A read receipt marks every unread message up to it in
+    # one UPDATE, see ChatConsumer.mark_read
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # Message history is read per conversation in time order, see ConversationMessagesView
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='message_conversation_time_idx'),
+            # Only unread messages are looked up by receiver, so only they are indexed
+            models.Index(
+                fields=['receiver', 'conversation', 'timestamp'],
+                name='message_unread_idx',
+                condition=models.Q(read_at__isnull=True),
+            ),
+        ]
 
     def __str__(self):
         return f'Message from {self.sender} to {self.receiver} at {self.timestamp}'
+
+
+class UnreadCounterManager(models.Manager):
+
+    def increment(self, counts):
+        """
+        Add to the unread counters in ``counts``, a mapping of (user id, conversation id) to the
+        number of new messages. Each counter is one atomic UPDATE; a counter that doesn't exist
+        yet is created, and the unique constraint turns a concurrent create into an update.
+        """
+        for (user_id, conversation_id), count in counts.items():
+            counter = self.filter(user_id=user_id, conversation_id=conversation_id)
+            if counter.update(count=F('count') + count):
+                continue
+            try:
+                with transaction.atomic():
+                    self.create(user_id=user_id, conversation_id=conversation_id, count=count)
+            except IntegrityError:
+                counter.update(count=F('count') + count)
+
+    def decrement(self, user_id, conversation_id, count):
+        self.filter(user_id=user_id, conversation_id=conversation_id).update(count=Greatest(F('count') - count, 0))
+
+
+class UnreadCounter(models.Model):
+    """
+    Number of messages a user hasn't read in a conversation, kept up to date as messages are
+    written and read so nothing has to count them. reconcile_unread_counts repairs any drift.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, related_name='unread_counters', on_delete=models.CASCADE)
+    conversation = models.ForeignKey(Conversation, related_name='unread_counters', on_delete=models.CASCADE)
+    count = models.PositiveIntegerField(default=0)
+
+    objects = UnreadCounterManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'conversation'], name='unique_unread_counter'),
+        ]
+
+    def __str__(self):
+        return f'{self.count} unread for {self.user} in conversation {self.conversation_id}'
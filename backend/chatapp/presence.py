@@ -0,0 +1,99 @@
+import asyncio, logging, time
+from django.conf import settings
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Connection:
+    __slots__ = ('user_id', 'group', 'last_seen')
+
+    def __init__(self, user_id, group):
+        self.user_id = user_id
+        self.group = group
+        self.last_seen = time.monotonic()
+
+
+class PresenceRegistry:
+    """
+    Tracks which users have a chat socket open on this node.
+
+    Every ChatConsumer connection registers once it knows who its user is and is kept alive by
+    the frames the client sends (heartbeats included). A connection that stays silent for
+    CHAT_PRESENCE['TTL'] seconds is taken as dead: it is dropped from the registry and asked to
+    close.
+
+    Nodes don't share the registry. Presence changes go out as 'presence' events to the
+    conversation group instead: a user coming online asks the other members to announce
+    themselves, and a user going offline on one node is announced as online again by any other
+    node that still has a connection for them (see ChatConsumer.presence).
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._connections = {}
+        self._sweeper = None
+        self._channel_layer = None
+
+    def _ensure_started(self, channel_layer):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._connections, self._sweeper = loop, {}, None
+        self._channel_layer = channel_layer
+        if self._sweeper is None:
+            self._sweeper = loop.create_task(self._sweep())
+
+    def is_online(self, user_id, group=None):
+        return any(
+            connection.user_id == user_id and (group is None or connection.group == group)
+            for connection in self._connections.values()
+        )
+
+    def online_users(self, group=None):
+        return {
+            connection.user_id for connection in self._connections.values()
+            if group is None or connection.group == group
+        }
+
+    async def register(self, channel_layer, channel_name, user_id, group):
+        self._ensure_started(channel_layer)
+        was_online = self.is_online(user_id, group)
+        self._connections[channel_name] = Connection(user_id, group)
+        if not was_online:
+            await self.announce(channel_layer, group, user_id, True, reply=True)
+
+    def touch(self, channel_name):
+        connection = self._connections.get(channel_name)
+        if connection is not None:
+            connection.last_seen = time.monotonic()
+
+    async def unregister(self, channel_layer, channel_name):
+        connection = self._connections.pop(channel_name, None)
+        if connection is not None and not self.is_online(connection.user_id, connection.group):
+            await self.announce(channel_layer, connection.group, connection.user_id, False)
+
+    async def announce(self, channel_layer, group, user_id, online, reply=False):
+        await metrics.group_send(channel_layer, group, {
+            'type': 'presence',
+            'user_id': user_id,
+            'online': online,
+            # Asks the other members of the group to announce themselves in return
+            'reply': reply,
+        })
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(settings.CHAT_PRESENCE['SWEEP_INTERVAL'])
+            deadline = time.monotonic() - settings.CHAT_PRESENCE['TTL']
+            stale = [name for name, connection in self._connections.items() if connection.last_seen < deadline]
+            for channel_name in stale:
+                metrics.presence_expired.inc()
+                try:
+                    await self.unregister(self._channel_layer, channel_name)
+                    await self._channel_layer.send(channel_name, {'type': 'presence_expired'})
+                except Exception:
+                    logger.exception('Could not expire chat connection %s', channel_name)
+
+
+presence_registry = PresenceRegistry()
+metrics.Gauge('chat_online_users', 'Users with a registered chat connection on this process.', collect=lambda: {(): len(presence_registry.online_users())})
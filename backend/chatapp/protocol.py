@@ -0,0 +1,79 @@
+"""
+Wire formats for the chat WebSockets.
+
+JSON text frames stay the default. A client can ask for compact binary frames by offering the
+MSGPACK_SUBPROTOCOL subprotocol when it opens the socket, e.g.
+``new WebSocket(url, ["swappynest.msgpack"])``; it then gets msgpack frames and can send
+msgpack frames itself (text frames are still understood).
+
+Events carry timestamps as epoch seconds, which is also what msgpack clients get. JSON clients
+keep getting the string form they always had: the consumer handlers pass each payload's
+``timestamp`` through the codec's stamp() as they build it, so frames are never walked.
+"""
+import json
+from datetime import datetime, timezone
+import msgpack
+
+
+MSGPACK_SUBPROTOCOL = 'swappynest.msgpack'
+
+
+
+def format_timestamp(value):
+    # Same text as str() of an aware datetime, which is what the JSON frames always carried
+    return str(datetime.fromtimestamp(value, tz=timezone.utc))
+
+
+class JsonCodec:
+    subprotocol = None
+    binary = False
+
+    def stamp(self, payload):
+        """``payload`` with its epoch ``timestamp`` in the string form JSON clients expect."""
+        return dict(payload, timestamp=format_timestamp(payload['timestamp']))
+
+    def encode(self, payload):
+        return json.dumps(payload)
+
+    def decode(self, text_data=None, bytes_data=None):
+        return json.loads(text_data if text_data is not None else bytes_data)
+
+
+class MsgpackCodec:
+    subprotocol = MSGPACK_SUBPROTOCOL
+    binary = True
+
+    def stamp(self, payload):
+        return payload
+
+    def encode(self, payload):
+        return msgpack.packb(payload, use_bin_type=True)
+
+    def decode(self, text_data=None, bytes_data=None):
+        if bytes_data is None:
+            return json.loads(text_data)
+        return msgpack.unpackb(bytes_data, raw=False)
+
+
+def negotiate(scope):
+    """Pick the codec for a connection from the subprotocols the client offered."""
+    if MSGPACK_SUBPROTOCOL in scope.get('subprotocols', ()):
+        return MsgpackCodec()
+    return JsonCodec()
+
+
+class CodecConsumerMixin:
+    """WebSocket consumer helpers that send and receive through the negotiated codec."""
+
+    async def accept_with_codec(self):
+        self.codec = negotiate(self.scope)
+        await self.accept(subprotocol=self.codec.subprotocol)
+
+    async def send_payload(self, payload):
+        if self.codec.binary:
+            await self.send(bytes_data=self.codec.encode(payload))
+        else:
+            await self.send(text_data=self.codec.encode(payload))
+
+    def decode_frame(self, text_data=None, bytes_data=None):
+        return self.codec.decode(text_data=text_data, bytes_data=bytes_data)
@@ -1,3 +1,228 @@
-from django.test import TestCase
+import io
+from unittest import mock
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from rest_framework.test import APITestCase
+from user.models import UserAccount
+from rest_framework_simplejwt.tokens import AccessToken
+from . import metrics
+from .auth import JWTAuthMiddleware
+from .models import Conversation, ConversationManager, Message, UnreadCounter
 
-# Create your tests here.
+
+class ConversationPairTest(TestCase):
+
+    def setUp(self):
+        self.users = [
+            UserAccount.objects.create(email=f'user{number}@example.com', username=f'user{number}')
+            for number in range(3)
+        ]
+
+    def legacy_conversation(self, *users):
+        # A conversation from before the canonical pair, only known through its participants
+        conversation = Conversation.objects.create()
+        conversation.participants.add(*users)
+        return conversation
+
+    def test_get_or_create_pair(self):
+        first, second = self.users[:2]
+        conversation = Conversation.objects.get_or_create_pair(second.id, first.id)
+        self.assertEqual((conversation.user_low_id, conversation.user_high_id), (first.id, second.id))
+        self.assertEqual(set(conversation.participants.values_list('id', flat=True)), {first.id, second.id})
+
+        self.assertEqual(Conversation.objects.get_or_create_pair(first.id, second.id), conversation)
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_get_or_create_pair_lost_race(self):
+        first, second = self.users[:2]
+        existing = Conversation.objects.get_or_create_pair(first.id, second.id)
+
+        # The lookup misses as if the other request hadn't committed yet, the create then hits the constraint
+        with mock.patch.object(ConversationManager, 'get', side_effect=[Conversation.DoesNotExist, existing]) as lookup:
+            conversation = Conversation.objects.get_or_create_pair(second.id, first.id)
+
+        self.assertEqual(conversation, existing)
+        self.assertEqual(lookup.call_count, 2)
+        self.assertEqual(Conversation.objects.count(), 1)
+
+    def test_backfill_merges_duplicates(self):
+        first, second, third = self.users
+        oldest = self.legacy_conversation(first, second)
+        duplicate = self.legacy_conversation(second, first)
+        group = self.legacy_conversation(first, second, third)
+        for conversation in (oldest, duplicate, group):
+            Message.objects.create(conversation=conversation, sender=first, receiver=second, content='hi')
+
+        output = io.StringIO()
+        call_command('backfill_conversation_pairs', '--dry-run', stdout=output)
+        self.assertIn('Would have backfilled 1 conversations and merged 1 duplicates', output.getvalue())
+        self.assertEqual(Conversation.objects.count(), 3)
+        self.assertFalse(Conversation.objects.filter(user_low__isnull=False).exists())
+
+        call_command('backfill_conversation_pairs', stdout=io.StringIO())
+        self.assertFalse(Conversation.objects.filter(id=duplicate.id).exists())
+        oldest.refresh_from_db()
+        self.assertEqual((oldest.user_low_id, oldest.user_high_id), (first.id, second.id))
+        self.assertEqual(oldest.messages.count(), 2)
+        self.assertEqual(oldest.last_message_at, oldest.messages.latest('timestamp').timestamp)
+        # Conversations without exactly two participants are left as they are
+        group.refresh_from_db()
+        self.assertIsNone(group.user_low_id)
+        self.assertEqual(group.messages.count(), 1)
+
+        # Running it again changes nothing, and the pair lookup now finds the merged conversation
+        call_command('backfill_conversation_pairs', stdout=io.StringIO())
+        self.assertEqual(Conversation.objects.count(), 2)
+        self.assertEqual(Conversation.objects.get_or_create_pair(second.id, first.id), oldest)
+
+
+class ConversationListTest(APITestCase):
+
+    def setUp(self):
+        self.viewer = UserAccount.objects.create(email='viewer@example.com', username='viewer')
+        self.client.force_authenticate(self.viewer)
+        self.conversations = []
+        for number in range(23):
+            other = UserAccount.objects.create(email=f'user{number}@example.com', username=f'user{number}')
+            self.conversations.append(Conversation.objects.get_or_create_pair(self.viewer.id, other.id))
+
+    def send(self, conversation, content):
+        sender = conversation.user_high_id if conversation.user_low_id == self.viewer.id else conversation.user_low_id
+        message = Message.objects.create(conversation=conversation, sender_id=sender, receiver=self.viewer, content=content)
+        Conversation.objects.record_activity({conversation.id: message.timestamp})
+        UnreadCounter.objects.increment({(self.viewer.id, conversation.id): 1})
+
+    def test_most_recently_active_first(self):
+        quiet, busy = self.conversations[0], self.conversations[1]
+        self.send(quiet, 'first')
+        self.send(busy, 'hello')
+        self.send(busy, 'again')
+
+        page = self.client.get('/api/chatapp/conversations/').data
+        first, second = page['results'][:2]
+        self.assertEqual((first['id'], first['last_message'], first['unread_count']), (busy.id, 'again', 2))
+        self.assertEqual((second['id'], second['last_message'], second['unread_count']), (quiet.id, 'first', 1))
+        self.assertIsNone(page['results'][2]['last_message'])
+
+        rest = self.client.get(page['next']).data
+        self.assertIsNone(rest['next'])
+        ids = [conversation['id'] for conversation in page['results'] + rest['results']]
+        self.assertEqual(sorted(ids), sorted(conversation.id for conversation in self.conversations))
+
+    def test_message_history(self):
+        conversation = self.conversations[0]
+        for number in range(60):
+            self.send(conversation, f'message {number}')
+
+        url = f'/api/chatapp/conversations/{conversation.id}/messages/'
+        page = self.client.get(url).data
+        self.assertEqual(page['results'][0]['text'], 'message 59')
+        # Messages are known by their uuid, the id the WebSocket broadcasts too
+        newest = conversation.messages.latest('timestamp', 'id')
+        self.assertEqual(page['results'][0]['id'], newest.uuid)
+
+        older = self.client.get(page['next']).data
+        self.assertIsNone(older['next'])
+        texts = [message['text'] for message in page['results'] + older['results']]
+        self.assertEqual(texts, [f'message {number}' for number in reversed(range(60))])
+
+
+class UnreadCounterTest(TestCase):
+
+    def setUp(self):
+        self.sender = UserAccount.objects.create(email='sender@example.com', username='sender')
+        self.receiver = UserAccount.objects.create(email='receiver@example.com', username='receiver')
+        self.conversation = Conversation.objects.get_or_create_pair(self.sender.id, self.receiver.id)
+
+    def count(self, user):
+        return UnreadCounter.objects.get(user=user, conversation=self.conversation).count
+
+    def test_increment_and_decrement(self):
+        key = (self.receiver.id, self.conversation.id)
+        UnreadCounter.objects.increment({key: 2})
+        UnreadCounter.objects.increment({key: 3, (self.sender.id, self.conversation.id): 1})
+        self.assertEqual(self.count(self.receiver), 5)
+        self.assertEqual(self.count(self.sender), 1)
+
+        UnreadCounter.objects.decrement(self.receiver.id, self.conversation.id, 4)
+        self.assertEqual(self.count(self.receiver), 1)
+        # Never below zero, e.g. when a receipt covers messages the counter never saw
+        UnreadCounter.objects.decrement(self.receiver.id, self.conversation.id, 4)
+        self.assertEqual(self.count(self.receiver), 0)
+
+    def test_reconcile_unread_counts(self):
+        for _ in range(3):
+            Message.objects.create(conversation=self.conversation, sender=self.sender, receiver=self.receiver, content='hi')
+        Message.objects.create(conversation=self.conversation, sender=self.receiver, receiver=self.sender, content='hi')
+        UnreadCounter.objects.create(user=self.receiver, conversation=self.conversation, count=7)
+
+        output = io.StringIO()
+        call_command('reconcile_unread_counts', '--dry-run', stdout=output)
+        self.assertIn('Would have corrected 1 unread counters and created 1 missing ones', output.getvalue())
+        self.assertEqual(self.count(self.receiver), 7)
+        self.assertFalse(UnreadCounter.objects.filter(user=self.sender).exists())
+
+        call_command('reconcile_unread_counts', stdout=io.StringIO())
+        self.assertEqual(self.count(self.receiver), 3)
+        self.assertEqual(self.count(self.sender), 1)
+
+        # Read messages don't count
+        Message.objects.filter(receiver=self.sender).update(read_at=Message.objects.first().timestamp)
+        call_command('reconcile_unread_counts', stdout=io.StringIO())
+        self.assertEqual(self.count(self.sender), 0)
+
+
+class MetricsEndpointTest(TestCase):
+
+    def scrape(self, headers=()):
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        async def app(scope, receive, send):
+            raise AssertionError('the metrics path must not reach the app')
+
+        scope = {'type': 'http', 'path': '/metrics', 'headers': list(headers)}
+        async_to_sync(metrics.MetricsEndpoint(app))(scope, None, send)
+        return sent[0]['status'], sent[1]['body'].decode()
+
+    def test_needs_a_token_without_debug(self):
+        with override_settings(DEBUG=False, CHAT_METRICS={'PATH': '/metrics', 'TOKEN': ''}):
+            self.assertEqual(self.scrape()[0], 403)
+        with override_settings(DEBUG=True, CHAT_METRICS={'PATH': '/metrics', 'TOKEN': ''}):
+            self.assertEqual(self.scrape()[0], 200)
+
+        with override_settings(DEBUG=False, CHAT_METRICS={'PATH': '/metrics', 'TOKEN': 'secret'}):
+            self.assertEqual(self.scrape()[0], 401)
+            status, body = self.scrape([(b'authorization', b'Bearer secret')])
+        self.assertEqual(status, 200)
+        self.assertIn('# TYPE chat_messages_total counter', body)
+
+    def test_group_sizes_are_bucketed(self):
+        tracker = metrics.GroupTracker()
+        for channel in range(3):
+            tracker.add('chat_5', f'channel{channel}')
+        tracker.add('chat_6', 'channel0')
+        sizes = tracker.by_size()
+        self.assertEqual((sizes['chat', '1'], sizes['chat', '2'], sizes['chat', '5'], sizes['chat', '+Inf']), (1, 1, 2, 2))
+
+
+class JWTAuthMiddlewareTest(TestCase):
+
+    def scope_user(self, query_string):
+        scopes = []
+
+        async def app(scope, receive, send):
+            scopes.append(scope)
+
+        async_to_sync(JWTAuthMiddleware(app))({'type': 'websocket', 'query_string': query_string}, None, None)
+        return scopes[0].get('user')
+
+    def test_user_comes_from_the_token(self):
+        user = UserAccount.objects.create(email='user@example.com', username='user')
+        self.assertEqual(self.scope_user(f'token={AccessToken.for_user(user)}'.encode()), user)
+        self.assertFalse(self.scope_user(b'token=forged').is_authenticated)
+        # Without a token the user the session middleware found stays
+        self.assertIsNone(self.scope_user(b''))
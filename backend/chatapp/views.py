@@ -1,21 +1,45 @@
+from functools import reduce
+from operator import or_
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import permissions
+from rest_framework.pagination import CursorPagination
+from django.db.models import F, FilteredRelation, Q
+from django.db.models.functions import Coalesce
 from .models import Conversation, Message
 from .serializers import MessageSerializer
 from django.contrib.auth import get_user_model
 
 user = get_user_model()
 
+class ConversationPagination(CursorPagination):
+    # Most recently active conversations first, the id breaks ties between equal timestamps
+    ordering = ('-last_message_at', '-id')
+    page_size = 20
+
+
 class ConversationListView(APIView):
     permission_classes = (permissions.IsAuthenticated,)  # Only authenticated users can access this view
+    pagination_class = ConversationPagination
 
     def get(self, request):
-        # Get all conversations that the user is part of
-        conversations = Conversation.objects.filter(participants=request.user)
+        # The user's conversations straight off the (user, last_message_at) indexes, with their
+        # unread counter joined in. Last messages are looked up for the page only.
+        conversations = (
+            Conversation.objects.filter(Q(user_low=request.user) | Q(user_high=request.user))
+            .annotate(
+                viewer_unread=FilteredRelation('unread_counters', condition=Q(unread_counters__user=request.user)),
+                unread_count=Coalesce(F('viewer_unread__count'), 0),
+            )
+            .prefetch_related('participants')
+        )
+
+        paginator = self.pagination_class()
+        page = paginator.paginate_queryset(conversations, request, view=self)
+        last_messages = self.last_messages(page)
         data = []
 
-        for conversation in conversations:
+        for conversation in page:
             # Gather participant data
             participants = [
                 {
@@ -29,39 +53,76 @@ class ConversationListView(APIView):
             ]
 
             # Generate the conversation name: "conversation_user1_user2"
-            participant_usernames = sorted([str(user.id) for user in conversation.participants.all()])
-            conversation_name = f"conversation_{'_'.join(participant_usernames)}"
+            participant_ids = sorted(str(participant['id']) for participant in participants)
+            conversation_name = f"conversation_{'_'.join(participant_ids)}"
 
+            last_message, timestamp = last_messages.get(conversation.id, (None, None))
             # Add the conversation details to the response data
             data.append({
                 'id': conversation.id,
                 'participants': participants,
                 'name': conversation_name,
-                'created_at': conversation.created_at
+                'created_at': conversation.created_at,
+                'last_message': last_message,
+                'timestamp': timestamp,
+                'unread_count': conversation.unread_count,
             })
 
-        return Response(data)
+        return paginator.get_paginated_response(data)
+
+    def last_messages(self, conversations):
+        # The newest message of each conversation sits at its last_message_at, so this is one
+        # index lookup per conversation on the page. Conversations without messages find nothing.
+        if not conversations:
+            return {}
+        rows = Message.objects.filter(reduce(or_, (
+            Q(conversation_id=conversation.id, timestamp=conversation.last_message_at) for conversation in conversations
+        ))).order_by('conversation_id', 'id').values_list('conversation_id', 'content', 'timestamp')
+        # Messages with the same time are told apart by id, the later row wins
+        return {conversation_id: (content, timestamp) for conversation_id, content, timestamp in rows}
+
+class MessagePagination(CursorPagination):
+    # Newest messages first: "next" scrolls back through older history, "previous" comes forward again.
+    # Each page is a range scan on the (conversation, timestamp, id) index, however long the chat is.
+    ordering = ('-timestamp', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
 
-user = get_user_model()
 
 class ConversationMessagesView(APIView):
 
     permission_classes = (permissions.IsAuthenticated,)
+    pagination_class = MessagePagination
 
     def get(self, request, conversation_id):
         try:
             conversation = Conversation.objects.get(id=conversation_id)
-            participants = conversation.participants.all()
-            print(participants)
 
-            
             # Ensure the current user is part of the conversation
-            if request.user not in conversation.participants.all():
+            if not conversation.participants.filter(id=request.user.id).exists():
                 return Response({"error": "Access denied"}, status=403)
 
-            messages = Message.objects.filter(conversation=conversation)
-            message_data = [{"sender": msg.sender.username, "text": msg.content} for msg in messages]
-            return Response(message_data)
+            # Plain rows with the sender's username joined in, no model instances per message
+            messages = Message.objects.filter(conversation=conversation).values(
+                'uuid', 'sender_id', 'content', 'timestamp', 'read_at', sender_username=F('sender__username')
+            )
+
+            paginator = self.pagination_class()
+            page = paginator.paginate_queryset(messages, request, view=self)
+            message_data = [
+                {
+                    # The uuid is the message's id on the wire, the WebSocket sends the same one
+                    "id": msg['uuid'],
+                    "sender_id": msg['sender_id'],
+                    "sender": msg['sender_username'],
+                    "text": msg['content'],
+                    "timestamp": msg['timestamp'],
+                    "read_at": msg['read_at'],
+                }
+                for msg in page
+            ]
+            return paginator.get_paginated_response(message_data)
         
         except Conversation.DoesNotExist:
             return Response({"error": "Conversation not found"}, status=404)
@@ -0,0 +1,170 @@
+import asyncio, atexit, logging, threading
+from collections import Counter
+from django.conf import settings
+from django.db import transaction
+from .models import Conversation, Message, UnreadCounter
+from .metrics import timed_sync_to_async
+from .dbexecutor import db_executor
+
+logger = logging.getLogger(__name__)
+
+
+def latest_activity(messages):
+    # The newest message time per conversation
+    latest = {}
+    for message in messages:
+        if message.conversation_id not in latest or message.timestamp > latest[message.conversation_id]:
+            latest[message.conversation_id] = message.timestamp
+    return latest
+
+
+class MessageWriteBehind:
+    """
+    Write-behind buffer for chat messages, turned on with CHAT_WRITE_BEHIND['ENABLED'].
+
+    Consumers build the Message object (its uuid and timestamp are set on creation), broadcast
+    it straight away and hand it to submit(). A background task on the event loop collects
+    messages until it has BATCH_SIZE of them or the oldest one has waited MAX_LATENCY seconds,
+    then writes them with a single bulk_create. The queue holds at most MAX_QUEUE messages;
+    when it is full submit() waits, which slows down the senders instead of dropping messages.
+
+    submit() returns a future that is done once the message has been written (or given up
+    on), so a connection can wait for its own messages without waiting for everyone else's.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._queue = None
+        self._wakeup = None
+        self._task = None
+        self._last = None
+        # Messages the task has taken off the queue and not written yet, as (message, future)
+        self._batch = []
+        # Held while a batch is written, so drain() at shutdown waits for a write in progress
+        self._writing = threading.Lock()
+
+    @property
+    def config(self):
+        return settings.CHAT_WRITE_BEHIND
+
+    @property
+    def enabled(self):
+        return self.config['ENABLED']
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # A queue belongs to one event loop, carry over anything an old loop left behind.
+            # Nobody on the new loop can be waiting for those messages.
+            leftover = [message for message, _ in self._batch + self._take_all()]
+            self._batch = []
+            self._loop = loop
+            self._queue = asyncio.Queue(maxsize=self.config['MAX_QUEUE'])
+            self._wakeup = asyncio.Event()
+            self._task = None
+            self._last = None
+            for message in leftover:
+                self._queue.put_nowait((message, None))
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run(self._queue, self._wakeup))
+
+    async def submit(self, message):
+        """Queue ``message``. Returns a future that is done once it has been written."""
+        self._ensure_started()
+        written = self._loop.create_future()
+        await self._queue.put((message, written))
+        self._last = written
+        self._wakeup.set()
+        return written
+
+    async def flush(self, pending=None):
+        """
+        Wait until the messages behind the futures in ``pending`` are written or, without
+        ``pending``, every message submitted so far. Batches are written in order, so the
+        latter only has to wait for the last message.
+        """
+        if pending is None:
+            if self._last is None or self._loop is not asyncio.get_running_loop():
+                return
+            pending = [self._last]
+        pending = [written for written in pending if not written.done()]
+        if pending:
+            await asyncio.wait(pending)
+
+    async def _run(self, queue, wakeup):
+        loop = asyncio.get_running_loop()
+        while True:
+            self._batch = batch = [await queue.get()]
+            deadline = loop.time() + self.config['MAX_LATENCY']
+            while True:
+                wakeup.clear()
+                while len(batch) < self.config['BATCH_SIZE'] and not queue.empty():
+                    batch.append(queue.get_nowait())
+                timeout = deadline - loop.time()
+                if len(batch) >= self.config['BATCH_SIZE'] or timeout <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+            futures = [written for _, written in batch]
+            try:
+                await self._persist(batch)
+            except Exception:
+                logger.exception('Could not write %d queued chat messages', len(futures))
+            finally:
+                for written in futures:
+                    if written is not None and not written.done():
+                        written.set_result(None)
+                    queue.task_done()
+
+    @timed_sync_to_async(adapter=db_executor.adapter)
+    def _persist(self, batch):
+        self.write(batch)
+
+    def write(self, batch):
+        # Whoever gets here first writes the batch and empties it: the task, or drain() at shutdown
+        with self._writing:
+            messages = [message for message, _ in batch]
+            batch[:] = []
+            if messages:
+                self.persist(messages)
+
+    def persist(self, batch):
+        try:
+            with transaction.atomic():
+                Message.objects.bulk_create(batch)
+                Conversation.objects.record_activity(latest_activity(batch))
+                UnreadCounter.objects.increment(Counter((message.receiver_id, message.conversation_id) for message in batch))
+        except Exception:
+            # One bad message (e.g. a deleted user) must not take the rest of the batch with it
+            for message in batch:
+                try:
+                    with transaction.atomic():
+                        message.save()
+                        Conversation.objects.record_activity({message.conversation_id: message.timestamp})
+                        UnreadCounter.objects.increment({(message.receiver_id, message.conversation_id): 1})
+                except Exception:
+                    logger.exception('Could not write chat message %s', message.uuid)
+
+    def _take_all(self):
+        batch = []
+        while self._queue is not None and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+            self._queue.task_done()
+        return batch
+
+    def drain(self):
+        """
+        Synchronously write whatever is still queued, used at shutdown. The batch the task was
+        collecting or writing goes first.
+        """
+        self.write(self._batch)
+        batch = self._take_all()
+        if batch:
+            self.write(batch)
+
+
+write_behind = MessageWriteBehind()
+atexit.register(write_behind.drain)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product, Image, Interest, LikedProduct
+from .models import Product, Image, Interest, LikedProduct, Like
 
 
 class ImageAdmin(admin.TabularInline):
@@ -9,7 +9,7 @@ class ImageAdmin(admin.TabularInline):
 
 
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('productname', 'category', 'purchaseyear',)
+    list_display = ('productname', 'category', 'purchaseyear', 'like_count',)
     list_display_links = ('productname',)
     search_fields = ('productname', 'category', 'condition',)
     list_per_page = 50
@@ -27,6 +27,13 @@ class LikedProductsAdmin(admin.ModelAdmin):
     search_fields = ('user',)
     list_per_page = 50
 
+class LikeAdmin(admin.ModelAdmin):
+    list_display = ('user', 'product', 'created_at')
+    list_display_links = ('user',)
+    raw_id_fields = ('user', 'product')
+    list_per_page = 50
+
 admin.site.register(Product, ProductAdmin)
 admin.site.register(Interest, InterestAdmin)
 admin.site.register(LikedProduct, LikedProductsAdmin)
+admin.site.register(Like, LikeAdmin)
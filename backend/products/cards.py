@@ -0,0 +1,187 @@
+import threading, time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+from swappynest import profiling
+
+
+class ProductCardCache:
+    """
+    Read-through cache of serialized product cards.
+
+    Cards are keyed by product id and stored with the product's ``updated_at``, so an edited
+    product never gets an old card back. Image and owner changes don't touch ``updated_at``
+    and are dropped through invalidate() instead (see products/signals.py).
+
+    There are two tiers: a small in-process LRU, and the PRODUCT_CARD_CACHE['ALIAS'] cache
+    (local memory in development and tests, Redis in production). A page of cards is read from
+    the shared tier with one get_many. The LRU only keeps cards for LRU_TTL seconds, because an
+    invalidation in another process can't reach it.
+
+    Cards are stored with relative media URLs and made absolute per request, so the same card
+    serves every host. Anything that depends on the viewer is added per request as well. The
+    cards handed out are the cached objects themselves, so they are copied, never changed.
+
+    Hits and misses are counted per process (stats(), on /api/metrics/requests/) and per
+    sampled request (the ``product_cards.*`` counters of the request profile).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = OrderedDict()
+        self.reset_stats()
+
+    @property
+    def config(self):
+        return settings.PRODUCT_CARD_CACHE
+
+    @property
+    def backend(self):
+        return caches[self.config['ALIAS']]
+
+    def key(self, product_id):
+        return f'product_card:{product_id}'
+
+    def reset_stats(self):
+        with self._lock:
+            self.local_hits = self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            local_hits, hits, misses = self.local_hits, self.hits, self.misses
+        lookups = local_hits + hits + misses
+        return {
+            'local_hits': local_hits,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round((local_hits + hits) / lookups, 4) if lookups else None,
+        }
+
+    def _count(self, local_hits, hits, misses):
+        with self._lock:
+            self.local_hits += local_hits
+            self.hits += hits
+            self.misses += misses
+        profiling.count('product_cards.local_hits', local_hits)
+        profiling.count('product_cards.hits', hits)
+        profiling.count('product_cards.misses', misses)
+
+    # -------------------------------------------------------------- local tier
+
+    def _local_get(self, key, stamp):
+        entry = self._local.get(key)
+        if entry is None:
+            return None
+        expires, cached_stamp, card = entry
+        if expires < time.monotonic() or cached_stamp != stamp:
+            self._local.pop(key, None)
+            return None
+        self._local.move_to_end(key)
+        return card
+
+    def _local_set(self, key, stamp, card):
+        self._local[key] = (time.monotonic() + self.config['LRU_TTL'], stamp, card)
+        self._local.move_to_end(key)
+        while len(self._local) > self.config['LRU_SIZE']:
+            self._local.popitem(last=False)
+
+    # ------------------------------------------------------------------ public
+
+    def get_many(self, products, serialize):
+        """
+        Return the cards of ``products`` in order. ``serialize`` turns a product into a card
+        and is only called for the cards that are in neither tier.
+        """
+        stamps = {product.id: product.updated_at.isoformat() for product in products}
+        cards = {}
+
+        with self._lock:
+            for product in products:
+                card = self._local_get(self.key(product.id), stamps[product.id])
+                if card is not None:
+                    cards[product.id] = card
+        local_hits, hits = len(cards), 0
+
+        wanted = [product for product in products if product.id not in cards]
+        if wanted:
+            stored = self.backend.get_many([self.key(product.id) for product in wanted])
+            missing = {}
+            for product in wanted:
+                entry = stored.get(self.key(product.id))
+                if entry is not None and entry[0] == stamps[product.id]:
+                    cards[product.id] = entry[1]
+                    hits += 1
+                else:
+                    card = cards[product.id] = serialize(product)
+                    missing[self.key(product.id)] = (stamps[product.id], card)
+            if missing:
+                self.backend.set_many(missing, timeout=self.config['TIMEOUT'])
+
+            with self._lock:
+                for product in wanted:
+                    self._local_set(self.key(product.id), stamps[product.id], cards[product.id])
+
+        self._count(local_hits, hits, len(wanted) - hits)
+        return [cards[product.id] for product in products]
+
+    def invalidate(self, *product_ids):
+        keys = [self.key(product_id) for product_id in product_ids]
+        with self._lock:
+            for key in keys:
+                self._local.pop(key, None)
+        if keys:
+            self.backend.delete_many(keys)
+
+
+product_cards = ProductCardCache()
+
+
+def _url_paths(serializer, prefix=()):
+    # Paths to every file field that the serializer renders as a URL, '*' stands for a list
+    paths = []
+    for name, field in serializer.fields.items():
+        if isinstance(field, serializers.ListSerializer):
+            paths += _url_paths(field.child, prefix + (name, '*'))
+        elif isinstance(field, serializers.BaseSerializer):
+            paths += _url_paths(field, prefix + (name,))
+        elif isinstance(field, serializers.FileField) and getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL):
+            paths.append(prefix + (name,))
+    return paths
+
+
+def _absolute(value, path, build):
+    if value is None:
+        return value
+    if not path:
+        return build(value) if isinstance(value, str) else value
+    if path[0] == '*':
+        return [_absolute(item, path[1:], build) for item in value]
+    if path[0] not in value:
+        return value
+    value = dict(value)
+    value[path[0]] = _absolute(value[path[0]], path[1:], build)
+    return value
+
+
+class CachedCardListSerializer(serializers.ListSerializer):
+    """List serializer that reads its cards through ``product_cards``."""
+
+    def to_representation(self, data):
+        products = list(data.all() if hasattr(data, 'all') else data)
+        # Cards are rendered without the request so they hold relative URLs
+        plain = type(self.child)(context={})
+        cards = product_cards.get_many(products, plain.to_representation)
+        # Per viewer fields, e.g. ProductSerializer.personalize
+        personalize = getattr(self.child, 'personalize', None)
+        if personalize is not None:
+            cards = personalize(cards, products)
+
+        request = self.context.get('request')
+        if request is None:
+            return cards
+        paths = _url_paths(self.child)
+        for path in paths:
+            cards = [_absolute(card, path, request.build_absolute_uri) for card in cards]
+        return cards
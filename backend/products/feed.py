@@ -0,0 +1,231 @@
+import hashlib, math, random, time
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F, Q
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.utils.urls import replace_query_param
+from .models import Product, Interest
+from .scoring import fetch_in_order
+
+
+# Feed positions are computed in the database by hashing the id with a couple of multiply
+# and square rounds modulo a prime. Every intermediate value stays below 2**62, so it works
+# with plain integer arithmetic in SQLite and Postgres. The order is fixed for a given seed,
+# and the database only hands back the rows of the requested page.
+MODULUS = 2147483647  # 2**31 - 1
+
+
+def feed_seed(request):
+    """
+    The seed for a request's feed order. Clients can pin it with ``?seed=``, otherwise it is
+    derived from the user and the current FEED_SEED_PERIOD so paging stays stable.
+    """
+    seed = request.query_params.get('seed', '')
+    if seed.isdigit():
+        return int(seed) % MODULUS
+
+    user_key = request.user.id if request.user.is_authenticated else 'anonymous'
+    period = int(time.time() // settings.FEED_SEED_PERIOD)
+    digest = hashlib.blake2b(f'{user_key}:{period}'.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') % MODULUS
+
+
+def seeded_order(queryset, seed):
+    """Order ``queryset`` by a seeded pseudo-random hash of its ids."""
+    digest = hashlib.blake2b(str(seed).encode(), digest_size=8).digest()
+    multiplier = int.from_bytes(digest[:4], 'big') % (MODULUS - 1) + 1
+    offset = int.from_bytes(digest[4:], 'big') % MODULUS
+
+    position = (F('id') * multiplier + offset) % MODULUS
+    position = (position * position) % MODULUS
+    position = (position * multiplier + offset) % MODULUS
+    position = (position * position) % MODULUS
+    # Ties are possible after squaring, the id keeps the order total
+    return queryset.annotate(feed_position=position).order_by('feed_position', 'id')
+
+
+def feed_cache():
+    return caches[settings.FEED_CACHE]
+
+
+def pool_key(category):
+    return f'feed:pool:{category}'
+
+
+GENERATION_KEY = 'feed:generation'
+
+
+def candidate_pools(categories):
+    """
+    The candidate pool of every category in ``categories``: the FEED_POOL_SIZE newest
+    products of the category as (id, owner id) pairs, newest first, and the current catalog
+    generation (see invalidate_feed). Pools live in the FEED_CACHE for FEED_POOL_TTL seconds
+    and are dropped whenever a product of the category is saved or deleted (see
+    products/signals.py).
+    """
+    cache = feed_cache()
+    keys = {pool_key(category): category for category in categories}
+    stored = cache.get_many([GENERATION_KEY, *keys])
+    generation = stored.pop(GENERATION_KEY, 0)
+    pools = {keys[key]: pool for key, pool in stored.items()}
+
+    missing = {}
+    for category in categories:
+        if category not in pools:
+            pool = list(
+                Product.objects.filter(category=category)
+                .order_by('-id')
+                .values_list('id', 'user_id')[:settings.FEED_POOL_SIZE]
+            )
+            pools[category] = missing[pool_key(category)] = pool
+    if missing:
+        cache.set_many(missing, timeout=settings.FEED_POOL_TTL)
+
+    return pools, generation
+
+
+def invalidate_feed(category, catalog_changed):
+    """
+    Drop the candidate pool of ``category``. When products were added or removed the general
+    counts are stale too, they are keyed by the catalog generation, which moves on.
+    """
+    cache = feed_cache()
+    cache.delete(pool_key(category))
+    if catalog_changed:
+        try:
+            cache.incr(GENERATION_KEY)
+        except ValueError:
+            # Evicted or never set, any value the counts weren't keyed by will do
+            cache.set(GENERATION_KEY, random.getrandbits(62), timeout=None)
+
+
+class RankedFeed:
+    """
+    A user's product feed: products from the categories they are interested in, interleaved
+    with everything else at FEED_INTEREST_RATIO.
+
+    Interest products come from the cached candidate pools. The general products are the rest
+    of the catalog in seeded order (see seeded_order), and the pools' id cutoffs keep the two
+    streams apart without an ``id__in`` subquery. Because a slot's stream follows from its
+    position alone, slicing the feed only asks the database for the general ids of that slice.
+
+    The size of the general stream is a COUNT that is kept in the FEED_CACHE per catalog
+    generation and set of pool cutoffs, so it is shared by every user with the same interests.
+    The viewer's own products are left out of their stream and counted on their own, which is
+    one cached number per user. The object behaves like a sequence, so it can be handed to the
+    regular paginator.
+    """
+
+    def __init__(self, user, seed, ratio=None):
+        self.user_id = user.id if user.is_authenticated else None
+        self.seed = seed
+        self.ratio = settings.FEED_INTEREST_RATIO if ratio is None else ratio
+        # The queryset a slice's products are fetched from, views can add select/prefetch_related to it
+        self.rows = Product.objects.all()
+
+        categories = []
+        if self.user_id is not None:
+            for interests in Interest.objects.filter(user_id=self.user_id).values_list('interested_products', flat=True):
+                categories.extend(category for category in interests if category not in categories)
+
+        general = Product.objects.all()
+        pools, generation = candidate_pools(categories)
+        interest_ids, seen, cutoffs = [], set(), []
+        for category, pool in pools.items():
+            for product_id, owner_id in pool:
+                if owner_id != self.user_id and product_id not in seen:
+                    seen.add(product_id)
+                    interest_ids.append(product_id)
+
+            # A full pool only covers the newest products of its category, the older ones stay in the general stream
+            if len(pool) >= settings.FEED_POOL_SIZE:
+                general = general.exclude(Q(category=category) & Q(id__gte=pool[-1][0]))
+                cutoffs.append(f'{category}>={pool[-1][0]}')
+            else:
+                general = general.exclude(category=category)
+                cutoffs.append(category)
+
+        # Sort first so the shuffle only depends on the seed, not on the order the pools came back in
+        interest_ids.sort()
+        random.Random(seed).shuffle(interest_ids)
+        self.interest_ids = interest_ids
+        self._outside_pools = general
+        if self.user_id is not None:
+            general = general.exclude(user_id=self.user_id)
+        self.general = seeded_order(general, seed)
+
+        streams = hashlib.blake2b('\n'.join(sorted(cutoffs)).encode(), digest_size=8).hexdigest()
+        self.count_key = f'feed:count:{generation}:{streams}'
+        self.own_count_key = f'feed:count:{generation}:{streams}:{self.user_id}'
+        self._general_count = None
+
+    @property
+    def general_count(self):
+        if self._general_count is None:
+            cache = feed_cache()
+            keys = [self.count_key] if self.user_id is None else [self.count_key, self.own_count_key]
+            counts = cache.get_many(keys)
+            missing = {}
+            if self.count_key not in counts:
+                counts[self.count_key] = missing[self.count_key] = self._outside_pools.count()
+            if self.user_id is not None and self.own_count_key not in counts:
+                own = self._outside_pools.filter(user_id=self.user_id).count()
+                counts[self.own_count_key] = missing[self.own_count_key] = own
+            if missing:
+                cache.set_many(missing, timeout=settings.FEED_POOL_TTL)
+            self._general_count = counts[self.count_key] - counts.get(self.own_count_key, 0)
+        return self._general_count
+
+    def count(self):
+        return len(self.interest_ids) + self.general_count
+
+    def __len__(self):
+        return self.count()
+
+    def _interest_before(self, position):
+        # How many of the first ``position`` slots are interest products. The ratio decides,
+        # unless one of the streams has run dry and the other one has to fill the slot.
+        target = min(math.floor(position * self.ratio), len(self.interest_ids))
+        return max(target, position - self.general_count)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+
+        start, stop, _ = index.indices(self.count())
+        if start >= stop:
+            return []
+
+        first_interest, last_interest = self._interest_before(start), self._interest_before(stop)
+        interest = iter(self.interest_ids[first_interest:last_interest])
+        general_ids = []
+        if stop - last_interest > start - first_interest:
+            general_ids = self.general.values_list('id', flat=True)[start - first_interest:stop - last_interest]
+        general = iter(general_ids)
+
+        product_ids = []
+        for position in range(start, stop):
+            stream = interest if self._interest_before(position + 1) > self._interest_before(position) else general
+            product_ids.append(next(stream))
+
+        # Products deleted since the pools were cached are simply missing from the page
+        return fetch_in_order(self.rows, product_ids)
+
+
+class FeedPagination(PageNumberPagination):
+    """Page number pagination that carries the feed seed in the next/previous links."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.seed = getattr(view, 'feed_seed', None)
+        return super().paginate_queryset(queryset, request, view)
+
+    def _with_seed(self, url):
+        if url is None or self.seed is None:
+            return url
+        return replace_query_param(url, 'seed', self.seed)
+
+    def get_next_link(self):
+        return self._with_seed(super().get_next_link())
+
+    def get_previous_link(self):
+        return self._with_seed(super().get_previous_link())
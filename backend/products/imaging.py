@@ -0,0 +1,119 @@
+import io, logging, os
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from PIL import Image as PILImage, ImageOps
+from .cards import product_cards
+
+logger = logging.getLogger(__name__)
+
+
+def render_sizes(source, sizes, quality):
+    """
+    Decode ``source`` once, turn it upright by its EXIF orientation and return it re-encoded as
+    a JPEG per entry of ``sizes`` ({name: longest side}). Images are never scaled up, and the
+    EXIF data (camera, location, ...) is not copied over.
+    """
+    with PILImage.open(source) as image:
+        image.draft('RGB', (max(sizes.values()),) * 2)
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        rendered = {}
+        # Largest first, every smaller size is scaled down from the one before it
+        for name, side in sorted(sizes.items(), key=lambda item: -item[1]):
+            image.thumbnail((side, side), PILImage.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, 'JPEG', quality=quality, optimize=True, progressive=True)
+            rendered[name] = buffer.getvalue()
+        return rendered
+
+
+class ImageProcessor:
+    """
+    Generates the PRODUCT_IMAGES['SIZES'] of uploaded product photos on a small local thread pool,
+    so the upload request only has to store the originals. Until an image is done, its serializer
+    falls back to the original for every size. The queue lives in memory, images it lost (or that
+    miss a newly added size) are queued again by the requeue_image_variants command.
+
+    With PRODUCT_IMAGES['WORKERS'] = 0 images are processed right away in the calling thread,
+    which is what the tests use.
+    """
+
+    def __init__(self):
+        self._pool = None
+
+    @property
+    def config(self):
+        return settings.PRODUCT_IMAGES
+
+    @property
+    def pool(self):
+        if self._pool is None and self.config['WORKERS'] > 0:
+            self._pool = ThreadPoolExecutor(max_workers=self.config['WORKERS'], thread_name_prefix='product-images')
+        return self._pool
+
+    def submit(self, image_ids):
+        """Process ``image_ids`` once the current transaction commits."""
+        image_ids = list(image_ids)
+        transaction.on_commit(lambda: self._submit(image_ids))
+
+    def _submit(self, image_ids):
+        pool = self.pool
+        for image_id in image_ids:
+            if pool is None:
+                self.process(image_id)
+            else:
+                pool.submit(self._run, image_id)
+
+    def shutdown(self):
+        """Wait for the images that are being processed, e.g. before the media directory goes away."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def _run(self, image_id):
+        # Pool threads live outside the request cycle, so they look after their own connection
+        close_old_connections()
+        try:
+            self.process(image_id)
+        except Exception:
+            logger.exception('Could not process product image %s', image_id)
+        finally:
+            close_old_connections()
+
+    def process(self, image_id):
+        """
+        Render the sizes ``image_id`` is missing. Every saved size holds a blob reference, so the
+        ones its variants don't end up pointing at are deleted again.
+        """
+        from .models import Image
+
+        image = Image.objects.filter(id=image_id).first()
+        if image is None or not image.image:
+            return
+        sizes = {name: side for name, side in self.config['SIZES'].items() if name not in image.variants}
+        if not sizes:
+            return
+        storage = image.image.storage
+        with image.image.open('rb') as source:
+            rendered = render_sizes(source, sizes, self.config['QUALITY'])
+
+        stem = os.path.splitext(image.image.name)[0]
+        saved = {
+            name: storage.save(f'{stem}-{name}.jpg', ContentFile(content))
+            for name, content in rendered.items()
+        }
+        # Only if nothing changed the variants meanwhile: the image may have been deleted, or another
+        # run may have saved these sizes first. Either way nothing points at ours then.
+        if not Image.objects.filter(id=image_id, variants=image.variants).update(variants={**image.variants, **saved}):
+            for name in saved.values():
+                storage.delete(name)
+            return
+        # The product's cached card still points at the original
+        product_cards.invalidate(image.product_id)
+
+
+image_processor = ImageProcessor()
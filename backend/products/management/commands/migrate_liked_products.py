@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from products.models import Product, LikedProduct, Like
+
+
+class Command(BaseCommand):
+    help = (
+        'Copy the LikedProduct JSON lists into the Like table and recount every product\'s '
+        'like_count from it. Likes that already exist are left alone, so it is safe to run '
+        'again, and ids of products that no longer exist are skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would change without writing anything.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Likes written per query.')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        batch_size = options['batch_size']
+
+        product_ids = set(Product.objects.values_list('id', flat=True))
+        likes, skipped = [], 0
+        for liked in LikedProduct.objects.only('user_id', 'liked_products').iterator():
+            for value in set(liked.liked_products or ()):
+                try:
+                    product_id = int(value)
+                except (TypeError, ValueError):
+                    product_id = None
+                if product_id not in product_ids:
+                    skipped += 1
+                    continue
+                likes.append(Like(user_id=liked.user_id, product_id=product_id))
+
+        counts = Like.objects.filter(product=OuterRef('pk')).order_by().values('product').annotate(total=Count('id')).values('total')
+        if not dry_run:
+            with transaction.atomic():
+                Like.objects.bulk_create(likes, batch_size=batch_size, ignore_conflicts=True)
+                recounted = Product.objects.update(like_count=Coalesce(Subquery(counts), 0))
+        else:
+            recounted = len(product_ids)
+
+        prefix = 'Would have ' if dry_run else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'{prefix}copied {len(likes)} likes, skipped {skipped} unknown products and recounted {recounted} products.'
+        ))
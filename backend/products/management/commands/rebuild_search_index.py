@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from products.models import Product
+from products.search import search_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the product search index (vocabulary and document matrix) from scratch.'
+
+    def handle(self, *args, **options):
+        products = Product.objects.only('id', 'productname', 'description').order_by('id').iterator(chunk_size=2000)
+        search_index.build(products)
+        self.stdout.write(self.style.SUCCESS(
+            f'Indexed {len(search_index.base_ids)} products into {search_index.path}.'
+        ))
@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from products.imaging import image_processor
+from products.models import Image
+
+
+class Command(BaseCommand):
+    help = (
+        'Queue every product image that is missing one of the PRODUCT_IMAGES sizes for processing '
+        'again, e.g. after the process died with uploads still queued or after a size was added. '
+        'Those images are served from the original until they are done.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report what would be queued without processing anything.')
+        parser.add_argument('--batch-size', type=int, default=500, help='Images queued at a time.')
+
+    def handle(self, *args, **options):
+        sizes = list(settings.PRODUCT_IMAGES['SIZES'])
+        image_ids = list(
+            Image.objects.exclude(image='').exclude(variants__has_keys=sizes).order_by('id').values_list('id', flat=True)
+        )
+
+        if options['dry_run']:
+            self.stdout.write(f'Would have queued {len(image_ids)} images.')
+            return
+
+        batch_size = options['batch_size']
+        for start in range(0, len(image_ids), batch_size):
+            image_processor.submit(image_ids[start:start + batch_size])
+        # The pool threads don't outlive the command, wait for them
+        image_processor.shutdown()
+        self.stdout.write(self.style.SUCCESS(f'Queued {len(image_ids)} images for {", ".join(sizes)}.'))
@@ -1,5 +1,7 @@
 import uuid
-from django.db import models
+from django.db import IntegrityError, models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from user.models import UserAccount
 
 # Create your models here.
@@ -46,6 +48,8 @@ class Product(models.Model):
     category = models.CharField(max_length=100, choices=CATEGORY_CHOICES)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Kept up to date by Like.objects.toggle, migrate_liked_products recounts it
+    like_count = models.PositiveIntegerField(default=0, editable=False)
 
     def __str__(self):
         return self.productname 
@@ -54,9 +58,18 @@ class Image(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='images')
     image = models.ImageField(upload_to='products')
     uuid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
+    # File names of the generated sizes by size name, filled in by products/imaging.py
+    variants = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"{self.uuid}--{self.product.productname}"
+
+    def variant(self, size):
+        """The file of the given size, or the original while it hasn't been generated."""
+        name = self.variants.get(size)
+        if not name:
+            return self.image
+        return self.image.field.attr_class(self, self.image.field, name)
     
 class Interest(models.Model):
     user = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
@@ -66,8 +79,58 @@ class Interest(models.Model):
         return f"{self.user}'s interested products"
 
 class LikedProduct(models.Model):
+    # Replaced by Like, only read by the migrate_liked_products command now
     user = models.ForeignKey(UserAccount, on_delete=models.CASCADE)
     liked_products = models.JSONField(default=list, blank=True)
     
     def __str__(self):
-        return f"{self.user}'s liked products"
\ No newline at end of file
+        return f"{self.user}'s liked products"
+
+
+class LikeManager(models.Manager):
+
+    def toggle(self, user, product_id):
+        """
+        Like ``product_id`` for ``user`` if they don't like it yet, unlike it otherwise, and return
+        whether it is liked now. The unique constraint settles two toggles racing each other, and
+        the product's like_count moves by one atomic UPDATE.
+        """
+        with transaction.atomic():
+            products = Product.objects.filter(id=product_id)
+            if self.filter(user=user, product_id=product_id).delete()[0]:
+                products.update(like_count=Greatest(F('like_count') - 1, 0))
+                return False
+            try:
+                with transaction.atomic():
+                    self.create(user=user, product_id=product_id)
+            except IntegrityError:
+                # Either a concurrent toggle liked it first, or there is no such product
+                if not products.exists():
+                    raise Product.DoesNotExist(f'No product with id {product_id}.')
+                return True
+            if not products.update(like_count=F('like_count') + 1):
+                raise Product.DoesNotExist(f'No product with id {product_id}.')
+            return True
+
+    def liked_ids(self, user, product_ids):
+        """Which of ``product_ids`` ``user`` likes, in one query."""
+        if not user.is_authenticated or not product_ids:
+            return set()
+        return set(self.filter(user=user, product_id__in=product_ids).values_list('product_id', flat=True))
+
+
+class Like(models.Model):
+    """One user liking one product."""
+    user = models.ForeignKey(UserAccount, related_name='likes', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, related_name='likes', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = LikeManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'product'], name='unique_like'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} likes {self.product_id}'
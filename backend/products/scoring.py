@@ -0,0 +1,62 @@
+"""
+Batched similarity scoring shared by search, similar products and recommendations.
+
+Documents are rows of an L2-normalised sparse matrix (see products/search.py), so the cosine
+similarity of every document against a query is a single sparse matrix-vector product, and
+the best k of those scores are picked with a partial selection instead of a full sort.
+"""
+import numpy as np
+
+
+def score_rows(matrix, vector):
+    """Score every row of ``matrix`` against the (1 x terms) sparse ``vector`` in one product."""
+    if matrix is None or not matrix.shape[0]:
+        return np.empty(0)
+    return matrix.dot(vector.T).toarray().ravel()
+
+
+def top_k(scores, k):
+    """Positions of the ``k`` highest positive ``scores``, best first."""
+    candidates = np.flatnonzero(scores > 0)
+    if k <= 0 or not len(candidates):
+        return candidates[:0]
+
+    if len(candidates) > k:
+        # argpartition puts the k best in front (in no particular order) in O(n)
+        best = np.argpartition(-scores[candidates], k - 1)[:k]
+        candidates = candidates[best]
+
+    # Only the k winners get sorted, ties keep their index order
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def rank(segments, vector, k, exclude=()):
+    """
+    Return the ids of the ``k`` rows most similar to ``vector``, best first.
+
+    ``segments`` is a list of ``(matrix, ids, mask)`` tuples, where ``ids`` maps the rows of
+    ``matrix`` to product ids and ``mask`` (or None) flags the rows that are still live.
+    Ids in ``exclude`` are never returned.
+    """
+    all_scores, all_ids = [], []
+    for matrix, ids, mask in segments:
+        scores = score_rows(matrix, vector)
+        if mask is not None and len(scores):
+            scores = np.where(mask, scores, 0)
+        all_scores.append(scores)
+        all_ids.append(np.asarray(ids, dtype=np.int64)[:len(scores)])
+
+    if not all_scores:
+        return []
+    scores = np.concatenate(all_scores)
+    ids = np.concatenate(all_ids)
+    if len(exclude):
+        scores[np.isin(ids, np.fromiter(exclude, dtype=np.int64))] = 0
+
+    return [int(product_id) for product_id in ids[top_k(scores, k)]]
+
+
+def fetch_in_order(queryset, ids):
+    """Fetch the objects for ``ids`` in one query, keeping the order of ``ids``."""
+    objects = queryset.in_bulk(ids)
+    return [objects[object_id] for object_id in ids if object_id in objects]
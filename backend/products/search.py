@@ -0,0 +1,378 @@
+import contextlib, fcntl, json, logging, os, threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy import sparse
+from django.conf import settings
+from sklearn.feature_extraction.text import TfidfVectorizer
+from . import scoring
+
+logger = logging.getLogger(__name__)
+
+
+def product_text(product):
+    # The text that gets indexed for a product, same as what the search view used to vectorize
+    return product.productname + " " + product.description
+
+
+class SearchIndex:
+    """
+    TF-IDF index over the product catalog.
+
+    The vocabulary and the document matrix are fitted once (see the rebuild_search_index
+    command) and written to SEARCH_INDEX_DIR as plain .npy arrays, which are memory-mapped
+    when loaded. Saved and deleted products are applied on top of that base matrix as a
+    small delta (re-vectorized with the existing vocabulary), so a request only has to
+    transform the query. Terms that are not in the vocabulary are picked up by the next rebuild.
+
+    Every worker process writes the same files, so writes hold an exclusive lock on
+    SEARCH_INDEX_DIR/.lock and re-read the delta under it before changing it; otherwise two
+    workers saving products at once would each write their own copy and drop the other's.
+    """
+
+    BASE_FILES = ('data', 'indices', 'indptr', 'ids')
+
+    def __init__(self, path=None):
+        self._path = path
+        self._lock = threading.RLock()
+        self._manifest_mtime = None
+        self._reset()
+
+    def _reset(self):
+        self.build_id = None
+        self.vectorizer = None
+        self.base = None
+        self.base_ids = np.empty(0, dtype=np.int64)
+        self.base_rows = {}
+        self.base_mask = np.empty(0, dtype=bool)
+        self.delta = {}
+        self.removed = set()
+        self.delta_generation = 0
+        self._delta_cache = None
+
+    @property
+    def path(self):
+        return self._path or settings.SEARCH_INDEX_DIR
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    @contextlib.contextmanager
+    def _writing(self):
+        # The thread lock keeps this process's threads apart, flock() the other processes
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file('.lock'), 'a') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _reload(self):
+        # Under _writing(): another process may have written the delta within the manifest's
+        # mtime resolution, so it is read again whatever the mtime says
+        if not self.exists():
+            self._reset()
+            self._manifest_mtime = None
+            return False
+        self._load()
+        return True
+
+    # ----------------------------------------------------------------- building
+
+    def build(self, products):
+        """Fit the vocabulary on ``products`` and write a fresh index to disk."""
+        ids, texts = [], []
+        for product in products:
+            ids.append(product.id)
+            texts.append(product_text(product))
+
+        with self._writing():
+            vectorizer = TfidfVectorizer(stop_words='english')
+            try:
+                matrix = vectorizer.fit_transform(texts).tocsr()
+                vocabulary = {term: int(column) for term, column in vectorizer.vocabulary_.items()}
+                idf = vectorizer.idf_
+            except ValueError:
+                # Empty catalog, or nothing but stop words in it
+                matrix = sparse.csr_matrix((0, 0))
+                vocabulary, idf = {}, np.empty(0)
+
+            self._reset()
+            self._write_base(matrix, np.asarray(ids, dtype=np.int64))
+            np.save(self._file('idf.npy'), idf)
+            self._write_json('vocabulary.json', vocabulary)
+            self._write_delta()
+            self._write_manifest(len(ids))
+            self._load()
+
+    def compact(self):
+        """Fold the delta into the base matrix, keeping the current vocabulary."""
+        with self._writing():
+            if not self._reload() or not self.delta and not self.removed:
+                return
+            keep = np.flatnonzero(self.base_mask)
+            delta_ids, delta_rows = self._delta_matrix()
+            matrix = self.base[keep]
+            ids = self.base_ids[keep]
+            if delta_rows is not None:
+                matrix = sparse.vstack([matrix, delta_rows]).tocsr()
+                ids = np.concatenate([ids, delta_ids])
+
+            self.delta, self.removed = {}, set()
+            self._write_base(matrix, ids.astype(np.int64))
+            self._write_delta()
+            self._write_manifest(len(ids))
+            self._load()
+
+    def _write_manifest(self, documents):
+        self._write_json('manifest.json', {'build_id': os.urandom(8).hex(), 'documents': documents})
+
+    def _write_base(self, matrix, ids):
+        matrix.sort_indices()
+        arrays = {
+            'data': matrix.data.astype(np.float64),
+            'indices': matrix.indices.astype(np.int32),
+            'indptr': matrix.indptr.astype(np.int64),
+            'ids': ids,
+        }
+        for name, array in arrays.items():
+            tmp = self._file(f'{name}.tmp.npy')
+            np.save(tmp, array)
+            os.replace(tmp, self._file(f'{name}.npy'))
+
+    def _write_json(self, name, payload):
+        tmp = self._file(f'{name}.tmp')
+        with open(tmp, 'w') as handle:
+            json.dump(payload, handle)
+        os.replace(tmp, self._file(name))
+
+    # ------------------------------------------------------------------ loading
+
+    def exists(self):
+        return os.path.exists(self._file('manifest.json'))
+
+    def _load(self):
+        with open(self._file('manifest.json')) as handle:
+            manifest = json.load(handle)
+        self._manifest_mtime = os.stat(self._file('manifest.json')).st_mtime_ns
+
+        if manifest['build_id'] != self.build_id:
+            with open(self._file('vocabulary.json')) as handle:
+                vocabulary = json.load(handle)
+            idf = np.load(self._file('idf.npy'))
+            arrays = {name: np.load(self._file(f'{name}.npy'), mmap_mode='r') for name in self.BASE_FILES}
+
+            if vocabulary:
+                vectorizer = TfidfVectorizer(stop_words='english', vocabulary=vocabulary)
+                vectorizer.idf_ = idf
+            else:
+                vectorizer = None
+
+            ids = np.asarray(arrays['ids'])
+            self.build_id = manifest['build_id']
+            self.vectorizer = vectorizer
+            self.base = sparse.csr_matrix(
+                (arrays['data'], arrays['indices'], arrays['indptr']),
+                shape=(len(ids), len(vocabulary)),
+                copy=False,
+            )
+            self.base_ids = ids
+            self.base_rows = {int(product_id): row for row, product_id in enumerate(ids)}
+
+        self._load_delta()
+
+    def _load_delta(self):
+        delta, generation, removed = {}, 0, set()
+        if os.path.exists(self._file('delta.npz')):
+            with np.load(self._file('delta.npz')) as stored:
+                generation = int(stored['generation'])
+                removed = {int(product_id) for product_id in stored['removed']}
+                if len(stored['ids']):
+                    rows = sparse.csr_matrix(
+                        (stored['data'], stored['indices'], stored['indptr']),
+                        shape=(len(stored['ids']), self.base.shape[1]),
+                    )
+                    delta = {int(product_id): rows[row] for row, product_id in enumerate(stored['ids'])}
+
+        self.delta = delta
+        self.removed = removed
+        self.delta_generation = generation
+        self._delta_cache = None
+        self.base_mask = np.ones(len(self.base_ids), dtype=bool)
+        for product_id in removed | set(delta):
+            row = self.base_rows.get(product_id)
+            if row is not None:
+                self.base_mask[row] = False
+
+    def refresh(self):
+        """Load the index from disk, or reload it when another process has changed it."""
+        with self._lock:
+            try:
+                mtime = os.stat(self._file('manifest.json')).st_mtime_ns
+            except FileNotFoundError:
+                self._reset()
+                self._manifest_mtime = None
+                return False
+            if mtime != self._manifest_mtime:
+                self._load()
+            return True
+
+    def ensure_built(self, products):
+        """Build the index from ``products`` if it has never been built."""
+        with self._lock:
+            if not self.refresh():
+                self.build(products)
+
+    # -------------------------------------------------------- incremental update
+
+    def _write_delta(self):
+        ids, rows = self._delta_matrix()
+        if rows is not None:
+            data, indices, indptr = rows.data, rows.indices, rows.indptr
+        else:
+            data, indices, indptr = np.empty(0), np.empty(0, dtype=np.int32), np.zeros(1, dtype=np.int64)
+
+        tmp = self._file('delta.tmp.npz')
+        with open(tmp, 'wb') as handle:
+            np.savez(
+                handle, ids=ids, data=data, indices=indices, indptr=indptr,
+                removed=np.asarray(sorted(self.removed), dtype=np.int64),
+                generation=np.int64(self.delta_generation),
+            )
+        os.replace(tmp, self._file('delta.npz'))
+
+    def _commit_delta(self):
+        self.delta_generation += 1
+        self._delta_cache = None
+        self._write_delta()
+        # Touch the manifest so other processes notice the change on their next search
+        os.utime(self._file('manifest.json'))
+        self._manifest_mtime = os.stat(self._file('manifest.json')).st_mtime_ns
+
+    def update(self, changes):
+        """
+        Apply ``changes``, a mapping of product id to the product's text or None for a deleted
+        product, in one write of the delta. Saved products are re-vectorized with the current
+        vocabulary.
+        """
+        if not changes or not self.exists():
+            return
+        with self._writing():
+            if not self._reload() or self.vectorizer is None:
+                return
+            for product_id, text in changes.items():
+                row = self.base_rows.get(product_id)
+                if row is not None:
+                    self.base_mask[row] = False
+                if text is None:
+                    if row is not None:
+                        self.removed.add(product_id)
+                    self.delta.pop(product_id, None)
+                else:
+                    self.removed.discard(product_id)
+                    self.delta[product_id] = self.transform(text)
+            self._commit_delta()
+
+    # ------------------------------------------------------------------ querying
+
+    def _delta_matrix(self):
+        if self._delta_cache is None:
+            ids = np.asarray(list(self.delta), dtype=np.int64)
+            rows = sparse.vstack([self.delta[int(product_id)] for product_id in ids]).tocsr() if len(ids) else None
+            self._delta_cache = (ids, rows)
+        return self._delta_cache
+
+    def transform(self, text):
+        return self.vectorizer.transform([text]).tocsr()
+
+    def vector(self, product_id):
+        """The indexed vector of a product, or None when the product is not in the index."""
+        if product_id in self.delta:
+            return self.delta[product_id]
+        row = self.base_rows.get(product_id)
+        if row is None or not self.base_mask[row]:
+            return None
+        return self.base[row]
+
+    def _rank(self, vector, limit, exclude=()):
+        delta_ids, delta_rows = self._delta_matrix()
+        segments = [(self.base, self.base_ids, self.base_mask), (delta_rows, delta_ids, None)]
+        return scoring.rank(segments, vector, limit, exclude=exclude)
+
+    def search(self, text, limit):
+        """Return the ids of the ``limit`` products most similar to ``text``, best first."""
+        with self._lock:
+            if not self.refresh() or self.vectorizer is None:
+                return []
+            query = self.transform(text)
+            if not query.nnz:
+                return []
+            return self._rank(query, limit)
+
+    def similar(self, product_id, limit):
+        """Return the ids of the ``limit`` products most similar to an indexed product."""
+        with self._lock:
+            if not self.refresh() or self.vectorizer is None:
+                return []
+            vector = self.vector(product_id)
+            if vector is None or not vector.nnz:
+                return []
+            return self._rank(vector, limit, exclude=(product_id,))
+
+
+search_index = SearchIndex()
+
+
+class SearchIndexUpdater:
+    """
+    Applies product saves and deletes to ``search_index`` on one background thread, so a request
+    that saves a product doesn't wait for the index lock or for the delta to be written. Changes
+    that come in while a batch is being written are collected and written together with the
+    next one. Once the delta has grown past SEARCH_INDEX_DELTA_LIMIT the thread folds it into
+    the base matrix as well.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._pool = None
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search-index')
+        return self._pool
+
+    def upsert(self, product):
+        self._queue(product.id, product_text(product))
+
+    def remove(self, product_id):
+        self._queue(product_id, None)
+
+    def _queue(self, product_id, text):
+        with self._lock:
+            scheduled = bool(self._pending)
+            self._pending[product_id] = text
+        if not scheduled:
+            self.pool.submit(self._apply)
+
+    def _apply(self):
+        with self._lock:
+            changes, self._pending = self._pending, {}
+        try:
+            self.index.update(changes)
+            if len(self.index.delta) > settings.SEARCH_INDEX_DELTA_LIMIT:
+                self.index.compact()
+        except Exception:
+            logger.exception('Could not update the search index for %d products', len(changes))
+
+    def shutdown(self):
+        """Wait for the changes that are queued, e.g. before the index directory goes away."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+search_updates = SearchIndexUpdater(search_index)
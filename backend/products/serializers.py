@@ -1,14 +1,36 @@
-from rest_framework.serializers import ModelSerializer, DateField, DateTimeField
-from .models import Product, Image, Interest
+from django.conf import settings
+from rest_framework.serializers import ModelSerializer, DateField, DateTimeField, ImageField, SerializerMethodField
+from .models import Product, Image, Interest, Like
 from user.serializers import UserSerializer
+from swappynest.mixins import EagerLoadingMixin
+from .cards import CachedCardListSerializer
+
+class ImageVariantField(ImageField):
+    """URL of one generated size of an Image, see Image.variant."""
+
+    def __init__(self, size, **kwargs):
+        self.size = size
+        super().__init__(source='*', read_only=True, **kwargs)
+
+    def to_representation(self, image):
+        return super().to_representation(image.variant(self.size))
+
 
 class ImageSerializer(ModelSerializer):
+    """The original image, plus one URL per PRODUCT_IMAGES['SIZES'] entry (thumbnail, card, large)."""
+
     class Meta:
         model = Image
         fields = ('image',)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        for size in settings.PRODUCT_IMAGES['SIZES']:
+            fields[size] = ImageVariantField(size)
+        return fields
         
         
-class ProductSerializer(ModelSerializer):
+class ProductSerializer(EagerLoadingMixin, ModelSerializer):
     # Assuming you have an ImageSerializer to handle the images
     images = ImageSerializer(many=True)  
     user = UserSerializer(read_only=True)
@@ -19,9 +41,39 @@ class ProductSerializer(ModelSerializer):
     # Format the created_at field to display only date and time (hour and minute)
     created_at = DateTimeField(format='%Y-%m-%d %H:%M')
 
+    # Whether the request's user likes the product, filled in by personalize()
+    is_liked = SerializerMethodField()
+
     class Meta:
         model = Product
         fields = '__all__'
+        # Lists of products are read through the product card cache
+        list_serializer_class = CachedCardListSerializer
+
+    def viewer(self):
+        return getattr(self.context.get('request'), 'user', None)
+
+    def get_is_liked(self, product):
+        return False
+
+    def to_representation(self, product):
+        card = super().to_representation(product)
+        # A single product gets the same viewer lookup a list does for its whole page
+        if self.parent is None:
+            card = self.personalize([card], [product])[0]
+        return card
+
+    def personalize(self, cards, products):
+        """
+        The viewer's side of a page of cached cards: ``is_liked`` from one lookup for the whole
+        page, and ``like_count`` from the product rows, which are fresher than the cards.
+        """
+        viewer = self.viewer()
+        liked = Like.objects.liked_ids(viewer, [product.id for product in products]) if viewer is not None else set()
+        return [
+            {**card, 'like_count': product.like_count, 'is_liked': product.id in liked}
+            for card, product in zip(cards, products)
+        ]
         
 class InterestSerializer(ModelSerializer):
     class Meta:
@@ -0,0 +1,65 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from user.models import UserAccount
+from .models import Product, Image
+from .search import search_updates
+from .feed import invalidate_feed
+from .cards import product_cards
+
+
+# Keep the search index in step with the catalog. Changes are queued once the transaction
+# commits, so a rolled back save never shows up in search results, and written to the index
+# in the background, so saving a product doesn't wait for it.
+@receiver(post_save, sender=Product)
+def index_saved_product(sender, instance, **kwargs):
+    transaction.on_commit(lambda: search_updates.upsert(instance))
+
+
+@receiver(post_delete, sender=Product)
+def unindex_deleted_product(sender, instance, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: search_updates.remove(product_id))
+
+
+# A new or changed product makes its category's feed candidate pool stale, and a new or
+# deleted one the cached size of the general stream as well
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_feed_pool(sender, instance, created=True, **kwargs):
+    category = instance.category
+    transaction.on_commit(lambda: invalidate_feed(category, catalog_changed=created))
+
+
+# Cached product cards embed the product, its images and its owner
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_card(sender, instance, **kwargs):
+    product_id = instance.id
+    transaction.on_commit(lambda: product_cards.invalidate(product_id))
+
+
+@receiver(post_save, sender=Image)
+@receiver(post_delete, sender=Image)
+def invalidate_image_product_card(sender, instance, **kwargs):
+    product_id = instance.product_id
+    transaction.on_commit(lambda: product_cards.invalidate(product_id))
+
+
+@receiver(post_save, sender=UserAccount)
+def invalidate_owner_product_cards(sender, instance, created, update_fields=None, **kwargs):
+    # Logging in only touches last_login, which is not on the cards
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    user_id = instance.id
+    transaction.on_commit(lambda: product_cards.invalidate(
+        *Product.objects.filter(user_id=user_id).values_list('id', flat=True)
+    ))
+
+
+# The generated sizes of a deleted image hold blob references too, the original is released by blobstore
+@receiver(post_delete, sender=Image)
+def release_image_variants(sender, instance, **kwargs):
+    storage = instance.image.storage
+    names = list(instance.variants.values())
+    transaction.on_commit(lambda: [storage.delete(name) for name in names])
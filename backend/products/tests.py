@@ -1,3 +1,371 @@
-from django.test import TestCase
+import datetime, io, tempfile
+from unittest import mock
+from blobstore.models import Blob
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image as PILImage
+from rest_framework.test import APIRequestFactory, APITestCase
+from user.models import UserAccount
+from . import imaging
+from .imaging import image_processor
+from .models import Product, Image, Interest, LikedProduct, Like
+from .serializers import ProductSerializer
 
-# Create your tests here.
+
+class ProductSerializerEagerLoadingTest(APITestCase):
+
+    def test_relations_come_from_nested_serializers(self):
+        self.assertEqual(ProductSerializer.eager_relations(), (('user',), ('images',)))
+
+
+class LikeTest(APITestCase):
+
+    def setUp(self):
+        self.viewer = UserAccount.objects.create(email='viewer@example.com', username='viewer')
+        self.seller = UserAccount.objects.create(email='seller@example.com', username='seller')
+        self.product = Product.objects.create(
+            user=self.seller, productname='Guitar', purchaseyear=datetime.date(2020, 1, 1),
+            condition='good', category='music',
+        )
+        self.client.force_authenticate(self.viewer)
+
+    def toggle(self, product_id):
+        return self.client.post('/api/products/likeproduct/', {'product_id': product_id}, format='json')
+
+    def test_toggle_keeps_like_count(self):
+        self.assertTrue(self.toggle(self.product.id).data['liked'])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.like_count, 1)
+
+        self.assertFalse(self.toggle(self.product.id).data['liked'])
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.like_count, 0)
+        self.assertFalse(Like.objects.exists())
+
+    def test_listings_carry_the_viewers_likes(self):
+        cache.clear()
+        self.toggle(self.product.id)
+        listing = self.client.get('/api/products/music/').data['results']
+        self.assertEqual((listing[0]['is_liked'], listing[0]['like_count']), (True, 1))
+
+        # The second viewer gets the same cached card, without the first viewer's like
+        self.client.force_authenticate(self.seller)
+        listing = self.client.get('/api/products/music/').data['results']
+        self.assertEqual((listing[0]['is_liked'], listing[0]['like_count']), (False, 1))
+
+        self.client.force_authenticate(self.viewer)
+        liked = self.client.get('/api/products/listlikedproducts/').data
+        self.assertEqual([product['id'] for product in liked['results']], [self.product.id])
+
+    def test_user_products_and_a_single_product_carry_the_viewers_like(self):
+        self.toggle(self.product.id)
+        listing = self.client.get(f'/api/user/{self.seller.id}/products').data
+        self.assertEqual(listing[0]['is_liked'], True)
+
+        request = APIRequestFactory().get('/')
+        request.user = self.viewer
+        with CaptureQueriesContext(connection) as queries:
+            card = ProductSerializer(self.product, context={'request': request}).data
+        self.assertTrue(card['is_liked'])
+        self.assertEqual(sum('products_like' in query['sql'] for query in queries), 1)
+
+    def test_unknown_product(self):
+        self.assertEqual(self.toggle(self.product.id + 100).status_code, 400)
+        self.assertFalse(Like.objects.exists())
+
+    def test_migrate_liked_products(self):
+        LikedProduct.objects.create(user=self.viewer, liked_products=[self.product.id, str(self.product.id), 12345])
+        LikedProduct.objects.create(user=self.seller, liked_products=[self.product.id])
+        call_command('migrate_liked_products', stdout=io.StringIO())
+        call_command('migrate_liked_products', stdout=io.StringIO())
+
+        self.assertEqual(Like.objects.filter(product=self.product).count(), 2)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.like_count, 2)
+
+
+class ProductCardCacheTest(APITestCase):
+
+    def test_hits_and_misses_are_counted(self):
+        from swappynest.profiling import request_stats
+        from .cards import product_cards
+        seller = UserAccount.objects.create(email='seller@example.com', username='seller')
+        for _ in range(2):
+            Product.objects.create(
+                user=seller, productname='Guitar', purchaseyear=datetime.date(2020, 1, 1),
+                condition='good', category='music',
+            )
+        caches[settings.PRODUCT_CARD_CACHE['ALIAS']].clear()
+        product_cards.invalidate(*Product.objects.values_list('id', flat=True))
+        product_cards.reset_stats()
+        request_stats.reset()
+
+        # The profiled requests are logged, assertLogs keeps the lines out of the test output
+        with override_settings(REQUEST_PROFILING=dict(settings.REQUEST_PROFILING, ENABLED=True, SAMPLE_RATE=1)), \
+                self.assertLogs('swappynest.requests', 'INFO') as logged:
+            for _ in range(2):
+                self.client.get('/api/products/music/')
+        self.assertEqual(len(logged.records), 2)
+        self.assertEqual(product_cards.stats(), {'local_hits': 2, 'hits': 0, 'misses': 2, 'hit_rate': 0.5})
+
+        counters = request_stats.summary()['GET api/products/<slug:slug>/']['counters']
+        self.assertEqual(counters, {'product_cards.local_hits': 2, 'product_cards.misses': 2})
+
+
+class RequestProfilingTest(APITestCase):
+
+    def test_server_timing_only_for_staff(self):
+        staff = UserAccount.objects.create(email='staff@example.com', username='staff', is_staff=True)
+        with override_settings(REQUEST_PROFILING=dict(settings.REQUEST_PROFILING, ENABLED=True, SAMPLE_RATE=1)), \
+                self.assertLogs('swappynest.requests', 'INFO'):
+            self.assertNotIn('Server-Timing', self.client.get('/api/products/music/'))
+
+            self.client.force_authenticate(staff)
+            self.assertIn('Server-Timing', self.client.get('/api/products/music/'))
+
+
+class UploadImageTest(APITestCase):
+
+    def setUp(self):
+        self.seller = UserAccount.objects.create(email='seller@example.com', username='seller')
+        self.client.force_authenticate(self.seller)
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, PRODUCT_IMAGES={
+            'SIZES': {'thumbnail': 40, 'card': 80}, 'QUALITY': 85, 'WORKERS': 0,
+        }))
+
+    def photo(self):
+        # A landscape photo taken with the camera on its side, EXIF orientation 6 turns it portrait
+        image = PILImage.new('RGB', (200, 100), (200, 120, 40))
+        exif = PILImage.Exif()
+        exif[0x0112] = 6
+        buffer = io.BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_generates_upright_sizes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/products/uploadproduct/', {
+                'productname': 'Guitar', 'description': 'Acoustic guitar', 'purchaseyear': '2020-01-01',
+                'condition': 'good', 'category': 'music', 'interested_products': '[]',
+                'images': [self.photo(), self.photo()],
+            }, format='multipart')
+        self.assertEqual(response.status_code, 200)
+
+        images = list(Image.objects.all())
+        self.assertEqual(len(images), 2)
+        for image in images:
+            self.assertEqual(set(image.variants), {'thumbnail', 'card'})
+            with image.variant('card').open('rb') as card:
+                self.assertEqual(PILImage.open(card).size, (40, 80))
+
+        # Both uploads are the same photo, so they share their blobs
+        self.assertEqual(images[0].image.name, images[1].image.name)
+        self.assertEqual(images[0].variants, images[1].variants)
+        card = ProductSerializer(Product.objects.all(), many=True).data[0]['images'][0]
+        self.assertEqual(card['card'], f"/media/{images[0].variants['card']}")
+        self.assertNotEqual(card['thumbnail'], card['card'])
+
+    def test_processing_holds_one_reference_per_size(self):
+        product = Product.objects.create(
+            user=self.seller, productname='Guitar', purchaseyear=datetime.date(2020, 1, 1),
+            condition='good', category='music',
+        )
+        image = Image.objects.create(product=product, image=self.photo())
+        image_processor.process(image.id)
+        image_processor.process(image.id)
+        image.refresh_from_db()
+
+        # Another upload of the same photo, deleted while its sizes were rendered: they are released again
+        deleted = Image.objects.create(product=product, image=self.photo())
+        render_sizes = imaging.render_sizes
+
+        def render_and_delete(*args):
+            rendered = render_sizes(*args)
+            deleted.delete()
+            return rendered
+
+        with mock.patch.object(imaging, 'render_sizes', side_effect=render_and_delete), \
+                self.captureOnCommitCallbacks(execute=True):
+            image_processor.process(deleted.id)
+        self.assertEqual(
+            dict(Blob.objects.values_list('name', 'references')),
+            {name: 1 for name in [image.image.name, *image.variants.values()]},
+        )
+
+    def test_requeue_image_variants(self):
+        product = Product.objects.create(
+            user=self.seller, productname='Guitar', purchaseyear=datetime.date(2020, 1, 1),
+            condition='good', category='music',
+        )
+        # Never processed, and processed before the card size was added
+        pending = Image.objects.create(product=product, image=self.photo())
+        outdated = Image.objects.create(product=product, image=self.photo(), variants={'thumbnail': 'products/old.jpg'})
+
+        output = io.StringIO()
+        call_command('requeue_image_variants', '--dry-run', stdout=output)
+        self.assertIn('Would have queued 2 images', output.getvalue())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('requeue_image_variants', stdout=io.StringIO())
+        for image in (pending, outdated):
+            image.refresh_from_db()
+            self.assertEqual(set(image.variants), {'thumbnail', 'card'})
+
+        output = io.StringIO()
+        call_command('requeue_image_variants', '--dry-run', stdout=output)
+        self.assertIn('Would have queued 0 images', output.getvalue())
+
+
+class FeedCacheTest(APITestCase):
+
+    def setUp(self):
+        caches[settings.FEED_CACHE].clear()
+        self.viewer = UserAccount.objects.create(email='viewer@example.com', username='viewer')
+        self.seller = UserAccount.objects.create(email='seller@example.com', username='seller')
+        Interest.objects.create(user=self.viewer, interested_products=['books'])
+        self.client.force_authenticate(self.viewer)
+        for number in range(25):
+            self.add_product(category='books' if number % 3 else 'music')
+
+    def add_product(self, category):
+        return Product.objects.create(
+            user=self.seller, productname='Guitar', purchaseyear=datetime.date(2020, 1, 1),
+            condition='good', category=category,
+        )
+
+    def get(self, page):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/products/listallproduct/?seed=7&page={page}')
+        self.assertEqual(response.status_code, 200)
+        return response.data, [query['sql'] for query in queries]
+
+    def test_pages_reuse_the_cached_count(self):
+        first, _ = self.get(1)
+        second, queries = self.get(2)
+        self.assertEqual(second['count'], 25)
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql])
+        # The general stream is paged in the database, not loaded whole
+        general = [sql for sql in queries if '%' in sql]
+        self.assertEqual(len(general), 1)
+        self.assertIn('LIMIT', general[0])
+
+        third, _ = self.get(3)
+        ids = [product['id'] for page in (first, second, third) for product in page['results']]
+        self.assertEqual(sorted(ids), sorted(Product.objects.values_list('id', flat=True)))
+
+    def test_new_products_invalidate_the_order(self):
+        self.assertEqual(self.get(1)[0]['count'], 25)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.add_product(category='music')
+        self.assertEqual(self.get(1)[0]['count'], 26)
+
+        # The viewer's own products are not in their feed
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(
+                user=self.viewer, productname='Lamp', purchaseyear=datetime.date(2020, 1, 1),
+                condition='good', category='music',
+            )
+        self.assertEqual(self.get(1)[0]['count'], 26)
+
+
+class SearchIndexUpdateTest(APITestCase):
+
+    def setUp(self):
+        index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(index_dir.cleanup)
+        self.enterContext(override_settings(SEARCH_INDEX_DIR=index_dir.name))
+        self.seller = UserAccount.objects.create(email='seller@example.com', username='seller')
+        from .search import search_index
+        self.index = search_index
+        self.index.build([self.add_product('Acoustic guitar')])
+
+    def add_product(self, name):
+        return Product.objects.create(
+            user=self.seller, productname=name, description='', purchaseyear=datetime.date(2020, 1, 1),
+            condition='good', category='music',
+        )
+
+    def test_saves_are_indexed_in_the_background(self):
+        from .search import search_updates
+        with self.captureOnCommitCallbacks(execute=True):
+            product = self.add_product('Electric guitar')
+        search_updates.shutdown()
+        self.assertIn(product.id, self.index.search('electric guitar', limit=5))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            product.delete()
+        search_updates.shutdown()
+        self.assertEqual(len(self.index.search('guitar', limit=5)), 1)
+
+
+class ProductListingQueryCountTest(APITestCase):
+    """
+    Every product listing has to run the same number of queries for a page of 2 products as
+    for a full page, no matter how many images and owners the products have.
+    """
+
+    def setUp(self):
+        self.viewer = UserAccount.objects.create(email='viewer@example.com', username='viewer')
+        self.seller = UserAccount.objects.create(email='seller@example.com', username='seller')
+        Interest.objects.create(user=self.viewer, interested_products=['books'])
+        self.client.force_authenticate(self.viewer)
+        self.index_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.index_dir.cleanup)
+        self.created = 0
+
+    def add_products(self, count):
+        for _ in range(count):
+            self.created += 1
+            owner = UserAccount.objects.create(email=f'owner{self.created}@example.com', username=f'owner{self.created}')
+            for user, category in ((owner, 'books'), (self.seller, 'music')):
+                product = Product.objects.create(
+                    user=user,
+                    productname=f'Guitar {self.created}',
+                    description='Acoustic guitar',
+                    purchaseyear=datetime.date(2020, 1, 1),
+                    condition='good',
+                    category=category,
+                )
+                Image.objects.create(product=product, image=f'products/{self.created}-a.jpg')
+                Image.objects.create(product=product, image=f'products/{self.created}-b.jpg')
+                Like.objects.create(user=self.viewer, product=product)
+
+    def count_queries(self, url):
+        # Feed pools are only invalidated on commit, which never happens inside a test case
+        caches[settings.FEED_CACHE].clear()
+        with override_settings(SEARCH_INDEX_DIR=self.index_dir.name):
+            from .search import search_index
+            search_index.build(Product.objects.all())
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, url):
+        self.add_products(1)
+        small = self.count_queries(url)
+        self.add_products(7)
+        large = self.count_queries(url)
+        self.assertEqual(small, large, f'{url} runs more queries as the page grows')
+
+    def test_list_all_products(self):
+        self.assertConstantQueries('/api/products/listallproduct/')
+
+    def test_list_categorical_products(self):
+        self.assertConstantQueries('/api/products/books/')
+
+    def test_list_liked_products(self):
+        self.assertConstantQueries('/api/products/listlikedproducts/')
+
+    def test_search(self):
+        self.assertConstantQueries('/api/products/search/?q=guitar')
+
+    def test_user_products(self):
+        self.assertConstantQueries(f'/api/user/{self.seller.id}/products')
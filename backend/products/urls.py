@@ -1,11 +1,12 @@
 from django.urls import path
-from .views import UploadProduct, ListAllProduct, ListCategoricalProduct, ProductSearchView, InterestDetailView, LikeProductView, ListLikedProducts
+from .views import UploadProduct, ListAllProduct, ListCategoricalProduct, ProductSearchView, SimilarProductsView, InterestDetailView, LikeProductView, ListLikedProducts
 
 urlpatterns = [
     path('uploadproduct/', UploadProduct.as_view(), name='UploadProduct'),
     path('likeproduct/', LikeProductView.as_view(), name='LikeProductView'),
     path('listlikedproducts/', ListLikedProducts.as_view(), name='LikedProducts'),
     path('search/', ProductSearchView.as_view(), name='ProductSearchView'),
+    path('similar/<int:id>/', SimilarProductsView.as_view(), name='SimilarProductsView'),
     path('listallproduct/', ListAllProduct.as_view(), name='ListAllProduct'),
     path('interest/', InterestDetailView.as_view(), name='interest-detail'), 
     path('<slug:slug>/', ListCategoricalProduct.as_view(), name='ListCategoricalProduct'),
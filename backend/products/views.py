@@ -1,15 +1,19 @@
 from django.shortcuts import render
 from rest_framework.views import APIView
 from rest_framework import permissions
-from .models import Product, Image, Interest, LikedProduct
+from .models import Product, Image, Interest, Like
 from django.contrib.auth.models import AnonymousUser
 from rest_framework.response import Response
 from rest_framework.generics import ListAPIView, RetrieveAPIView
 from .serializers import ProductSerializer, InterestSerializer
-from rest_framework.response import Response
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-import random, json
+from .search import search_index
+from .imaging import image_processor
+from .scoring import fetch_in_order
+from .feed import FeedPagination, RankedFeed, feed_seed
+from swappynest.mixins import EagerLoadingViewMixin
+import json, logging
+
+logger = logging.getLogger(__name__)
 
 
 class UploadProduct(APIView):
@@ -39,10 +43,12 @@ class UploadProduct(APIView):
                 category=category
             )
 
-            # Handle multiple images (get from request.FILES)
-            images = request.FILES.getlist('images')  # Fixed here
-            for image in images:
-                Image.objects.create(product=product, image=image)
+            # Handle multiple images (get from request.FILES), stored in one insert. The sizes
+            # shown in listings are generated in the background once the product is committed.
+            images = Image.objects.bulk_create(
+                Image(product=product, image=image) for image in request.FILES.getlist('images')
+            )
+            image_processor.submit(image.id for image in images)
 
             # Handle the interested products
             try:
@@ -64,8 +70,7 @@ class UploadProduct(APIView):
 
             return Response({'success': 'Your product has been successfully uploaded.'})
         except Exception as e:
-            # Print error message for debugging
-            print("Error:", str(e))
+            logger.exception('Could not upload a product')
             return Response({'error': str(e)}, status=400)
         
 
@@ -89,42 +94,26 @@ class InterestDetailView(RetrieveAPIView):
 
 
 
-class ListAllProduct(ListAPIView):
+class ListAllProduct(EagerLoadingViewMixin, ListAPIView):
     """
-    A view that lists products with a focus on the user's interested products, 
-    with general products included as well. The list is shuffled to provide 
-    variety with every request.
+    A view that lists products with a focus on the user's interested products, with general
+    products mixed in at FEED_INTEREST_RATIO. The user's own products are left out. The order
+    comes from a seed (see products/feed.py) so it stays the same from page to page, and
+    only the rows of the requested page are fetched.
     """
     permission_classes = (permissions.AllowAny, )
+    pagination_class = FeedPagination
 
     def get_queryset(self):
-        # Seed the random number generator for shuffling
-        random.seed(random.random())  
-        current_user = self.request.user
-        print(current_user)
-
-        if current_user.is_authenticated:
-            interested_categories = Interest.objects.filter(user=current_user).values_list('interested_products', flat=True)
-            interested_categories = [category for sublist in interested_categories for category in sublist]
-
-            recommended_products = Product.objects.filter(category__in=interested_categories).exclude(user=current_user)
-            all_products = Product.objects.exclude(user=current_user)            
-            general_products = all_products.exclude(id__in=recommended_products)
-
-            combined_list = list(recommended_products) + list(general_products)
-
-        else:
-            combined_list = list(Product.objects.all())
-
-        random.shuffle(combined_list)
-        return combined_list
+        self.feed_seed = feed_seed(self.request)
+        return RankedFeed(self.request.user, self.feed_seed)
 
     serializer_class = ProductSerializer
 
 
 
 # ListCategoricalProduct class is created to get the products of a single category 
-class ListCategoricalProduct(ListAPIView):
+class ListCategoricalProduct(EagerLoadingViewMixin, ListAPIView):
     # Since the product searching is allowed to all users so, the users are not required to Log In before searching for products
     permission_classes = (permissions.AllowAny, )
     serializer_class = ProductSerializer
@@ -156,43 +145,35 @@ class ProductSearchView(ListAPIView):
         if not search_query:
             return Response({"error": "Query parameter 'q' is required"}, status=400)
 
-        products = Product.objects.all()
-        product_data = [product.productname + " " + product.description for product in products]
+        # The index is normally built by the rebuild_search_index command, build it here on first use otherwise
+        search_index.ensure_built(Product.objects.only('id', 'productname', 'description').iterator())
 
-        # Combine the query and product data for TF-IDF vectorization
-        combined_data = product_data + [search_query]
+        # Get the top 15 most similar products, only the query is vectorized at request time
+        product_ids = search_index.search(search_query, limit=15)
+        top_products = fetch_in_order(ProductSerializer.setup_eager_loading(Product.objects.all()), product_ids)
 
-        # Create the TF-IDF vectorizer and fit it on the combined data
-        vectorizer = TfidfVectorizer(stop_words='english')
-        tfidf_matrix = vectorizer.fit_transform(combined_data)
+        # Serialize the products to return
+        serialized_products = self.get_serializer(top_products, many=True)
 
-        # Separate the query vector (last row) and product vectors (all rows except last)
-        query_vector = tfidf_matrix[-1]
-        product_vectors = tfidf_matrix[:-1]
+        return Response(serialized_products.data[:])
+    
 
-        # Compute cosine similarity between the query vector and product vectors
-        similarities = []
-        for product, product_vector in zip(products, product_vectors):
-            similarity = self.compute_cosine_similarity(query_vector, product_vector)
-            similarities.append((product, similarity))
 
-        # Sort products by similarity score in descending order
-        similarities.sort(key=lambda x: x[1], reverse=True)
 
-        # Get the top 15 most similar products
-        top_products = similarities[:15]
+class SimilarProductsView(APIView):
+    """
+    Products whose name and description are closest to the given product, scored against the search index.
+    """
+    permission_classes = (permissions.AllowAny,)
 
-        # Serialize the products to return
-        serialized_products = self.serializer_class([product for product, _ in top_products], many=True)
+    def get(self, request, id):
+        search_index.ensure_built(Product.objects.only('id', 'productname', 'description').iterator())
 
-        return Response(serialized_products.data[:])
-    
-    def compute_cosine_similarity(self, vec1, vec2):
-        """
-        Computes cosine similarity between two vectors.
-        """
-        return cosine_similarity(vec1, vec2)[0][0]
-    
+        product_ids = search_index.similar(id, limit=10)
+        products = fetch_in_order(ProductSerializer.setup_eager_loading(Product.objects.all()), product_ids)
+        serializer = ProductSerializer(products, many=True, context={'request': request})
+
+        return Response(serializer.data)
 
 
 
@@ -206,50 +187,20 @@ class LikeProductView(APIView):
     def post(self, request):
         try:
             currentuser = request.user
-            product_id = request.data['product_id']
-
-            try:
-                liked_list = LikedProduct.objects.get(user=currentuser)
-                existing_liked_set = set(liked_list.liked_products)
-
-                if product_id in existing_liked_set:
-                    existing_liked_set.remove(product_id)  # If the product is already liked, unlike it
-                    message = "Product unliked successfully."
-                else:
-                    existing_liked_set.add(product_id)  # If the product is not liked, like it
-                    message = "Product liked successfully."
-
-                
-                liked_list.liked_products = sorted(list(existing_liked_set))  # Convert set to list and sort
-                liked_list.save()
+            product_id = int(request.data['product_id'])
 
-            except LikedProduct.DoesNotExist:
-                # If the user does not have a liked products entry, create it
-                LikedProduct.objects.create(user=currentuser, liked_products=[product_id])
-                message = "Product liked successfully."
+            liked = Like.objects.toggle(currentuser, product_id)
+            message = "Product liked successfully." if liked else "Product unliked successfully."
 
-            return Response({'success': message})
+            return Response({'success': message, 'liked': liked})
 
         except Exception as e:
             return Response({'error': str(e)}, status=400)
 
-class ListLikedProducts(ListAPIView):
+class ListLikedProducts(EagerLoadingViewMixin, ListAPIView):
     permission_classes = (permissions.IsAuthenticated, )
     serializer_class = ProductSerializer
-    pagination_class = None
-    
-    def get_queryset(self):
-        currentuser = self.request.user 
-        try:
-            liked_product = LikedProduct.objects.get(user=currentuser)
-            print(liked_product.liked_products)
-
-            product_ids = liked_product.liked_products
-            products = Product.objects.filter(id__in=product_ids)
 
-            return products
-
-        except LikedProduct.DoesNotExist:
-            return Product.objects.none()
-        
-    
\ No newline at end of file
+    def get_queryset(self):
+        # Most recently liked first
+        return Product.objects.filter(likes__user=self.request.user).order_by('-likes__created_at')
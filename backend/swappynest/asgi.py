@@ -3,15 +3,20 @@ from django.core.asgi import get_asgi_application # For default ASGI application
 from channels.routing import ProtocolTypeRouter, URLRouter # ProtocolTypeRouter allows routing based on the protocols such as 'http', 'websocket' etc. And URLRouter is used for route based url patterns (specifically for WebSocket routing)
 from channels.auth import AuthMiddlewareStack # Middleware  for handling authentication in WebSockets
 from chatapp.routing import websocket_urlpatterns
+from chatapp.auth import JWTAuthMiddleware
+from chatapp.metrics import MetricsEndpoint
+from .media import MediaEndpoint
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'swappynest.settings')
 django.setup() 
 
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": MetricsEndpoint(MediaEndpoint(get_asgi_application())), # /metrics and MEDIA_URL are answered here, everything else goes to Django
     "websocket": AuthMiddlewareStack(
-        URLRouter(
-            websocket_urlpatterns
+        JWTAuthMiddleware(  # Clients identify with their access token in ?token=
+            URLRouter(
+                websocket_urlpatterns
+            )
         )
     )
 })
\ No newline at end of file
@@ -0,0 +1,201 @@
+import mimetypes, os, re
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from blobstore.storage import TEMPORARY_PREFIX, is_content_addressed
+
+_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _stat(path):
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+    return stat if os.path.isfile(path) else None
+
+
+def _read(handle, offset, count):
+    handle.seek(offset)
+    return handle.read(count)
+
+
+class MediaFile:
+    """What a request for one file under MEDIA_ROOT needs to know about it."""
+
+    def __init__(self, name, path, stat):
+        self.name = name
+        self.path = path
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.immutable = is_content_addressed(name)
+        if self.immutable:
+            # blobs/ab/<sha-256>.jpg, the digest is the content
+            self.etag = '"%s"' % os.path.splitext(os.path.basename(name))[0]
+        else:
+            self.etag = '"%x-%x"' % (stat.st_mtime_ns, stat.st_size)
+        self.content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    def not_modified(self, headers):
+        if_none_match = headers.get(b'if-none-match')
+        if if_none_match is not None:
+            # Weak comparison, W/"x" matches "x"
+            tags = {tag.strip().removeprefix('W/') for tag in if_none_match.decode('latin-1').split(',')}
+            return '*' in tags or self.etag in tags
+        if_modified_since = headers.get(b'if-modified-since')
+        if if_modified_since is not None:
+            since = parse_http_date_safe(if_modified_since.decode('latin-1'))
+            return since is not None and self.mtime <= since
+        return False
+
+    def byte_range(self, headers):
+        """
+        The (start, end) of a satisfiable single byte range, inclusive, 'unsatisfiable', or None
+        for the whole file. Multiple ranges and stale If-Range validators get the whole file.
+        """
+        value = headers.get(b'range')
+        if value is None or self.size == 0:
+            return None
+        if_range = headers.get(b'if-range')
+        if if_range is not None:
+            if_range = if_range.decode('latin-1').strip()
+            if if_range != self.etag and parse_http_date_safe(if_range) != self.mtime:
+                return None
+        match = _RANGE.match(value.decode('latin-1').strip())
+        if match is None:
+            return None
+        first, last = match.groups()
+        if not first:
+            if not last:
+                return None
+            # bytes=-500 is the last 500 bytes
+            start, end = max(self.size - int(last), 0), self.size - 1
+        else:
+            start = int(first)
+            end = min(int(last), self.size - 1) if last else self.size - 1
+        if start >= self.size or start > end:
+            return 'unsatisfiable'
+        return start, end
+
+    def headers(self):
+        config = settings.MEDIA_SERVING
+        if self.immutable:
+            cache_control = f"public, max-age={config['IMMUTABLE_MAX_AGE']}, immutable"
+        else:
+            cache_control = f"public, max-age={config['MAX_AGE']}"
+        return [
+            (b'etag', self.etag.encode()),
+            (b'last-modified', http_date(self.mtime).encode()),
+            (b'cache-control', cache_control.encode()),
+            (b'accept-ranges', b'bytes'),
+            (b'x-content-type-options', b'nosniff'),
+        ]
+
+
+class MediaEndpoint:
+    """
+    ASGI middleware that serves MEDIA_URL from MEDIA_ROOT and hands every other HTTP request to
+    ``app``, so a single Daphne deployment can serve uploads without going through Django's
+    request cycle or holding a sync thread per download.
+
+    Responses carry an ETag and Last-Modified and answer If-None-Match, If-Modified-Since,
+    Range and If-Range. Content-addressed blobs (see blobstore/storage.py) never change, so
+    they are sent with a far-future immutable Cache-Control and their digest as ETag.
+
+    Bodies go out with the server's ``http.response.zerocopysend`` extension (sendfile) when it
+    offers one, ``http.response.pathsend`` for whole files otherwise, and in
+    MEDIA_SERVING['CHUNK_SIZE'] chunks read off the event loop as the fallback.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        config = settings.MEDIA_SERVING
+        if not config['ENABLED'] or scope['type'] != 'http' or not scope['path'].startswith(settings.MEDIA_URL):
+            return await self.app(scope, receive, send)
+
+        if scope['method'] not in ('GET', 'HEAD'):
+            return await self.respond(send, 405, [(b'allow', b'GET, HEAD')], b'Method Not Allowed\n')
+
+        name = scope['path'][len(settings.MEDIA_URL):]
+        try:
+            path = safe_join(settings.MEDIA_ROOT, name)
+        except SuspiciousFileOperation:
+            path = None
+        # Half-written uploads aren't anyone's to download
+        if path and os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/').startswith(TEMPORARY_PREFIX):
+            path = None
+        stat = await sync_to_async(_stat, thread_sensitive=False)(path) if path and name else None
+        if stat is None:
+            return await self.respond(send, 404, [], b'Not Found\n')
+
+        file = MediaFile(name, path, stat)
+        headers = dict(scope.get('headers', ()))
+        if file.not_modified(headers):
+            return await self.respond(send, 304, file.headers(), None)
+
+        byte_range = file.byte_range(headers)
+        if byte_range == 'unsatisfiable':
+            return await self.respond(send, 416, [(b'content-range', f'bytes */{file.size}'.encode())], b'Range Not Satisfiable\n')
+        if byte_range is None:
+            status, start, count = 200, 0, file.size
+            response_headers = file.headers()
+        else:
+            start, end = byte_range
+            status, count = 206, end - start + 1
+            response_headers = file.headers() + [(b'content-range', f'bytes {start}-{end}/{file.size}'.encode())]
+
+        await send({
+            'type': 'http.response.start',
+            'status': status,
+            'headers': response_headers + [
+                (b'content-type', file.content_type.encode()),
+                (b'content-length', str(count).encode()),
+            ],
+        })
+        if scope['method'] == 'HEAD' or count == 0:
+            return await send({'type': 'http.response.body', 'body': b''})
+        await self.send_file(scope, send, file, start, count, whole=byte_range is None)
+
+    async def send_file(self, scope, send, file, start, count, whole):
+        extensions = scope.get('extensions') or {}
+        if whole and 'http.response.pathsend' in extensions and 'http.response.zerocopysend' not in extensions:
+            return await send({'type': 'http.response.pathsend', 'path': file.path})
+
+        open_file = sync_to_async(open, thread_sensitive=False)
+        handle = await open_file(file.path, 'rb')
+        try:
+            if 'http.response.zerocopysend' in extensions:
+                return await send({
+                    'type': 'http.response.zerocopysend',
+                    'file': handle,
+                    'offset': start,
+                    'count': count,
+                })
+
+            read = sync_to_async(_read, thread_sensitive=False)
+            chunk_size = settings.MEDIA_SERVING['CHUNK_SIZE']
+            offset, remaining = start, count
+            while remaining:
+                chunk = await read(handle, offset, min(chunk_size, remaining))
+                if not chunk:
+                    # The file shrank since it was stat'ed, the response can't be completed
+                    raise OSError(f'{file.path} ended early')
+                offset += len(chunk)
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': bool(remaining)})
+        finally:
+            handle.close()
+
+    async def respond(self, send, status, headers, body):
+        # A body of None is a 304, which describes the file instead of carrying one
+        if body is not None:
+            headers = headers + [
+                (b'content-type', b'text/plain; charset=utf-8'),
+                (b'content-length', str(len(body)).encode()),
+            ]
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body or b''})
@@ -0,0 +1,80 @@
+from django.db.models import QuerySet
+from rest_framework import serializers
+
+
+class EagerLoadingMixin:
+    """
+    Serializer mixin that works out which relations a serializer walks, so a list of
+    objects can be loaded with a fixed number of queries instead of 1 + N per relation.
+
+    Nested serializers over a single object are joined with select_related, nested
+    ``many=True`` serializers and many related fields are prefetched, recursively.
+    ``Meta.select_related`` and ``Meta.prefetch_related`` add anything the fields do not show,
+    e.g. relations used inside a SerializerMethodField.
+    """
+
+    @classmethod
+    def eager_relations(cls):
+        """Return the ``(select_related, prefetch_related)`` lookups of this serializer."""
+        cached = cls.__dict__.get('_eager_relations')
+        if cached is None:
+            select, prefetch = _walk(cls(), '', False)
+            meta = getattr(cls, 'Meta', None)
+            select += [lookup for lookup in getattr(meta, 'select_related', ()) if lookup not in select]
+            prefetch += [lookup for lookup in getattr(meta, 'prefetch_related', ()) if lookup not in prefetch]
+            cached = (tuple(select), tuple(prefetch))
+            cls._eager_relations = cached
+        return cached
+
+    @classmethod
+    def setup_eager_loading(cls, queryset):
+        select, prefetch = cls.eager_relations()
+        if select:
+            queryset = queryset.select_related(*select)
+        if prefetch:
+            queryset = queryset.prefetch_related(*prefetch)
+        return queryset
+
+
+def _walk(serializer, prefix, in_prefetch):
+    select, prefetch = [], []
+    for field in serializer.fields.values():
+        if field.source == '*' or '.' in field.source:
+            continue
+        lookup = prefix + field.source
+
+        if isinstance(field, serializers.ListSerializer):
+            prefetch.append(lookup)
+            child_select, child_prefetch = _walk(field.child, lookup + '__', True)
+            prefetch += child_select + child_prefetch
+        elif isinstance(field, serializers.BaseSerializer):
+            # Below a prefetch the join has to become part of the prefetch as well
+            (prefetch if in_prefetch else select).append(lookup)
+            child_select, child_prefetch = _walk(field, lookup + '__', in_prefetch)
+            select += child_select
+            prefetch += child_prefetch
+        elif isinstance(field, serializers.ManyRelatedField):
+            prefetch.append(lookup)
+    return select, prefetch
+
+
+def eager_load(queryset, serializer_class):
+    """
+    Apply the relation needs of ``serializer_class`` to ``queryset``. Lazy sequences that are
+    not querysets (like the product feed) can expose the queryset they load rows from as ``rows``.
+    """
+    if not hasattr(serializer_class, 'setup_eager_loading'):
+        return queryset
+    if isinstance(queryset, QuerySet):
+        return serializer_class.setup_eager_loading(queryset)
+    if isinstance(getattr(queryset, 'rows', None), QuerySet):
+        queryset.rows = serializer_class.setup_eager_loading(queryset.rows)
+    return queryset
+
+
+class EagerLoadingViewMixin:
+    """Generic view mixin that eager loads whatever the view's serializer needs."""
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        return eager_load(queryset, self.get_serializer_class())
@@ -0,0 +1,228 @@
+import contextvars, json, logging, random, re, threading, time
+from collections import Counter, deque
+from django.conf import settings
+from django.db import connections
+from rest_framework import serializers
+
+logger = logging.getLogger('swappynest.requests')
+
+_current = contextvars.ContextVar('request_profile', default=None)
+
+# Placeholder lists of any length, e.g. the IN (%s, %s, ...) of a prefetch, count as one query shape
+_PLACEHOLDERS = re.compile(r'%s(?:\s*,\s*%s)+')
+
+
+def signature(sql):
+    return _PLACEHOLDERS.sub('%s...', sql)
+
+
+class RequestProfile:
+    """What one sampled request spent its time on."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.sql_time = 0.0
+        self.serializer_time = 0.0
+        self.signatures = Counter()
+        # Named counts that code along the way adds with count(), e.g. cache hits
+        self.counters = Counter()
+        self._serializing = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Database execute wrapper, see django.db.backends.base.base.BaseDatabaseWrapper.execute_wrapper
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.sql_time += time.perf_counter() - start
+            self.queries += 1
+            self.signatures[signature(sql)] += 1
+
+    def duplicates(self, threshold):
+        # The same query shape run again and again in one request is the mark of an N+1
+        return [
+            {'sql': sql if len(sql) <= 300 else f'{sql[:150]} ... {sql[-150:]}', 'count': count}
+            for sql, count in self.signatures.most_common()
+            if count >= threshold
+        ]
+
+
+def count(name, amount=1):
+    """Add ``amount`` to the counter ``name`` of the current request, if it is being sampled."""
+    profile = _current.get()
+    if profile is not None and amount:
+        profile.counters[name] += amount
+
+
+def _timed_data(data):
+    # Wraps Serializer.data / ListSerializer.data, only the outermost serializer is timed
+    def timed(serializer):
+        profile = _current.get()
+        if profile is None or profile._serializing:
+            return data.fget(serializer)
+        profile._serializing += 1
+        start = time.perf_counter()
+        try:
+            return data.fget(serializer)
+        finally:
+            profile.serializer_time += time.perf_counter() - start
+            profile._serializing -= 1
+    return property(timed)
+
+
+_hooks_installed = False
+_hooks_lock = threading.Lock()
+
+
+def install_serializer_hooks():
+    # Patches DRF for the whole process, so it only happens once a request is actually profiled
+    global _hooks_installed
+    with _hooks_lock:
+        if _hooks_installed:
+            return
+        for serializer_class in (serializers.Serializer, serializers.ListSerializer):
+            serializer_class.data = _timed_data(serializer_class.data)
+        _hooks_installed = True
+
+
+def _percentile(ordered, p):
+    return ordered[min(int(p / 100 * len(ordered)), len(ordered) - 1)]
+
+
+class RequestStats:
+    """
+    Rolling, in-process aggregate of the sampled requests per route, over the last
+    REQUEST_PROFILING['WINDOW'] seconds (and at most MAX_SAMPLES requests per route).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def add(self, route, sample):
+        config = settings.REQUEST_PROFILING
+        with self._lock:
+            samples = self._samples.get(route)
+            if samples is None:
+                samples = self._samples[route] = deque(maxlen=config['MAX_SAMPLES'])
+            samples.append((time.monotonic(), sample))
+
+    def reset(self):
+        with self._lock:
+            self._samples = {}
+
+    def summary(self):
+        deadline = time.monotonic() - settings.REQUEST_PROFILING['WINDOW']
+        with self._lock:
+            routes = {
+                route: [sample for recorded, sample in samples if recorded >= deadline]
+                for route, samples in self._samples.items()
+            }
+
+        summary = {}
+        for route, samples in routes.items():
+            if not samples:
+                continue
+            durations = sorted(sample['duration_ms'] for sample in samples)
+            queries = [sample['queries'] for sample in samples]
+            duplicates, counters = Counter(), Counter()
+            for sample in samples:
+                for duplicate in sample['duplicates']:
+                    duplicates[duplicate['sql']] += 1
+                counters.update(sample['counters'])
+            summary[route] = {
+                'requests': len(samples),
+                'duration_ms': {
+                    'p50': round(_percentile(durations, 50), 2),
+                    'p95': round(_percentile(durations, 95), 2),
+                    'max': round(durations[-1], 2),
+                },
+                'queries': {'mean': round(sum(queries) / len(queries), 2), 'max': max(queries)},
+                'sql_ms_mean': round(sum(sample['sql_ms'] for sample in samples) / len(samples), 2),
+                'serializer_ms_mean': round(sum(sample['serializer_ms'] for sample in samples) / len(samples), 2),
+                'response_bytes_mean': round(sum(sample['response_bytes'] or 0 for sample in samples) / len(samples)),
+                # Query shapes that repeated in a request, with the number of requests they repeated in
+                'duplicate_queries': [{'sql': sql, 'requests': count} for sql, count in duplicates.most_common(10)],
+                'counters': dict(sorted(counters.items())),
+            }
+        return dict(sorted(summary.items(), key=lambda item: -item[1]['duration_ms']['p95']))
+
+
+request_stats = RequestStats()
+
+
+class RequestProfilingMiddleware:
+    """
+    Profiles a REQUEST_PROFILING['SAMPLE_RATE'] share of requests: SQL query count and time
+    (through a database execute wrapper, so DEBUG is not needed), repeated query shapes,
+    serializer time, response size and the counters added with count().
+
+    The numbers are logged as one JSON line on the 'swappynest.requests' logger and added to
+    ``request_stats``, which staff can read at /api/metrics/requests/. A sampled response gets a
+    Server-Timing header too, when DEBUG is on or the user is staff: the timings tell anyone
+    else more about the backend than they need to know. Requests that are not sampled only pay
+    for one random() call.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        config = settings.REQUEST_PROFILING
+        if not config['ENABLED'] or random.random() >= config['SAMPLE_RATE']:
+            return self.get_response(request)
+
+        if not _hooks_installed:
+            install_serializer_hooks()
+        profile = RequestProfile()
+        token = _current.set(profile)
+        wrappers = [connection.execute_wrapper(profile) for connection in connections.all()]
+        try:
+            for wrapper in wrappers:
+                wrapper.__enter__()
+            response = self.get_response(request)
+        finally:
+            for wrapper in reversed(wrappers):
+                wrapper.__exit__(None, None, None)
+            _current.reset(token)
+
+        self.record(request, response, profile, config)
+        return response
+
+    @staticmethod
+    def shows_timings(request):
+        # DRF sets request.user once it has authenticated the request, token users included
+        user = getattr(request, 'user', None)
+        return settings.DEBUG or (user is not None and user.is_staff)
+
+    def record(self, request, response, profile, config):
+        duration = (time.perf_counter() - profile.started) * 1000
+        sql = profile.sql_time * 1000
+        serialize = profile.serializer_time * 1000
+        size = None if response.streaming else len(response.content)
+        resolver_match = getattr(request, 'resolver_match', None)
+        route = resolver_match.route if resolver_match is not None else 'unresolved'
+
+        if config['SERVER_TIMING'] and self.shows_timings(request):
+            response['Server-Timing'] = ', '.join([
+                f'db;dur={sql:.2f};desc="{profile.queries} queries"',
+                f'serialize;dur={serialize:.2f}',
+                f'total;dur={duration:.2f}',
+            ])
+
+        sample = {
+            'method': request.method,
+            'route': route,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration, 2),
+            'queries': profile.queries,
+            'sql_ms': round(sql, 2),
+            'duplicates': profile.duplicates(config['DUPLICATE_THRESHOLD']),
+            'serializer_ms': round(serialize, 2),
+            'response_bytes': size,
+            'counters': dict(profile.counters),
+        }
+        logger.info(json.dumps(sample))
+        request_stats.add(f'{request.method} {route}', sample)
@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'chatapp',
     'user',
     'products',
+    'blobstore',
     'rest_framework',
     'rest_framework_simplejwt.token_blacklist',
     'corsheaders',
@@ -75,6 +76,7 @@ CORS_ORIGIN_ALLOW_ALL = True
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'swappynest.profiling.RequestProfilingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -149,6 +151,78 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Write-behind buffer for chat messages (see chatapp/writebehind.py). When enabled, messages are broadcast
+# right away and written in batches of up to BATCH_SIZE, at most MAX_LATENCY seconds after they were sent.
+# Senders wait once MAX_QUEUE messages are waiting to be written.
+CHAT_WRITE_BEHIND = {
+    'ENABLED': os.getenv('CHAT_WRITE_BEHIND', 'false').lower() == 'true',
+    'BATCH_SIZE': 100,
+    'MAX_LATENCY': 0.05,
+    'MAX_QUEUE': 5000,
+}
+
+# Chat-list updates are held for this many seconds and sent as one frame per user with only the
+# latest update of each conversation (see chatapp/coalescer.py). 0 sends every update right away.
+CHAT_LIST_COALESCE_WINDOW = 0.1
+
+# Chat presence (see chatapp/presence.py). A chat socket that sends nothing, heartbeats included,
+# for TTL seconds is dropped; stale sockets are looked for every SWEEP_INTERVAL seconds.
+CHAT_PRESENCE = {
+    'TTL': 60,
+    'SWEEP_INTERVAL': 15,
+}
+
+# A client that keeps typing sends its typing state to the conversation at most once per
+# CHAT_TYPING_DEBOUNCE seconds. Read receipts are collected for CHAT_READ_DEBOUNCE seconds and
+# written as one update.
+CHAT_TYPING_DEBOUNCE = 2.0
+CHAT_READ_DEBOUNCE = 1.0
+
+# Chat database writes that need a transaction run on a dedicated pool of WORKERS threads, each
+# with its own database connection (see chatapp/dbexecutor.py). 0 uses the shared sync_to_async thread.
+CHAT_DB_EXECUTOR = {
+    'WORKERS': int(os.getenv('CHAT_DB_WORKERS', '8')),
+}
+
+# Chat consumer metrics (see chatapp/metrics.py), served by the ASGI app at PATH in the Prometheus
+# text format. With TOKEN set, scrapers have to send it as a bearer token. Without one, PATH
+# only answers while DEBUG is on.
+CHAT_METRICS = {
+    'PATH': '/metrics',
+    'TOKEN': os.getenv('METRICS_TOKEN', ''),
+}
+
+
+# Request profiling (see swappynest/profiling.py), off unless REQUEST_PROFILING=true. SAMPLE_RATE
+# of the requests get their queries, SQL time, repeated query shapes, serializer time and response
+# size recorded and logged on 'swappynest.requests'. With SERVER_TIMING they are also sent back in
+# a Server-Timing header, but only with DEBUG on or to staff users. A query shape repeated
+# DUPLICATE_THRESHOLD times in one request is reported as a likely N+1. Staff can read the
+# per-route aggregate of the last WINDOW seconds at /api/metrics/requests/.
+REQUEST_PROFILING = {
+    'ENABLED': os.getenv('REQUEST_PROFILING', 'false').lower() == 'true',
+    'SAMPLE_RATE': float(os.getenv('REQUEST_PROFILING_SAMPLE_RATE', '0.05')),
+    'SERVER_TIMING': True,
+    'DUPLICATE_THRESHOLD': 5,
+    'WINDOW': 300,
+    'MAX_SAMPLES': 1000,
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'swappynest.requests': {
+            'handlers': ['console'],
+            'level': os.getenv('REQUEST_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
@@ -175,6 +249,82 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# MEDIA_URL is served by the ASGI app (see swappynest/media.py), by default only in DEBUG: in production
+# the proxy in front of it is expected to serve MEDIA_ROOT. Content-addressed blobs are cached for
+# IMMUTABLE_MAX_AGE seconds, other files revalidate after MAX_AGE, and bodies are read in CHUNK_SIZE pieces
+# when the server has no zero-copy send.
+MEDIA_SERVING = {
+    'ENABLED': os.getenv('MEDIA_SERVING', str(DEBUG)).lower() == 'true',
+    'MAX_AGE': 60 * 60,
+    'IMMUTABLE_MAX_AGE': 365 * 24 * 60 * 60,
+    'CHUNK_SIZE': 256 * 1024,
+}
+
+# Uploads are stored once per content under MEDIA_ROOT/blobs/ and reference counted (see blobstore/storage.py)
+STORAGES = {
+    'default': {'BACKEND': 'blobstore.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+
+# Product search index (see products/search.py). It is rebuilt with `manage.py rebuild_search_index`,
+# and saved products are kept in a delta, written by a background thread, that the same thread folds
+# into the index once it grows past the limit.
+SEARCH_INDEX_DIR = os.path.join(BASE_DIR, 'search_index')
+SEARCH_INDEX_DELTA_LIMIT = 1000
+
+# How long (in seconds) a user's product feed keeps the same random order when no seed is passed
+FEED_SEED_PERIOD = 60 * 60
+
+# Feed ranking (see products/feed.py): the share of feed slots given to products from the user's
+# interested categories, the size of each category's cached candidate pool, and how long pools and
+# the size of the rest of the catalog are cached. They are invalidated from any worker, so they
+# live in the shared FEED_CACHE alias.
+FEED_INTEREST_RATIO = 0.6
+FEED_POOL_SIZE = 500
+FEED_POOL_TTL = 10 * 60
+FEED_CACHE = 'product_cards'
+
+# The local memory cache culls the oldest entries past MAX_ENTRIES. Product cards (see products/cards.py)
+# and feed pools are shared between workers, so they go to Redis when REDIS_URL is set.
+REDIS_URL = os.getenv('REDIS_URL')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+        },
+    },
+    'product_cards': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'swappynest',
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'product-cards',
+        'OPTIONS': {
+            'MAX_ENTRIES': 20000,
+        },
+    },
+}
+
+# Serialized product card cache: the cache alias it is stored in, how long cards live there, and
+# the size and lifetime of the in-process LRU in front of it
+PRODUCT_CARD_CACHE = {
+    'ALIAS': 'product_cards',
+    'TIMEOUT': 24 * 60 * 60,
+    'LRU_SIZE': 2048,
+    'LRU_TTL': 30,
+}
+
+# Uploaded product photos (see products/imaging.py): the longest side of every size that is
+# generated, the JPEG quality, and the threads that generate them (0 does it inside the request)
+PRODUCT_IMAGES = {
+    'SIZES': {'thumbnail': 240, 'card': 640, 'large': 1600},
+    'QUALITY': 85,
+    'WORKERS': int(os.getenv('PRODUCT_IMAGE_WORKERS', '2')),
+}
+
 
 
 # Necessary addons for rest framework and jwtauthentication
@@ -0,0 +1,83 @@
+import os, tempfile
+from asgiref.sync import async_to_sync
+from channels.testing import HttpCommunicator
+from channels.testing.application import ApplicationCommunicator
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+from .media import MediaEndpoint
+
+
+async def not_found(scope, receive, send):
+    await send({'type': 'http.response.start', 'status': 404, 'headers': []})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+class MediaEndpointTest(SimpleTestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name, MEDIA_SERVING=dict(settings.MEDIA_SERVING, ENABLED=True)))
+        self.name = 'blobs/ab/ab' + '0' * 62 + '.jpg'
+        os.makedirs(os.path.join(media.name, 'blobs/ab'))
+        with open(os.path.join(media.name, self.name), 'wb') as handle:
+            handle.write(bytes(range(256)) * 4)
+        self.app = MediaEndpoint(not_found)
+
+    def get(self, path, headers=()):
+        communicator = HttpCommunicator(self.app, 'GET', path, headers=[(key.encode(), value.encode()) for key, value in headers])
+        response = async_to_sync(communicator.get_response)()
+        response['headers'] = {key.decode(): value.decode() for key, value in response['headers']}
+        return response
+
+    def test_blobs_are_immutable_and_revalidate(self):
+        response = self.get(f'/media/{self.name}')
+        self.assertEqual(response['status'], 200)
+        self.assertEqual(len(response['body']), 1024)
+        self.assertEqual(response['headers']['content-type'], 'image/jpeg')
+        self.assertIn('immutable', response['headers']['cache-control'])
+
+        etag = response['headers']['etag']
+        response = self.get(f'/media/{self.name}', [('if-none-match', f'W/{etag}')])
+        self.assertEqual((response['status'], response['body']), (304, b''))
+
+    def test_ranges(self):
+        response = self.get(f'/media/{self.name}', [('range', 'bytes=256-259')])
+        self.assertEqual(response['status'], 206)
+        self.assertEqual(response['body'], bytes(range(4)))
+        self.assertEqual(response['headers']['content-range'], 'bytes 256-259/1024')
+
+        response = self.get(f'/media/{self.name}', [('range', 'bytes=-2')])
+        self.assertEqual(response['body'], bytes([254, 255]))
+
+        self.assertEqual(self.get(f'/media/{self.name}', [('range', 'bytes=2000-')])['status'], 416)
+
+    def test_outside_media_root_and_other_paths(self):
+        self.assertEqual(self.get('/media/../settings.py')['status'], 404)
+        self.assertEqual(self.get('/media/blobs/missing.jpg')['status'], 404)
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, 'blobs/tmp'))
+        with open(os.path.join(settings.MEDIA_ROOT, 'blobs/tmp/upload'), 'wb') as handle:
+            handle.write(b'half an upload')
+        self.assertEqual(self.get('/media/blobs/tmp/upload')['status'], 404)
+        self.assertEqual(self.get('/media/blobs/ab/../tmp/upload')['status'], 404)
+        self.assertEqual(self.get('/api/products/')['status'], 404)
+
+    def test_zerocopysend(self):
+        scope = {
+            'type': 'http', 'http_version': '1.1', 'method': 'GET', 'path': f'/media/{self.name}',
+            'query_string': b'', 'headers': [(b'range', b'bytes=10-19')],
+            'extensions': {'http.response.zerocopysend': {}},
+        }
+
+        async def request():
+            communicator = ApplicationCommunicator(self.app, scope)
+            await communicator.send_input({'type': 'http.request', 'body': b''})
+            start = await communicator.receive_output()
+            body = await communicator.receive_output()
+            await communicator.wait()
+            return start, body
+
+        start, body = async_to_sync(request)()
+        self.assertEqual(start['status'], 206)
+        self.assertEqual(body['type'], 'http.response.zerocopysend')
+        self.assertEqual((body['offset'], body['count']), (10, 10))
@@ -1,7 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
-from .views import LogoutView
+from .views import LogoutView, RequestStatsView
 
 urlpatterns = [
     path('api-auth/', include('rest_framework.urls')),
@@ -19,6 +19,8 @@ urlpatterns = [
     path('admin/', admin.site.urls),
 
     path('api/logout/', LogoutView.as_view(), name='Logout'),
+
+    path('api/metrics/requests/', RequestStatsView.as_view(), name='request-stats'),
     
 ]
 
@@ -1,8 +1,11 @@
+from django.conf import settings
 from rest_framework import permissions, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework_simplejwt.exceptions import TokenError
+from products.cards import product_cards
+from .profiling import request_stats
 
 class LogoutView(APIView):
     permission_classes = (permissions.IsAuthenticated, )
@@ -20,4 +23,17 @@ class LogoutView(APIView):
         except TokenError as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class RequestStatsView(APIView):
+    """Rolling per-route request profile of this process, see swappynest/profiling.py, and its product card cache hits."""
+    permission_classes = (permissions.IsAdminUser, )
+
+    def get(self, request):
+        return Response({
+            'sample_rate': settings.REQUEST_PROFILING['SAMPLE_RATE'],
+            'window_seconds': settings.REQUEST_PROFILING['WINDOW'],
+            'routes': request_stats.summary(),
+            'product_cards': product_cards.stats(),
+        })
@@ -1,6 +1,6 @@
 from rest_framework import permissions, status
 from django.shortcuts import get_object_or_404
-from django.core.files.storage import default_storage
+from django.db import transaction
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.views import APIView
 from rest_framework.generics import RetrieveAPIView, ListAPIView
@@ -81,32 +81,34 @@ class UserDetail(APIView):
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def put(self, request, *args, **kwargs):
-        user = self.get_object()
-
-        if not request.user.is_authenticated or request.user != user:
-            raise PermissionDenied(
-                "You are not allowed to update this profile.")
-
         remove_profilephoto = request.data.get(
             'remove_profilephoto', 'false') == 'true'
         profilephoto = request.data.get('profilephoto', None)
 
-        if remove_profilephoto and not profilephoto:  # Remove only if no new photo is provided
-            if user.profilephoto:
-                try:
-                    file_path = user.profilephoto.path
-                    if default_storage.exists(file_path):
-                        default_storage.delete(file_path)
-                    user.profilephoto = None
-                except Exception as e:
-                    return Response({"message": f"Error deleting file: {str(e)}"}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-
-        serializer = UserSerializer(user, data=request.data, partial=True)
-        if serializer.is_valid():
+        # The row is locked so two updates can't both give up the same old photo
+        with transaction.atomic():
+            user = get_object_or_404(User.objects.select_for_update(), id=self.kwargs.get('id'))
+
+            if not request.user.is_authenticated or request.user != user:
+                raise PermissionDenied(
+                    "You are not allowed to update this profile.")
+
+            old_photo = user.profilephoto.name
+
+            if remove_profilephoto and not profilephoto:  # Remove only if no new photo is provided
+                user.profilephoto = None
+
+            serializer = UserSerializer(user, data=request.data, partial=True)
+            if not serializer.is_valid():
+                return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
             serializer.save()
-            return Response(serializer.data, status=status.HTTP_200_OK)
 
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            # A removed or replaced photo drops its reference once the new one is committed
+            if old_photo and user.profilephoto.name != old_photo:
+                storage = user.profilephoto.storage
+                transaction.on_commit(lambda: storage.delete(old_photo))
+
+        return Response(serializer.data, status=status.HTTP_200_OK)
 
 
 class UserProductsView(APIView):
@@ -120,10 +122,10 @@ class UserProductsView(APIView):
         user = get_object_or_404(User, id=id)
 
         # Query products belonging to this user
-        products = Product.objects.filter(user=user)
+        products = ProductSerializer.setup_eager_loading(Product.objects.filter(user=user))
 
-        # Serialize the products
-        serializer = ProductSerializer(products, many=True)
+        # Serialize the products, with the viewer's likes
+        serializer = ProductSerializer(products, many=True, context={'request': request})
 
         return Response(serializer.data, status=status.HTTP_200_OK)
 
@@ -9,6 +9,7 @@ import {
   ListItemAvatar,
   Paper,
   CircularProgress,
+  Button,
 } from "@mui/material"
 import ChatBox from "./Chatbox"
 import { useAuth } from "../context/authContext"
@@ -22,8 +23,15 @@ const ChatList = () => {
   const [selectedChat, setSelectedChat] = useState(null)
   const [conversations, setConversations] = useState([])
   const [loading, setLoading] = useState(true)
+  // The list is paginated, most recently active first; this is the URL of the next page if there is one
+  const [nextPage, setNextPage] = useState(null)
   const socketRef = useRef(null)
 
+  const withOtherParticipant = (chat) => ({
+    ...chat,
+    otherParticipant: chat.participants.find((user) => user.id !== userData.id),
+  })
+
   useEffect(() => {
     if (isAuth && userData) {
       const token = localStorage.getItem("access_token")
@@ -36,11 +44,8 @@ const ChatList = () => {
         })
           .then((response) => response.json())
           .then((data) => {
-            const filteredChats = data.map((chat) => {
-              const otherParticipant = chat.participants.find((user) => user.id !== userData.id)
-              return { ...chat, otherParticipant }
-            })
-            setConversations(filteredChats)
+            setConversations((data.results || data).map(withOtherParticipant))
+            setNextPage(data.next || null)
             setLoading(false)
           })
           .catch((error) => {
@@ -56,6 +61,8 @@ const ChatList = () => {
           const data = JSON.parse(event.data)
           if (data.type === "update_conversation") {
             updateConversation(data.conversation)
+          } else if (data.type === "update_conversations") {
+            data.conversations.forEach(updateConversation)
           }
         }
 
@@ -93,6 +100,27 @@ const ChatList = () => {
     })
   }
 
+  const fetchMoreConversations = () => {
+    const token = localStorage.getItem("access_token")
+    fetch(nextPage, {
+      headers: {
+        Authorization: `Bearer ${token}`,
+      },
+    })
+      .then((response) => response.json())
+      .then((data) => {
+        setConversations((prevConversations) => {
+          // A live update may already have moved a conversation of this page to the top
+          const known = new Set(prevConversations.map((conv) => conv.id))
+          return [...prevConversations, ...data.results.filter((chat) => !known.has(chat.id)).map(withOtherParticipant)]
+        })
+        setNextPage(data.next)
+      })
+      .catch((error) => {
+        console.error("Error fetching conversations:", error)
+      })
+  }
+
   const getLastMessagePreview = (lastMessage) => {
     if (!lastMessage) return "No messages yet"
 
@@ -161,6 +189,11 @@ const ChatList = () => {
                 </ListItem>
               )
             })}
+            {nextPage && (
+              <ListItem sx={{ justifyContent: "center" }}>
+                <Button onClick={fetchMoreConversations}>Load more</Button>
+              </ListItem>
+            )}
           </List>
         )}
       </Paper>
@@ -1,4 +1,4 @@
-import { useState, useEffect, useRef, useCallback } from "react"
+import { useState, useEffect, useLayoutEffect, useRef, useCallback } from "react"
 import {
   Box,
   Typography,
@@ -36,6 +36,13 @@ const ChatBox = ({ chat, onClose }) => {
   const [selectedModalProduct, setSelectedModalProduct] = useState(null)
   const [connectionError, setConnectionError] = useState(false)
   const reconnectTimeoutRef = useRef(null)
+  const heartbeatRef = useRef(null)
+  // Cursor of the next, older page of history, null once the first message is loaded
+  const [nextPage, setNextPage] = useState(null)
+  const messagesContainerRef = useRef(null)
+  const loadingOlderRef = useRef(false)
+  // Scroll height before older messages were prepended, to keep the same messages in view
+  const prependedFromRef = useRef(null)
 
   const scrollToBottom = useCallback(() => {
     if (messagesEndRef.current) {
@@ -58,17 +65,32 @@ const ChatBox = ({ chat, onClose }) => {
       .map((p) => p.id)
       .sort()
       .join("_")
-    const ws = new WebSocket(`ws://localhost:8000/ws/chat/conversation_${participantIds}/`)
+    // The access token identifies this user to the socket, for presence, typing and read receipts
+    const token = localStorage.getItem("access_token")
+    const ws = new WebSocket(`ws://localhost:8000/ws/chat/conversation_${participantIds}/?token=${encodeURIComponent(token)}`)
     socketRef.current = ws
 
     ws.onopen = () => {
 
       setConnectionError(false)
+      // Keeps this user shown as online, the server drops sockets that stay silent for a minute
+      ws.send(JSON.stringify({ type: "heartbeat" }))
+      ws.send(JSON.stringify({ type: "read" }))
+      heartbeatRef.current = setInterval(() => {
+        if (ws.readyState === WebSocket.OPEN) {
+          ws.send(JSON.stringify({ type: "heartbeat" }))
+        }
+      }, 20000)
     }
 
     ws.onmessage = (event) => {
 
       const data = JSON.parse(event.data)
+      // Presence, typing and read receipt events aren't shown yet
+      if (data.type) return
+      if (data.sender_id !== userData.id) {
+        ws.send(JSON.stringify({ type: "read" }))
+      }
       setMessages((prevMessages) => {
         const messageExists = prevMessages.some((msg) => msg.id === data.id)
         if (!messageExists) {
@@ -86,6 +108,7 @@ const ChatBox = ({ chat, onClose }) => {
     }
 
     ws.onclose = (event) => {
+      clearInterval(heartbeatRef.current)
 
       if (!event.wasClean) {
         setConnectionError(true)
@@ -104,12 +127,14 @@ const ChatBox = ({ chat, onClose }) => {
   useEffect(() => {
     if (chat && chat.id) {
       setLoading(true);
+      setNextPage(null);
 
       axios.get(`http://localhost:8000/api/chatapp/conversations/${chat.id}/messages/`)
         .then((response) => {
-          // Axios automatically parses JSON, so we can use response.data directly
-          const data = response.data;
+          // Axios automatically parses JSON. History is paginated newest first, the sort below puts it back in order
+          const data = response.data.results || response.data;
           setMessages(data.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp)));
+          setNextPage(response.data.next || null);
           setLoading(false);
           setTimeout(scrollToBottom, 100); // Scroll after the messages are rendered
         })
@@ -137,6 +162,43 @@ const ChatBox = ({ chat, onClose }) => {
     scrollToBottom()
   }, [scrollToBottom])
 
+  useLayoutEffect(() => {
+    const container = messagesContainerRef.current
+    if (container && prependedFromRef.current !== null) {
+      container.scrollTop += container.scrollHeight - prependedFromRef.current
+      prependedFromRef.current = null
+    }
+  }, [messages])
+
+  const fetchOlderMessages = () => {
+    if (!nextPage || loadingOlderRef.current) return
+    loadingOlderRef.current = true
+
+    axios.get(nextPage)
+      .then((response) => {
+        const older = response.data.results.sort((a, b) => new Date(a.timestamp) - new Date(b.timestamp))
+        prependedFromRef.current = messagesContainerRef.current ? messagesContainerRef.current.scrollHeight : null
+        setMessages((prevMessages) => {
+          const known = new Set(prevMessages.map((msg) => msg.id))
+          return [...older.filter((msg) => !known.has(msg.id)), ...prevMessages]
+        })
+        setNextPage(response.data.next)
+      })
+      .catch((error) => {
+        console.error("Error fetching older messages:", error)
+      })
+      .finally(() => {
+        loadingOlderRef.current = false
+      })
+  }
+
+  const handleMessagesScroll = (event) => {
+    // Load the previous page when the user scrolls up to the oldest loaded message
+    if (event.currentTarget.scrollTop < 50) {
+      fetchOlderMessages()
+    }
+  }
+
   const handleSendMessage = async () => {
     if (newMessage.trim() && socketRef.current && socketRef.current.readyState === WebSocket.OPEN) {
       setSending(true)
@@ -254,7 +316,11 @@ const ChatBox = ({ chat, onClose }) => {
           </IconButton>
         </Box>
 
-        <Box sx={{ flex: 1, overflowY: "auto", p: 2, backgroundColor: "#f9f9f9" }}>
+        <Box
+          ref={messagesContainerRef}
+          onScroll={handleMessagesScroll}
+          sx={{ flex: 1, overflowY: "auto", p: 2, backgroundColor: "#f9f9f9" }}
+        >
           {loading ? (
             <CircularProgress sx={{ margin: "auto", display: "block" }} />
           ) : (
@@ -23,7 +23,7 @@ export default function Feed({ initialProducts = [], searchQuery, categorySlug }
   const loader = useRef(null)
   const observer = useRef(null)
   const [swapOfferModalOpen, setSwapOfferModalOpen] = useState(false)
-  const { likedProducts, toggleLike } = useLikedProducts()
+  const { isLiked, toggleLike } = useLikedProducts()
 
   const handleOpenSwapOffer = (product) => {
     setSelectedProduct(product)
@@ -140,7 +140,7 @@ export default function Feed({ initialProducts = [], searchQuery, categorySlug }
             sx={{
               height: "100%",
               bgcolor: "grey.300",
-              backgroundImage: `url(${getFullImageUrl(images[0].image)})`,
+              backgroundImage: `url(${getFullImageUrl(images[0].card)})`,
               backgroundSize: "cover",
               backgroundPosition: "center",
             }}
@@ -161,7 +161,7 @@ export default function Feed({ initialProducts = [], searchQuery, categorySlug }
               sx={{
                 height: "100%",
                 bgcolor: "grey.300",
-                backgroundImage: `url(${getFullImageUrl(img.image)})`,
+                backgroundImage: `url(${getFullImageUrl(img.card)})`,
                 backgroundSize: "cover",
                 backgroundPosition: "center",
               }}
@@ -180,7 +180,7 @@ export default function Feed({ initialProducts = [], searchQuery, categorySlug }
           sx={{
             gridRow: "span 2",
             bgcolor: "grey.300",
-            backgroundImage: `url(${getFullImageUrl(images[0].image)})`,
+            backgroundImage: `url(${getFullImageUrl(images[0].card)})`,
             backgroundSize: "cover",
             backgroundPosition: "center",
           }}
@@ -188,7 +188,7 @@ export default function Feed({ initialProducts = [], searchQuery, categorySlug }
         <Box
           sx={{
             bgcolor: "grey.300",
-            backgroundImage: `url(${getFullImageUrl(images[1].image)})`,
+            backgroundImage: `url(${getFullImageUrl(images[1].card)})`,
             backgroundSize: "cover",
             backgroundPosition: "center",
           }}
@@ -197,7 +197,7 @@ export default function Feed({ initialProducts = [], searchQuery, categorySlug }
           sx={{
             position: "relative",
             bgcolor: "grey.300",
-            backgroundImage: `url(${getFullImageUrl(images[2].image)})`,
+            backgroundImage: `url(${getFullImageUrl(images[2].card)})`,
             backgroundSize: "cover",
             backgroundPosition: "center",
           }}
@@ -379,7 +379,7 @@ export default function Feed({ initialProducts = [], searchQuery, categorySlug }
                     },
                   }}
                 >
-                  {likedProducts.some((likedProduct) => likedProduct.id === product.id) ? (
+                  {isLiked(product) ? (
                     <Favorite style={{ fill: "currentColor", stroke: "currentColor", strokeWidth: 2 }} />
                   ) : (
                     <FavoriteBorder />
@@ -459,7 +459,7 @@ export default function Feed({ initialProducts = [], searchQuery, categorySlug }
               condition: selectedProduct.condition,
               purchaseYear: selectedProduct.purchaseyear,
               description: selectedProduct.description,
-              images: selectedProduct.images.map((img) => getFullImageUrl(img.image)),
+              images: selectedProduct.images.map((img) => getFullImageUrl(img.large)),
               uploadedBy: selectedProduct.user.username,
               userProfilePic: selectedProduct.user.profilephoto
                 ? getFullImageUrl(selectedProduct.user.profilephoto)
@@ -11,6 +11,7 @@ import {
   Typography,
   Box,
   CircularProgress,
+  Button,
 } from "@mui/material"
 import { Close } from "@mui/icons-material"
 import axios from "axios"
@@ -23,6 +24,8 @@ export default function LikedPostsModal({ open, onClose }) {
   const [selectedProduct, setSelectedProduct] = useState(null)
   const [productModalOpen, setProductModalOpen] = useState(false)
   const [loading, setLoading] = useState(false)
+  // The list is paginated, this is the URL of the next page if there is one
+  const [nextPage, setNextPage] = useState(null)
 
   useEffect(() => {
     if (open) {
@@ -34,7 +37,8 @@ export default function LikedPostsModal({ open, onClose }) {
     setLoading(true)
     try {
       const response = await axios.get(`${BASE_URL}/api/products/listlikedproducts/`)
-      setLikedProducts(response.data || [])
+      setLikedProducts(response.data.results || [])
+      setNextPage(response.data.next)
     } catch (error) {
       console.error("Error fetching liked products:", error)
     } finally {
@@ -42,6 +46,16 @@ export default function LikedPostsModal({ open, onClose }) {
     }
   }
 
+  const fetchMoreLikedProducts = async () => {
+    try {
+      const response = await axios.get(nextPage)
+      setLikedProducts((products) => [...products, ...response.data.results])
+      setNextPage(response.data.next)
+    } catch (error) {
+      console.error("Error fetching liked products:", error)
+    }
+  }
+
   const handleProductClick = (product) => {
     setSelectedProduct(product)
     setProductModalOpen(true)
@@ -113,7 +127,7 @@ export default function LikedPostsModal({ open, onClose }) {
                     <CardMedia
                       component="img"
                       height="200"
-                      image={product.images[0]?.image || "/placeholder.svg?height=200&width=250"}
+                      image={product.images[0]?.card || "/placeholder.svg?height=200&width=250"}
                       alt={product.productname}
                     />
                     <CardContent
@@ -135,6 +149,11 @@ export default function LikedPostsModal({ open, onClose }) {
                   </Card>
                 </Grid>
               ))}
+              {nextPage && (
+                <Grid item xs={12} display="flex" justifyContent="center">
+                  <Button onClick={fetchMoreLikedProducts}>Load more</Button>
+                </Grid>
+              )}
             </Grid>
           )}
         </DialogContent>
@@ -152,7 +171,7 @@ export default function LikedPostsModal({ open, onClose }) {
               condition: selectedProduct.condition,
               purchaseYear: selectedProduct.purchaseyear,
               description: selectedProduct.description,
-              images: selectedProduct.images.map((img) => img.image),
+              images: selectedProduct.images.map((img) => img.large),
               uploadedBy: selectedProduct.user.username,
               userId: selectedProduct.user.id,
               userProfilePic: selectedProduct.user.profilephoto,
@@ -11,7 +11,7 @@ import { useLikedProducts } from "../context/likedProductsContext"
 export default function ProductModal({ open, onClose, product }) {
   const [swapOfferModalOpen, setSwapOfferModalOpen] = useState(false)
   const { isAuth, userData } = useAuth()
-  const { likedProducts, toggleLike } = useLikedProducts();
+  const { isLiked, toggleLike } = useLikedProducts();
 
   const responsive = {
     desktop: {
@@ -274,7 +274,7 @@ export default function ProductModal({ open, onClose, product }) {
                       },
                     }}
                   >
-                    {likedProducts.some((likedProduct) => likedProduct.id === product.id) ? (
+                    {isLiked(product) ? (
                       <Favorite style={{ fill: "currentColor", stroke: "currentColor", strokeWidth: 2 }} />
                     ) : (
                       <FavoriteBorder />
@@ -363,7 +363,7 @@ export default function Profile() {
                         height="200"
                         image={
                           product.images[0]
-                            ? `${BASE_URL}${product.images[0].image}`
+                            ? `${BASE_URL}${product.images[0].card}`
                             : "/placeholder.svg?height=200&width=250"
                         }
                         alt={product.productname}
@@ -561,7 +561,7 @@ export default function Profile() {
               condition: selectedProduct.condition,
               purchaseYear: selectedProduct.purchaseyear,
               description: selectedProduct.description,
-              images: selectedProduct.images.map((img) => `${BASE_URL}${img.image}`),
+              images: selectedProduct.images.map((img) => `${BASE_URL}${img.large}`),
               uploadedBy: user.username,
               userId: user.id,
               userProfilePic: user.profilephoto
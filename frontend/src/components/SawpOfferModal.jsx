@@ -61,7 +61,7 @@ const SwapOfferModal = ({ isOpen, onClose, selectedProduct }) => {
       name: product.productname,
       condition: product.condition,
       purchaseYear: product.purchaseyear,
-      images: product.images.map((img) => getFullImageUrl(img.image)),
+      images: product.images.map((img) => getFullImageUrl(img.large)),
       description: product.description || "No description provided",
       uploadDate: product.created_at || "Not Provided",
       uploadedBy: userData.username,
@@ -105,7 +105,7 @@ const SwapOfferModal = ({ isOpen, onClose, selectedProduct }) => {
             purchaseYear: product.purchaseyear,
             description: product.description,
             uploadDate: product.created_at,
-            image: getFullImageUrl(product.images[0]?.image),
+            image: getFullImageUrl(product.images[0]?.thumbnail),
           },
         })
         sendMessage(productMessage)
@@ -124,7 +124,7 @@ const SwapOfferModal = ({ isOpen, onClose, selectedProduct }) => {
           purchaseYear: selectedProduct.purchaseyear,
           description: selectedProduct.description,
           uploadDate: selectedProduct.created_at,
-          image: getFullImageUrl(selectedProduct.images[0]?.image),
+          image: getFullImageUrl(selectedProduct.images[0]?.thumbnail),
           owner: {
             id: selectedProduct.user.id, // ✅ Include receiver's user ID
             username: selectedProduct.user.username, // ✅ Include receiver's username
@@ -223,7 +223,7 @@ const SwapOfferModal = ({ isOpen, onClose, selectedProduct }) => {
                     <CardMedia
                       component="img"
                       height="140"
-                      image={getFullImageUrl(product.images[0]?.image)}
+                      image={getFullImageUrl(product.images[0]?.thumbnail)}
                       alt={product.productname}
                     />
                     <CardContent
@@ -8,36 +8,15 @@ const LikedProductsContext = createContext()
 
 export const LikedProductsProvider = ({ children }) => {
   const { isAuth, getAccessToken } = useAuth()
-  const [likedProducts, setLikedProducts] = useState([])
+  // Listings carry is_liked for the current user, this only holds the toggles made since
+  const [likeOverrides, setLikeOverrides] = useState({})
 
   useEffect(() => {
-    if (isAuth) {
-      fetchLikedProducts()
-    } else {
-      // Reset liked products when not authenticated
-      setLikedProducts([])
-    }
+    // Reset the toggles whenever the user changes
+    setLikeOverrides({})
   }, [isAuth])
 
-  const fetchLikedProducts = async () => {
-    try {
-      const token = getAccessToken()
-      if (!token) {
-        console.error("No access token available")
-        return
-      }
-
-      const response = await axios.get("http://localhost:8000/api/products/listlikedproducts/", {
-        headers: {
-          Authorization: `Bearer ${token}`,
-        },
-      })
-      setLikedProducts(response.data)
-    } catch (error) {
-      console.error("Error fetching liked products:", error)
-      // If token expired, the interceptor in authContext should handle refresh
-    }
-  }
+  const isLiked = (product) => likeOverrides[product.id] ?? Boolean(product.is_liked)
 
   const toggleLike = async (productId) => {
     try {
@@ -56,7 +35,7 @@ export const LikedProductsProvider = ({ children }) => {
           },
         },
       )
-      fetchLikedProducts()
+      setLikeOverrides((overrides) => ({ ...overrides, [productId]: response.data.liked }))
       return response.data.success
     } catch (error) {
       console.error("Error toggling like:", error)
@@ -65,7 +44,7 @@ export const LikedProductsProvider = ({ children }) => {
   }
 
   return (
-    <LikedProductsContext.Provider value={{ likedProducts, toggleLike, fetchLikedProducts }}>
+    <LikedProductsContext.Provider value={{ isLiked, toggleLike }}>
       {children}
     </LikedProductsContext.Provider>
   )